@@ -22,6 +22,13 @@ COMMANDS = [
     "rm",
     "add",
     "commit",
+    "repack",
+    "gc",
+    "multi_pack_index",
+    "commit_graph",
+    "rev_list",
+    "fsmonitor_daemon",
+    "update_index",
 ]
 
 
@@ -52,4 +59,4 @@ def load_commands(subparsers: argparse._SubParsersAction):
 def main(argv=sys.argv[1:]):
     parser = build_parser()
     args = parser.parse_args(argv)
-    args.func(args)
+    return args.func(args)
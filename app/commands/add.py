@@ -1,31 +1,92 @@
 import os
 from argparse import _SubParsersAction
-from typing import List, Set
+from typing import List, Optional, Set
 
-from app.objects import GitBlob
 from app.repository import GitIgnore, GitIndex, GitIndexEntry, GitRepository
+from app.repository.blobs import write_blobs
+from app.repository.index import GitIndexLock
+from app.repository.worktree import refresh_fsmonitor
 
 from .command import cmd
 
 
 def setup_parser(subparsers: _SubParsersAction) -> None:
     parser = subparsers.add_parser("add", help="Add file contents to the index")
-    parser.add_argument("path", nargs="+", help="Files to add")
+    parser.add_argument("path", nargs="*", help="Files to add")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "-u",
+        "--update",
+        dest="update",
+        action="store_true",
+        help="Stage modified and deleted tracked files, but no new files",
+    )
+    mode.add_argument(
+        "-A",
+        "--all",
+        dest="all_files",
+        action="store_true",
+        help="Stage modified, deleted and new files",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of workers hashing and compressing files (default: all cores)",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Use worker processes instead of threads",
+    )
     parser.set_defaults(func=cmd_add)
 
 
 @cmd(req_repo=True)
 def cmd_add(args, repo: GitRepository) -> None:
-    add(repo, args.path)
-
-
-def add(repo: GitRepository, paths: List[str], skip_missing=False):
+    if not args.path and not (args.update or args.all_files):
+        raise Exception("Nothing specified, nothing added.")
+
+    # Held from reading the index until the new one is in place
+    with GitIndexLock(repo) as lock:
+        add(
+            repo,
+            args.path,
+            jobs=args.jobs,
+            processes=args.processes,
+            update=args.update,
+            all_files=args.all_files,
+            lock=lock,
+        )
+
+
+def add(
+    repo: GitRepository,
+    paths: List[str],
+    skip_missing=False,
+    jobs: Optional[int] = None,
+    processes: bool = False,
+    update: bool = False,
+    all_files: bool = False,
+    lock: Optional[GitIndexLock] = None,
+):
     files_to_add: Set[str] = set()
+    files_to_remove: Set[str] = set()
 
     ignore = GitIgnore.read(repo)
+    index = GitIndex.read(repo)
+
+    fsmonitor_changed = False
+    if update or all_files:
+        fsmonitor_changed = refresh_fsmonitor(repo, index)
+
+    if not paths:
+        # -u and -A without a pathspec cover the whole tree
+        paths = [repo.worktree]
 
     for path in paths:
-        abspath = os.path.realpath(path)
+        abspath = resolve_path(path)
 
         if os.path.commonpath([abspath, repo.worktree]) != repo.worktree:
             raise Exception(f"path is outside of worktree: {path}")
@@ -33,59 +94,82 @@ def add(repo: GitRepository, paths: List[str], skip_missing=False):
         if abspath.startswith(repo.gitdir):
             raise Exception(f"pathspec '{path}' did not match any files")
 
-        if os.path.isdir(abspath):
+        matched = False
+        if update or all_files:
+            # Tracked files are found through the index instead of a full walk
+            prefix = os.path.relpath(abspath, repo.worktree)
+            for i, name in enumerate(index.names):
+                if prefix != "." and not (
+                    name == prefix or name.startswith(prefix + "/")
+                ):
+                    continue
+                matched = True
+                if index.mode_type(i) == 0b1110 or index.fsmonitor_valid(i):
+                    # Submodules are not updated by add, and files the
+                    # filesystem monitor saw no change to need no check
+                    continue
+                full_path = os.path.join(repo.worktree, name)
+                if os.path.isfile(full_path) or os.path.islink(full_path):
+                    files_to_add.add(full_path)
+                else:
+                    files_to_remove.add(name)
+
+            if update:
+                if not matched and not skip_missing:
+                    raise Exception(f"pathspec '{path}' did not match any files")
+                continue
+
+        if os.path.isdir(abspath) and not os.path.islink(abspath):
             for root, dirs, files in os.walk(abspath):
                 if ".git" in dirs:
                     dirs.remove(".git")
-                for file in files:
+                # Links to directories are not followed, but added as links
+                links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+                for file in files + links:
                     full_path = os.path.join(root, file)
                     relpath = os.path.relpath(full_path, repo.worktree)
 
                     if not ignore.check_ignore(relpath):
                         files_to_add.add(full_path)
-        elif os.path.isfile(abspath):
+        elif os.path.isfile(abspath) or os.path.islink(abspath):
             relpath = os.path.relpath(abspath, repo.worktree)
             if not ignore.check_ignore(relpath):
                 files_to_add.add(abspath)
-        elif not skip_missing:
+        elif not matched and not skip_missing:
             raise Exception(f"path does not exist: {path}")
 
-    index = GitIndex.read(repo)
-
-    entry_map = {entry.name: i for i, entry in enumerate(index.entries)}
-
-    for abspath in files_to_add:
-        relpath = os.path.relpath(abspath, repo.worktree)
-
-        with open(abspath, "rb") as f:
-            data = f.read()
-
-            obj = GitBlob.deserialize(data)
-
-            sha = repo.objects.write(obj)
-
-            stat = os.stat(abspath)
-
-            new_entry = GitIndexEntry(
-                ctime=(int(stat.st_ctime), stat.st_ctime_ns % 10**9),
-                mtime=(int(stat.st_mtime), stat.st_mtime_ns % 10**9),
-                dev=stat.st_dev,
-                ino=stat.st_ino,
-                mode_type=0b1000,
-                mode_perms=0o644,
-                uid=stat.st_uid,
-                gid=stat.st_gid,
-                fsize=stat.st_size,
-                sha=sha,
-                assume_valid=False,
-                stage=0,
-                name=relpath,
-            )
-
-            if relpath in entry_map:
-                index.entries[entry_map[relpath]] = new_entry
-            else:
-                index.entries.append(new_entry)
-
-    index.entries.sort(key=lambda x: x.name)
-    index.write(repo)
+    # Files whose stat data still matches their entry are known to be unchanged,
+    # unless they were modified too close to the last index write to tell
+    changed: List[str] = []
+    for abspath in sorted(files_to_add):
+        found = index.find(os.path.relpath(abspath, repo.worktree))
+        if found is not None:
+            unchanged = index.matches_stat(found, os.lstat(abspath))
+            if unchanged and not index.is_racy(index.times(found)[1]):
+                continue
+        changed.append(abspath)
+
+    if not changed and not files_to_remove:
+        if fsmonitor_changed:
+            index.write(repo, lock)
+        return
+
+    blobs = write_blobs(repo, changed, jobs=jobs, processes=processes)
+
+    index.update(
+        GitIndexEntry.from_stat(os.path.relpath(abspath, repo.worktree), sha, stat)
+        for abspath, (sha, stat) in zip(changed, blobs)
+    )
+    if files_to_remove:
+        index.remove(files_to_remove)
+
+    index.write(repo, lock)
+
+
+def resolve_path(path: str) -> str:
+    # Only the directories leading to the path are resolved, so that a
+    # symbolic link is added as a link rather than as what it points to
+    path = os.path.abspath(path)
+    return os.path.join(
+        os.path.realpath(os.path.dirname(path)), os.path.basename(path)
+    )
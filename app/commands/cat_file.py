@@ -1,34 +1,153 @@
 import sys
 from argparse import _SubParsersAction
+from typing import Optional
 
+from app.cli import logger
 from app.objects import GitObject
 from app.repository import GitRepository
 
 from .command import cmd
 
+OBJECT_TYPES = ["blob", "commit", "tag", "tree"]
+
 
 def setup_parser(subparsers: _SubParsersAction) -> None:
     parser = subparsers.add_parser("cat-file", help="Cat the content of an object")
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "-t",
+        dest="mode",
+        action="store_const",
+        const="type",
+        help="Show the object type",
+    )
+    mode.add_argument(
+        "-s",
+        dest="mode",
+        action="store_const",
+        const="size",
+        help="Show the object size",
+    )
+    mode.add_argument(
+        "-e",
+        dest="mode",
+        action="store_const",
+        const="exists",
+        help="Exit with zero status if the object exists and is valid",
+    )
+    mode.add_argument(
+        "--batch",
+        dest="mode",
+        action="store_const",
+        const="batch",
+        help="Print type, size and contents of each object named on stdin",
+    )
+    mode.add_argument(
+        "--batch-check",
+        dest="mode",
+        action="store_const",
+        const="batch-check",
+        help="Print type and size of each object named on stdin",
+    )
+    parser.add_argument(
+        "--buffer",
+        action="store_true",
+        help="Do not flush output after each object in batch modes",
+    )
+
     parser.add_argument(
         "type",
         metavar="type",
-        choices=["blob", "commit", "tag", "tree"],
-        help="Specify the object type",
+        nargs="?",
+        help=f"Specify the object type ({', '.join(OBJECT_TYPES)})",
     )
-    parser.add_argument("object", metavar="object", help="Object to display")
+    parser.add_argument("object", metavar="object", nargs="?", help="Object to display")
     parser.set_defaults(func=cmd_cat_file)
 
 
 @cmd(req_repo=True)
-def cmd_cat_file(args, repo) -> None:
+def cmd_cat_file(args, repo) -> Optional[int]:
+    if args.mode in ("batch", "batch-check"):
+        if args.type is not None:
+            raise Exception(f"cat-file --{args.mode} does not take arguments")
+        cat_file_batch(repo, contents=args.mode == "batch", buffer=args.buffer)
+        return None
+
+    if args.mode is not None:
+        if args.type is None or args.object is not None:
+            raise Exception(f"cat-file -{args.mode[0]} takes exactly one object")
+        return cat_file_header(repo, args.type, args.mode)
+
+    if args.type not in OBJECT_TYPES:
+        raise Exception(f"invalid object type '{args.type}'")
+    if args.object is None:
+        raise Exception("cat-file requires an object")
+
     cat_file(repo, args.object, args.type.encode())
+    return None
 
 
 def cat_file(repo: GitRepository, name: str, fmt=None):
     sha = repo.objects.find(name, fmt=fmt)
+
+    if fmt == b"blob":
+        repo.objects.read_stream(sha, sys.stdout.buffer)
+        return
+
     obj = repo.objects.read(sha)
 
     if not isinstance(obj, GitObject):
         raise ValueError(f"not an object: {sha}")
 
     sys.stdout.buffer.write(obj.serialize())
+
+
+def cat_file_header(repo: GitRepository, name: str, mode: str) -> int:
+    if mode == "exists":
+        try:
+            repo.objects.read_header(repo.objects.find(name))
+        except (ValueError, FileNotFoundError):
+            return 1
+        return 0
+
+    fmt, size = repo.objects.read_header(repo.objects.find(name))
+
+    if mode == "type":
+        logger.info(fmt.decode("ascii"))
+    else:
+        logger.info(size)
+    return 0
+
+
+def cat_file_batch(repo: GitRepository, contents: bool, buffer: bool = False):
+    out = sys.stdout.buffer
+
+    for line in sys.stdin.buffer:
+        name = line.rstrip(b"\r\n").decode("utf-8")
+
+        try:
+            candidates = repo.objects.resolve(name)
+        except FileNotFoundError:
+            candidates = []
+
+        if len(candidates) > 1:
+            out.write(f"{name} ambiguous\n".encode("utf-8"))
+        elif not candidates:
+            out.write(f"{name} missing\n".encode("utf-8"))
+        else:
+            sha = candidates[0]
+            try:
+                fmt, size = repo.objects.read_header(sha)
+            except FileNotFoundError:
+                out.write(f"{name} missing\n".encode("utf-8"))
+            else:
+                out.write(f"{sha} {fmt.decode('ascii')} {size}\n".encode("ascii"))
+                if contents:
+                    repo.objects.read_stream(sha, out)
+                    out.write(b"\n")
+
+        if not buffer:
+            out.flush()
+
+    out.flush()
@@ -2,8 +2,8 @@ import os
 from argparse import _SubParsersAction
 
 from app.cli import logger
-from app.objects import GitBlob, GitCommit, GitTree
-from app.repository import GitRepository
+from app.objects import GitCommit, GitTree
+from app.repository import GitObjects, GitRepository
 from app.repository.branch import is_branch_name, update_ref
 
 from .command import cmd
@@ -35,11 +35,11 @@ def cmd_checkout(args, repo: GitRepository) -> None:
     if not isinstance(obj, GitCommit):
         raise ValueError(f"object is not a commit: {sha}")
 
-    tree_value = obj.kvlm.get_one(b"tree")
+    tree_value = obj.tree
     if tree_value is None:
         raise ValueError("malformed commit")
 
-    tree_obj = repo.objects.read(tree_value.decode("ascii"))
+    tree_obj = repo.objects.read(tree_value)
 
     if args.path is None:
         checkout_path = repo.worktree
@@ -89,18 +89,13 @@ def check_conflicts(repo: GitRepository, tree, path):
     for item in tree.items:
         dest = os.path.join(path, item.path)
 
-        if isinstance(repo.objects.read(item.sha), GitTree):
+        if item.is_tree():
             if os.path.exists(dest) and os.path.isdir(dest):
                 tree_obj = repo.objects.read(item.sha)
                 conflicts.extend(check_conflicts(repo, tree_obj, dest))
         else:
             if os.path.exists(dest):
-                with open(dest, "rb") as f:
-                    existing_content = f.read()
-
-                blob = repo.objects.read(item.sha)
-                assert isinstance(blob, GitBlob)
-                if existing_content != blob.data:
+                if GitObjects.hash_file(dest) != item.sha:
                     rel_path = os.path.relpath(dest, path)
                     conflicts.append(rel_path)
 
@@ -109,13 +104,14 @@ def check_conflicts(repo: GitRepository, tree, path):
 
 def tree_checkout(repo: GitRepository, tree, path):
     for item in tree.items:
-        obj = repo.objects.read(item.sha)
         dest = os.path.join(path, item.path)
 
-        if isinstance(obj, GitTree):
+        if item.is_tree():
+            obj = repo.objects.read(item.sha)
+            assert isinstance(obj, GitTree)
             if not os.path.exists(dest):
                 os.mkdir(dest)
             tree_checkout(repo, obj, dest)
-        elif isinstance(obj, GitBlob):
+        else:
             with open(dest, "wb") as obj_file:
-                obj_file.write(obj.data)
+                repo.objects.read_stream(item.sha, obj_file)
@@ -8,6 +8,7 @@ from app.repository import GitIndex, GitRepository
 from app.repository.branch import update_ref
 from app.repository.commit import tree_from_index
 from app.repository.config import get_user_from_config
+from app.repository.index import GitIndexLock
 
 from .command import cmd
 
@@ -20,13 +21,16 @@ def setup_parser(subparsers: _SubParsersAction) -> None:
 
 @cmd(req_repo=True)
 def cmd_commit(args, repo: GitRepository) -> None:
-    index = GitIndex.read(repo)
+    with GitIndexLock(repo) as lock:
+        index = GitIndex.read(repo)
 
-    if not index.entries:
-        logger.info("Nothing to commit (create/copy files and use 'mgit add')")
-        return
+        if not len(index):
+            logger.info("Nothing to commit (create/copy files and use 'mgit add')")
+            return
 
-    tree_sha = tree_from_index(repo, index)
+        tree_sha = tree_from_index(repo, index)
+        # Keep the trees just built in the index for the next commit
+        index.write(repo, lock)
 
     try:
         parent_sha = repo.objects.find("HEAD")
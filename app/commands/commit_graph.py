@@ -0,0 +1,49 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.commit_graph import verify_commit_graph
+from app.repository.reachability import write_reachable_commit_graph
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "commit-graph", help="Write and verify the commit-graph file"
+    )
+    parser.add_argument(
+        "action",
+        choices=["write", "verify"],
+        help="Write a commit-graph of reachable commits, or verify the existing one",
+    )
+    parser.add_argument(
+        "--changed-paths",
+        dest="changed_paths",
+        action="store_true",
+        default=None,
+        help="Also write changed-path Bloom filters for path-limited log",
+    )
+    parser.add_argument(
+        "--no-changed-paths",
+        dest="changed_paths",
+        action="store_false",
+        help="Do not write changed-path Bloom filters",
+    )
+    parser.set_defaults(func=cmd_commit_graph)
+
+
+@cmd(req_repo=True)
+def cmd_commit_graph(args, repo: GitRepository) -> int:
+    if args.action == "write":
+        write_reachable_commit_graph(repo, args.changed_paths)
+        return 0
+
+    graph = repo.objects.commit_graph
+    if graph is None:
+        return 0
+
+    errors = verify_commit_graph(graph, repo.objects.parse_commit_info)
+    for error in errors:
+        logger.error(str(error))
+    return 1 if errors else 0
@@ -0,0 +1,40 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.fsmonitor import (
+    fsmonitor_request,
+    run_fsmonitor_daemon,
+    start_fsmonitor_daemon,
+    stop_fsmonitor_daemon,
+)
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "fsmonitor--daemon", help="Watch the worktree for changes in the background"
+    )
+    parser.add_argument(
+        "action",
+        choices=["start", "run", "stop", "status"],
+        help="Start in the background, run in the foreground, stop or check it",
+    )
+    parser.set_defaults(func=cmd_fsmonitor_daemon)
+
+
+@cmd(req_repo=True)
+def cmd_fsmonitor_daemon(args, repo: GitRepository) -> None:
+    if args.action == "start":
+        pid = start_fsmonitor_daemon(repo)
+        logger.info(f"fsmonitor--daemon started (pid {pid})")
+    elif args.action == "run":
+        run_fsmonitor_daemon(repo)
+    elif args.action == "stop":
+        if not stop_fsmonitor_daemon(repo):
+            raise Exception("fsmonitor--daemon is not running")
+    elif fsmonitor_request(repo, "status") is not None:
+        logger.info(f"fsmonitor-daemon is watching '{repo.worktree}'")
+    else:
+        logger.info(f"fsmonitor-daemon is not watching '{repo.worktree}'")
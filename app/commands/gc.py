@@ -0,0 +1,28 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.repack import gc
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "gc", help="Cleanup unnecessary files and optimize the local repository"
+    )
+    parser.add_argument(
+        "--prune",
+        metavar="date",
+        default=None,
+        help="Prune loose unreachable objects older than date (default: 2.weeks.ago)",
+    )
+    parser.set_defaults(func=cmd_gc)
+
+
+@cmd(req_repo=True)
+def cmd_gc(args, repo: GitRepository) -> None:
+    result = gc(repo, prune=args.prune)
+
+    if result is not None:
+        logger.info(f"Total {result.total} (delta {result.deltas})")
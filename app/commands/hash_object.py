@@ -36,6 +36,14 @@ def cmd_hash_object(args) -> None:
     if not os.path.isfile(args.path):
         raise FileNotFoundError(f"No such file: {args.path}")
 
+    if args.type == "blob":
+        if args.write:
+            sha = GitRepository.load().objects.write_file(args.path)
+        else:
+            sha = GitObjects.hash_file(args.path)
+        logger.info(sha)
+        return
+
     with open(args.path, "rb") as obj_file:
         data = obj_file.read()
 
@@ -1,12 +1,15 @@
+import os
 import re
-from argparse import _SubParsersAction
+from argparse import REMAINDER, ArgumentParser, _SubParsersAction
 from datetime import datetime, timezone
-from typing import Set
+from itertools import islice
+from typing import List, Tuple
 
 from app.cli import logger
 from app.objects import GitCommit
 from app.repository import GitRepository
 from app.repository.branch import get_current_branch
+from app.repository.revision import parse_date, walk_commits
 
 from .command import cmd
 
@@ -20,24 +23,85 @@ def setup_parser(subparsers: _SubParsersAction) -> None:
         "log",
         help="Show history of a commit",
     )
-    parser.add_argument("commit", default="HEAD", nargs="?", help="Starting commit")
+    add_log_options(parser)
+    # Kept unparsed so that "--" still separates revisions from paths
+    parser.add_argument(
+        "args",
+        nargs=REMAINDER,
+        metavar="[commit...] [--] [path...]",
+        help="Starting commits (default: HEAD), then paths to limit history to",
+    )
     parser.set_defaults(func=cmd_log)
 
 
+def add_log_options(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "-n",
+        "--max-count",
+        dest="max_count",
+        type=int,
+        default=None,
+        help="Limit the number of commits to output",
+    )
+    parser.add_argument(
+        "--since",
+        "--after",
+        dest="since",
+        default=None,
+        help="Show commits more recent than a specific date",
+    )
+    parser.add_argument(
+        "--until",
+        "--before",
+        dest="until",
+        default=None,
+        help="Show commits older than a specific date",
+    )
+    parser.add_argument(
+        "--first-parent",
+        dest="first_parent",
+        action="store_true",
+        help="Follow only the first parent of merge commits",
+    )
+
+
 @cmd(req_repo=True)
 def cmd_log(args, repo: GitRepository) -> None:
-    seen: Set[str] = set()
+    # Options given after the first revision are left in args.args
+    options = ArgumentParser(add_help=False)
+    add_log_options(options)
+    _, rest = options.parse_known_args(args.args, namespace=args)
+
+    starts, pathspecs = split_revisions(repo, rest)
+
+    if not starts:
+        try:
+            starts = [repo.objects.find("HEAD", fmt=b"commit")]
+        except FileNotFoundError:
+            raise Exception(
+                f"your current branch '{get_current_branch(repo)}' does not have any commits yet"
+            )
 
-    try:
-        tail_sha = repo.objects.find(args.commit)
-    except ValueError:
-        raise Exception(f"ambiguous argument {args.commit}: could not find commit")
-    except FileNotFoundError:
-        raise Exception(
-            f"your current branch '{get_current_branch(repo)}' does not have any commits yet"
-        )
+    paths = [repo_path(repo, path) for path in pathspecs]
+    if "" in paths:
+        # A pathspec naming the whole worktree does not limit anything
+        paths = []
+
+    since = parse_date(args.since) if args.since is not None else None
+    until = parse_date(args.until) if args.until is not None else None
+
+    commits = walk_commits(
+        repo,
+        starts,
+        first_parent=args.first_parent,
+        since=since,
+        until=until,
+        paths=paths,
+    )
+    if args.max_count is not None and args.max_count >= 0:
+        commits = islice(commits, args.max_count)
 
-    for sha in iterate_commits(repo, tail_sha, seen):
+    for sha in commits:
         commit = repo.objects.read(sha)
 
         if not isinstance(commit, GitCommit):
@@ -46,22 +110,48 @@ def cmd_log(args, repo: GitRepository) -> None:
         print_commit(commit, sha)
 
 
-def iterate_commits(repo: GitRepository, sha: str, seen: Set[str]):
-    if sha in seen:
-        return
+def split_revisions(
+    repo: GitRepository, args: List[str]
+) -> Tuple[List[str], List[str]]:
+    if "--" in args:
+        separator = args.index("--")
+        commits = [resolve_commit(repo, arg) for arg in args[:separator]]
+        return commits, args[separator + 1 :]
+
+    # Without "--", everything from the first argument that is not a commit
+    # but names an existing file is a path, like git does
+    revisions: List[str] = []
+    for i, arg in enumerate(args):
+        if os.path.exists(arg) and not is_commit(repo, arg):
+            return revisions, args[i:]
+        revisions.append(resolve_commit(repo, arg))
+    return revisions, []
 
-    seen.add(sha)
-    commit = repo.objects.read(sha)
 
-    if not isinstance(commit, GitCommit):
-        raise ValueError(f"Object {sha} is not a commit")
+def is_commit(repo: GitRepository, name: str) -> bool:
+    try:
+        repo.objects.find(name, fmt=b"commit")
+    except (ValueError, FileNotFoundError):
+        return False
+    return True
+
+
+def resolve_commit(repo: GitRepository, name: str) -> str:
+    try:
+        return repo.objects.find(name, fmt=b"commit")
+    except (ValueError, FileNotFoundError):
+        raise Exception(
+            f"ambiguous argument '{name}': unknown revision or path not in the working tree"
+        )
 
-    parents = commit.kvlm.get(b"parent")
-    for parent in parents:
-        parent_sha = parent.decode("ascii")
-        yield from iterate_commits(repo, parent_sha, seen)
 
-    yield sha
+def repo_path(repo: GitRepository, path: str) -> str:
+    relpath = os.path.relpath(os.path.abspath(path), repo.worktree)
+    if relpath.startswith(".."):
+        raise Exception(f"path is outside of worktree: {path}")
+    if relpath == ".":
+        return ""
+    return relpath.replace(os.path.sep, "/")
 
 
 def print_commit(commit: GitCommit, sha: str):
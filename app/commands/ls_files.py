@@ -26,10 +26,10 @@ def cmd_ls_files(args, repo: GitRepository):
 
     if args.verbose:
         logger.info(
-            f"Index file format v{index.version}, has {len(index.entries)} entries."
+            f"Index file format v{index.version}, has {len(index)} entries."
         )
 
-    for e in index.entries:
+    for e in index:
         logger.info(e.name)
         if args.verbose:
             entry_type = {
@@ -46,4 +46,9 @@ def cmd_ls_files(args, repo: GitRepository):
             logger.info(
                 f"  user: {pwd.getpwuid(e.uid).pw_name} ({e.uid})  group: {grp.getgrgid(e.gid).gr_name} ({e.gid})"
             )
-            logger.info(f"  flags: stage={e.stage} assume_valid={e.assume_valid}")
+            flags = f"  flags: stage={e.stage} assume_valid={e.assume_valid}"
+            if index.version >= 3:
+                flags += (
+                    f" skip_worktree={e.skip_worktree} intent_to_add={e.intent_to_add}"
+                )
+            logger.info(flags)
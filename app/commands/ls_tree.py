@@ -33,12 +33,9 @@ def ls_tree(repo: GitRepository, name: str, recursive: bool = False, prefix=""):
         raise ValueError(f"Object is not a tree: {sha}")
 
     for item in obj.items:
-        if len(item.mode) == 5:
-            type_bytes = item.mode[0:1]
-        else:
-            type_bytes = item.mode[0:2]
+        mode = item.mode.rjust(6, b"0")
 
-        match type_bytes:
+        match mode[0:2]:
             case b"04":
                 type = "tree"
             case b"10":
@@ -52,7 +49,7 @@ def ls_tree(repo: GitRepository, name: str, recursive: bool = False, prefix=""):
 
         if not (recursive and type == "tree"):
             logger.info(
-                f"{'0' * (6 - len(item.mode)) + item.mode.decode('ascii')} {type} {item.sha}\t{os.path.join(prefix, item.path)}"
+                f"{mode.decode('ascii')} {type} {item.sha}\t{os.path.join(prefix, item.path)}"
             )
         else:
             ls_tree(repo, item.sha, recursive, os.path.join(prefix, item.path))
@@ -0,0 +1,47 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.midx import (
+    load_multi_pack_index,
+    verify_multi_pack_index,
+    write_multi_pack_index,
+)
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "multi-pack-index", help="Write and verify multi-pack-indexes"
+    )
+    parser.add_argument(
+        "action",
+        choices=["write", "verify"],
+        help="Write a multi-pack-index covering all packs, or verify the existing one",
+    )
+    parser.set_defaults(func=cmd_multi_pack_index)
+
+
+@cmd(req_repo=True)
+def cmd_multi_pack_index(args, repo: GitRepository) -> int:
+    pack_dir = repo.fs.resolve("objects", "pack")
+
+    if args.action == "write":
+        repo.objects.reload_packs()
+        write_multi_pack_index(pack_dir, repo.objects.packs)
+        repo.objects.reload_packs()
+        return 0
+
+    midx = load_multi_pack_index(pack_dir)
+    if midx is None:
+        return 0
+
+    try:
+        errors = verify_multi_pack_index(midx, repo.objects.packs)
+    finally:
+        midx.close()
+
+    for error in errors:
+        logger.error(str(error))
+    return 1 if errors else 0
@@ -0,0 +1,81 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.repack import repack
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "repack", help="Pack unpacked objects in a repository"
+    )
+    parser.add_argument(
+        "-a",
+        dest="all_objects",
+        action="store_true",
+        help="Pack all reachable objects into a single pack",
+    )
+    parser.add_argument(
+        "-d",
+        dest="delete",
+        action="store_true",
+        help="Remove redundant packs and loose objects after packing",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=None,
+        help="Number of objects considered as delta bases (default: pack.window)",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=None,
+        help="Maximum delta chain length (default: pack.depth)",
+    )
+    parser.add_argument(
+        "-j",
+        "--threads",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Number of processes searching for deltas (default: pack.threads)",
+    )
+    parser.add_argument(
+        "-b",
+        "--write-bitmap-index",
+        dest="write_bitmaps",
+        action="store_true",
+        default=None,
+        help="Write reachability bitmaps (default: repack.writeBitmaps)",
+    )
+    parser.add_argument(
+        "--no-write-bitmap-index",
+        dest="write_bitmaps",
+        action="store_false",
+        help="Do not write reachability bitmaps",
+    )
+    parser.set_defaults(func=cmd_repack)
+
+
+@cmd(req_repo=True)
+def cmd_repack(args, repo: GitRepository) -> None:
+    if args.write_bitmaps and not args.all_objects:
+        raise Exception("--write-bitmap-index requires -a")
+
+    result = repack(
+        repo,
+        all_objects=args.all_objects,
+        delete=args.delete,
+        window=args.window,
+        depth=args.depth,
+        jobs=args.jobs,
+        write_bitmaps=args.write_bitmaps,
+    )
+
+    if result is None:
+        logger.info("Nothing new to pack.")
+    else:
+        logger.info(f"Total {result.total} (delta {result.deltas})")
@@ -0,0 +1,123 @@
+from argparse import _SubParsersAction
+from typing import List, Set
+
+from app.cli import logger
+from app.repository import GitRepository
+from app.repository.reachability import (
+    find_reachable,
+    list_commits,
+    list_objects,
+    peel_to_commit,
+    ref_tips,
+)
+from app.repository.revision import walk_commits
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "rev-list", help="List commits and the objects they reach"
+    )
+    parser.add_argument(
+        "--all",
+        dest="all_refs",
+        action="store_true",
+        help="Start from every ref and HEAD",
+    )
+    parser.add_argument(
+        "--objects",
+        action="store_true",
+        help="Also list the tags, trees and blobs reachable from the commits",
+    )
+    parser.add_argument(
+        "--count",
+        action="store_true",
+        help="Print the number of objects instead of listing them",
+    )
+    parser.add_argument(
+        "--use-bitmap-index",
+        dest="use_bitmap_index",
+        action="store_true",
+        help="Answer from reachability bitmaps, without paths or ordering",
+    )
+    parser.add_argument(
+        "revisions",
+        nargs="*",
+        metavar="commit",
+        help="Commits to start from; ^commit excludes everything it reaches",
+    )
+    parser.set_defaults(func=cmd_rev_list)
+
+
+@cmd(req_repo=True)
+def cmd_rev_list(args, repo: GitRepository) -> None:
+    include: List[str] = []
+    exclude: List[str] = []
+    for name in args.revisions:
+        if name.startswith("^"):
+            exclude.append(resolve(repo, name[1:]))
+        else:
+            include.append(resolve(repo, name))
+    if args.all_refs:
+        include.extend(ref_tips(repo))
+
+    if not include:
+        raise Exception("usage: mgit rev-list [options] <commit>...")
+
+    if args.use_bitmap_index:
+        reachable = find_reachable(repo, include)
+        if exclude:
+            reachable = reachable.difference(find_reachable(repo, exclude))
+
+        if args.count:
+            total = len(reachable) if args.objects else reachable.count(b"commit")
+            logger.info(str(total))
+            return
+
+        for sha, _, _ in reachable.objects(None if args.objects else b"commit"):
+            logger.info(sha)
+        return
+
+    starts: List[str] = []
+    for sha in include:
+        commit = peel_to_commit(repo, sha)
+        if commit is not None:
+            starts.append(commit)
+
+    excluded_commits: Set[str] = set(list_commits(repo, exclude))
+    commits = [sha for sha in walk_commits(repo, starts) if sha not in excluded_commits]
+
+    if not args.objects:
+        if args.count:
+            logger.info(str(len(commits)))
+        else:
+            for sha in commits:
+                logger.info(sha)
+        return
+
+    excluded_objects = set(sha for sha, _, _ in list_objects(repo, exclude))
+    others = [
+        (sha, path)
+        for sha, fmt, path in list_objects(repo, include)
+        if fmt != b"commit" and sha not in excluded_objects
+    ]
+
+    if args.count:
+        logger.info(str(len(commits) + len(others)))
+        return
+
+    # Commits first, newest first, then everything they reach
+    for sha in commits:
+        logger.info(sha)
+    for sha, path in others:
+        logger.info(f"{sha} {path}")
+
+
+def resolve(repo: GitRepository, name: str) -> str:
+    try:
+        return repo.objects.find(name)
+    except (ValueError, FileNotFoundError):
+        raise Exception(
+            f"ambiguous argument '{name}': unknown revision or path not in the working tree"
+        )
@@ -1,9 +1,10 @@
 import os
 from argparse import _SubParsersAction
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set
 
 from app.cli import logger
 from app.repository import GitIndex, GitRepository
+from app.repository.index import GitIndexLock
 
 from .command import cmd
 
@@ -30,7 +31,9 @@ def setup_parser(subparsers: _SubParsersAction) -> None:
 
 @cmd(req_repo=True)
 def cmd_rm(args, repo: GitRepository) -> None:
-    rm(repo, args.path, cached=args.cached, recursive=args.recursive)
+    # Held from reading the index until the new one is in place
+    with GitIndexLock(repo) as lock:
+        rm(repo, args.path, cached=args.cached, recursive=args.recursive, lock=lock)
 
 
 def rm(
@@ -38,6 +41,7 @@ def rm(
     paths: List[str],
     cached=False,
     recursive=False,
+    lock: Optional[GitIndexLock] = None,
 ):
 
     dirs_to_remove: Set[str] = set()
@@ -72,19 +76,19 @@ def rm(
 
     index = GitIndex.read(repo)
 
-    kept_entries = []
+    removed_names: Set[str] = set()
     files_removed_from_index = []
 
-    for entry in index.entries:
-        abspath = repo.fs.resolve(entry.name, root="worktree")
+    for name in index.names:
+        abspath = repo.fs.resolve(name, root="worktree")
 
         if abspath in entries_to_remove:
             del entries_to_remove[abspath]
+            removed_names.add(name)
         elif abspath in files_to_remove:
             files_removed_from_index.append(abspath)
             files_to_remove.remove(abspath)
-        else:
-            kept_entries.append(entry)
+            removed_names.add(name)
 
     for _, path in entries_to_remove.items():
         raise Exception(f"pathspec '{path}' did not match any files")
@@ -109,5 +113,5 @@ def rm(
                 logger.info(f"removing {abspath} from the filesystem")
                 os.rmdir(abspath)
 
-    index.entries = kept_entries
-    index.write(repo)
+    index.remove(removed_names)
+    index.write(repo, lock)
@@ -1,11 +1,12 @@
-import os
 from argparse import _SubParsersAction
+from typing import List, Optional
 
 from app.cli import logger
-from app.objects import GitBlob
-from app.repository import GitIgnore, GitIndex, GitObjects, GitRepository
+from app.repository import GitIgnore, GitIndex, GitRepository
 from app.repository.branch import get_current_branch
-from app.repository.commit import tree_to_dict
+from app.repository.commit import Change, diff_tree_index
+from app.repository.index import GitIndexLock, IndexLocked
+from app.repository.worktree import find_untracked, refresh_index
 
 from .command import cmd
 
@@ -16,6 +17,8 @@ GREEN = "\033[32m"
 YELLOW = "\033[33m"
 RESET = "\033[0m"
 
+COLORS = {"added": GREEN, "modified": YELLOW, "deleted": RED}
+
 
 def setup_parser(subparsers: _SubParsersAction) -> None:
     parser = subparsers.add_parser("status", help="Show the working tree status")
@@ -24,11 +27,24 @@ def setup_parser(subparsers: _SubParsersAction) -> None:
 
 @cmd(req_repo=True)
 def cmd_status(args, repo: GitRepository) -> None:
-    index = GitIndex.read(repo)
+    # The lock is taken before reading so that what status learned can be
+    # written back without undoing another process's changes; when someone
+    # else holds it, or .git is read-only, status still runs but writes nothing
+    lock: Optional[GitIndexLock]
+    try:
+        lock = GitIndexLock(repo).acquire()
+    except (IndexLocked, OSError):
+        lock = None
+
+    try:
+        index = GitIndex.read(repo)
 
-    cmd_status_branch(repo)
-    cmd_status_head_index(repo, index)
-    cmd_status_index_worktree(repo, index)
+        cmd_status_branch(repo)
+        cmd_status_head_index(repo, index)
+        cmd_status_index_worktree(repo, index, lock)
+    finally:
+        if lock is not None:
+            lock.release()
 
 
 def cmd_status_branch(repo: GitRepository):
@@ -46,68 +62,35 @@ def cmd_status_head_index(repo, index: GitIndex):
     logger.info("Changes to be committed:")
 
     try:
-        head = tree_to_dict(repo, "HEAD")
+        head: Optional[str] = repo.objects.find("HEAD", fmt=b"tree")
     except FileNotFoundError:
-        head = {}
+        head = None
 
-    for entry in index.entries:
-        if entry.name in head:
-            if head[entry.name] != entry.sha:
-                logger.info(f"\t{YELLOW}modified: {entry.name}{RESET}")
-            head.pop(entry.name)
-        else:
-            logger.info(f"\t{GREEN}added:    {entry.name}{RESET}")
-
-    for entry in head.keys():
-        logger.info(f"\t{RED}deleted:  {entry}{RESET}")
+    changes: List[Change] = []
+    diff_tree_index(repo, index, head, index.cache_tree, "", 0, changes)
+    for change, name in changes:
+        logger.info(f"\t{COLORS[change]}{(change + ':').ljust(9)} {name}{RESET}")
 
     logger.info("")
 
 
-def cmd_status_index_worktree(repo: GitRepository, index: GitIndex):
+def cmd_status_index_worktree(
+    repo: GitRepository, index: GitIndex, lock: Optional[GitIndexLock]
+):
     logger.info("Changes not staged for commit:")
 
-    ignore = GitIgnore.read(repo)
-
-    gitdir_prefix = repo.gitdir + os.path.sep
-
-    all_files = list()
-
-    for root, _, files in os.walk(repo.worktree, True):
-        if root == repo.gitdir or root.startswith(gitdir_prefix):
-            continue
-        for file in files:
-            full_path = os.path.join(root, file)
-            rel_path = os.path.relpath(full_path, repo.worktree)
-            all_files.append(rel_path)
-
-    for entry in index.entries:
-        full_path = os.path.join(repo.worktree, entry.name)
-
-        if not os.path.exists(full_path):
-            logger.info(f"\t{RED}deleted:  {entry.name}{RESET}")
-        else:
-            stat = os.stat(full_path)
-
-            ctime_ns = entry.ctime[0] * 10**9 + entry.ctime[1]
-            mtime_ns = entry.mtime[0] * 10**9 + entry.mtime[1]
-            if (stat.st_ctime_ns != ctime_ns) or (stat.st_mtime_ns != mtime_ns):
-                with open(full_path, "rb") as f:
-                    data = f.read()
-
-                    obj = GitBlob.deserialize(data)
-                    raw = GitObjects.raw(obj)
-                    new_sha = GitObjects.hash(raw)
-
-                    if not (entry.sha == new_sha):
-                        logger.info(f"\t{YELLOW}modified: {entry.name}{RESET}")
-
-        if entry.name in all_files:
-            all_files.remove(entry.name)
+    changes, refreshed = refresh_index(repo, index)
+    for change, name in changes:
+        logger.info(f"\t{COLORS[change]}{(change + ':').ljust(9)} {name}{RESET}")
 
     logger.info("")
     logger.info("Untracked files:")
 
-    for file in all_files:
-        if not ignore.check_ignore(file):
-            logger.info(f"\t{RED}{file}{RESET}")
+    ignore = GitIgnore.read(repo, index)
+    untracked, changed = find_untracked(repo, index, ignore)
+    for file in untracked:
+        logger.info(f"\t{RED}{file}{RESET}")
+
+    if lock is not None and (changed or refreshed):
+        # Keep what was learned about the worktree for the next run
+        index.write(repo, lock)
@@ -0,0 +1,42 @@
+from argparse import _SubParsersAction
+
+from app.cli import logger
+from app.repository import GitIndex, GitRepository
+from app.repository.index import GitIndexLock
+from app.repository.worktree import refresh_index
+
+from .command import cmd
+
+
+def setup_parser(subparsers: _SubParsersAction) -> None:
+    parser = subparsers.add_parser(
+        "update-index", help="Register file contents in the working tree to the index"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Record new stat data for files whose contents did not change",
+    )
+    parser.add_argument(
+        "-q",
+        dest="quiet",
+        action="store_true",
+        help="Do not list the files that need to be updated",
+    )
+    parser.set_defaults(func=cmd_update_index)
+
+
+@cmd(req_repo=True)
+def cmd_update_index(args, repo: GitRepository) -> None:
+    if not args.refresh:
+        raise Exception("usage: mgit update-index --refresh [-q]")
+
+    with GitIndexLock(repo) as lock:
+        index = GitIndex.read(repo)
+        changes, changed = refresh_index(repo, index)
+        if not args.quiet:
+            for _, name in changes:
+                logger.info(f"{name}: needs update")
+
+        if changed:
+            index.write(repo, lock)
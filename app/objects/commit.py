@@ -4,43 +4,86 @@ from typing import Dict, List, Optional
 
 from .object import GitObject
 
+HEX_SHA_SIZE = 40
+
 
 class KeyValueListWithMessage:
     def __init__(self) -> None:
-        self._data: Dict[bytes, List[bytes]] = {}
-        self._message: bytes = b""
+        self._data: Optional[Dict[bytes, List[bytes]]] = {}
+        self._message: Optional[bytes] = b""
+        # Unmodified objects keep their raw form, which is parsed on first
+        # access and returned as is when serialized again
+        self._raw: Optional[bytes] = None
+        self._message_start = 0
+
+    @property
+    def raw(self) -> Optional[bytes]:
+        return self._raw
+
+    def _headers(self) -> Dict[bytes, List[bytes]]:
+        if self._data is None:
+            self._parse()
+            assert self._data is not None
+        return self._data
+
+    def _modify(self) -> Dict[bytes, List[bytes]]:
+        data = self._headers()
+        if self._message is None:
+            self._message = self.get_raw_message()
+        self._raw = None
+        return data
 
     def set(self, key: bytes, value: bytes) -> None:
-        self._data[key] = [value]
+        self._modify()[key] = [value]
 
     def append(self, key: bytes, value: bytes) -> None:
-        if key not in self._data:
-            self._data[key] = []
-        self._data[key].append(value)
+        data = self._modify()
+        if key not in data:
+            data[key] = []
+        data[key].append(value)
 
     def get(self, key: bytes) -> List[bytes]:
-        if key not in self._data:
+        data = self._headers()
+        if key not in data:
             return []
-        return self._data[key]
+        return data[key]
 
     def get_one(self, key: bytes) -> Optional[bytes]:
-        values = self._data.get(key)
+        values = self._headers().get(key)
         if values:
             return values[0]
         return None
 
     def set_message(self, value: bytes) -> None:
+        self._modify()
         self._message = value
 
+    def get_raw_message(self) -> bytes:
+        if self._message is None:
+            self._headers()
+            assert self._raw is not None
+            return self._raw[self._message_start :]
+        return self._message
+
     def get_message(self) -> bytes:
-        if self._message == b"":
+        message = self.get_raw_message()
+        if message == b"":
             raise ValueError("no commit message")
-        return self._message
+        return message
 
     @classmethod
     def deserialize(cls, data: bytes) -> KeyValueListWithMessage:
         kvlm = KeyValueListWithMessage()
+        kvlm._raw = data
+        kvlm._data = None
+        kvlm._message = None
+        return kvlm
+
+    def _parse(self) -> None:
+        data = self._raw
+        assert data is not None
 
+        headers: Dict[bytes, List[bytes]] = {}
         size = len(data)
 
         pos = 0
@@ -51,8 +94,8 @@ class KeyValueListWithMessage:
             if (space < 0) or (newline < space):
                 if newline != pos:
                     raise ValueError(f"Expected blank line at position {pos}")
-                kvlm.set_message(data[pos + 1 :])
-                return kvlm
+                pos += 1
+                break
             key = data[pos:space]
 
             end = pos
@@ -63,22 +106,36 @@ class KeyValueListWithMessage:
 
             value = data[space + 1 : end].replace(b"\n ", b"\n")
 
-            kvlm.append(key, value)
+            if key not in headers:
+                headers[key] = []
+            headers[key].append(value)
 
             pos = end + 1
 
-        return kvlm
+        self._data = headers
+        self._message_start = min(pos, size)
 
     def serialize(self) -> bytes:
-        result = b""
+        if self._raw is not None:
+            return self._raw
+
+        parts: List[bytes] = []
 
-        for key, values in self._data.items():
+        for key, values in self._headers().items():
             for value in values:
-                result += key + b" " + value.replace(b"\n", b"\n ") + b"\n"
+                parts.append(key + b" " + value.replace(b"\n", b"\n ") + b"\n")
+
+        parts.append(b"\n")
+        parts.append(self.get_message())
 
-        result += b"\n" + self.get_message()
+        return b"".join(parts)
 
-        return result
+
+def parse_timestamp(identity: bytes) -> int:
+    # "Name <email> 1234567890 +0100"
+    end = identity.rfind(b" ")
+    start = identity.rfind(b" ", 0, end)
+    return int(identity[start + 1 : end])
 
 
 class GitCommit(GitObject):
@@ -89,6 +146,52 @@ class GitCommit(GitObject):
     def initialize(self):
         self.kvlm = KeyValueListWithMessage()
 
+    @property
+    def tree(self) -> Optional[str]:
+        raw = self.kvlm.raw
+        if raw is not None and raw.startswith(b"tree "):
+            return raw[5 : 5 + HEX_SHA_SIZE].decode("ascii")
+
+        tree = self.kvlm.get_one(b"tree")
+        return tree.decode("ascii") if tree is not None else None
+
+    @property
+    def parents(self) -> List[str]:
+        # Parents directly follow the tree line, so they can be read at fixed
+        # offsets without parsing the rest of the headers
+        raw = self.kvlm.raw
+        if raw is not None and raw.startswith(b"tree "):
+            parents: List[str] = []
+            pos = 6 + HEX_SHA_SIZE
+            while raw.startswith(b"parent ", pos):
+                parents.append(raw[pos + 7 : pos + 7 + HEX_SHA_SIZE].decode("ascii"))
+                pos += 8 + HEX_SHA_SIZE
+            return parents
+
+        return [parent.decode("ascii") for parent in self.kvlm.get(b"parent")]
+
+    @property
+    def author_time(self) -> int:
+        return self._timestamp(b"author")
+
+    @property
+    def committer_time(self) -> int:
+        return self._timestamp(b"committer")
+
+    def _timestamp(self, key: bytes) -> int:
+        raw = self.kvlm.raw
+        if raw is not None:
+            # Only look at the headers, never into the message
+            start = raw.find(b"\n" + key + b" ", 0, raw.find(b"\n\n"))
+            if start >= 0:
+                end = raw.find(b"\n", start + 1)
+                return parse_timestamp(raw[start + len(key) + 2 : end])
+
+        identity = self.kvlm.get_one(key)
+        if identity is None:
+            raise ValueError(f"invalid commit: no {key.decode()}")
+        return parse_timestamp(identity)
+
     def serialize(self) -> bytes:
         return self.kvlm.serialize()
 
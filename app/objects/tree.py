@@ -1,7 +1,14 @@
 from __future__ import annotations
 
+from typing import Optional
+
 from .object import GitObject
 
+SHA_SIZE = 20
+
+TREE_MODE = b"40000"
+GITLINK_MODE = b"160000"
+
 
 class GitTree(GitObject):
     fmt = b"tree"
@@ -12,71 +19,98 @@ class GitTree(GitObject):
         self.items = list()
 
     def serialize(self) -> bytes:
-        result = b""
-
         self.items.sort(key=lambda leaf: leaf.sort_key())
-        for item in self.items:
-            result += item.serialize()
-
-        return result
+        return b"".join(item.serialize() for item in self.items)
 
     @classmethod
     def deserialize(cls, data: bytes) -> GitTree:
         instance = cls()
 
+        # Entries are decoded in place by offset, so a large tree is not
+        # copied once for every entry it contains
+        data = bytes(data)
         pos = 0
         size = len(data)
+        items = instance.items
 
         while pos < size:
-            node, consumed = GitTreeLeaf.deserialize(data[pos:])
-            pos += consumed
-            instance.items.append(node)
+            node, pos = GitTreeLeaf.deserialize(data, pos)
+            items.append(node)
 
         return instance
 
 
 class GitTreeLeaf:
+    __slots__ = ("mode", "path", "_sha", "_oid")
+
     def __init__(self, mode: bytes, path: str, sha: str):
         self.mode = mode
         self.path = path
-        self.sha = sha
+        self._sha: Optional[str] = sha
+        self._oid: Optional[bytes] = None
+
+    @classmethod
+    def from_oid(cls, mode: bytes, path: str, oid: bytes) -> GitTreeLeaf:
+        leaf = cls.__new__(cls)
+        leaf.mode = mode
+        leaf.path = path
+        leaf._sha = None
+        leaf._oid = oid
+        return leaf
+
+    @property
+    def sha(self) -> str:
+        # Most leaves of a parsed tree are never looked at, so the hex form
+        # is only built when asked for
+        if self._sha is None:
+            assert self._oid is not None
+            self._sha = self._oid.hex()
+        return self._sha
+
+    @sha.setter
+    def sha(self, value: str) -> None:
+        self._sha = value
+        self._oid = None
+
+    @property
+    def oid(self) -> bytes:
+        if self._oid is None:
+            assert self._sha is not None
+            self._oid = bytes.fromhex(self._sha)
+        return self._oid
+
+    def is_tree(self) -> bool:
+        # Some old tools wrote tree modes zero-padded to six digits
+        return self.mode == TREE_MODE or self.mode == b"0" + TREE_MODE
+
+    def is_gitlink(self) -> bool:
+        return self.mode == GITLINK_MODE
 
     def serialize(self) -> bytes:
-        result = self.mode + b" " + self.path.encode() + b"\x00"
-        sha_int = int(self.sha, 16)
-        result += sha_int.to_bytes(20, "big")
-        return result
+        return self.mode + b" " + self.path.encode() + b"\x00" + self.oid
 
     @classmethod
-    def deserialize(cls, raw: bytes) -> tuple[GitTreeLeaf, int]:
-        mode_separator = raw.find(b" ")
-        if mode_separator not in (5, 6):
+    def deserialize(cls, raw: bytes, pos: int = 0) -> tuple[GitTreeLeaf, int]:
+        mode_separator = raw.find(b" ", pos)
+        if mode_separator - pos not in (5, 6):
             raise ValueError("Missing or invalid mode separator")
 
-        mode = raw[:mode_separator]
-        if len(mode) == 5:
-            mode = b"0" + mode
-
         path_separator = raw.find(b"\x00", mode_separator)
         if path_separator < 0:
             raise ValueError("Missing path separator")
 
-        path = raw[mode_separator + 1 : path_separator].decode("utf-8")
-
-        SHA_SIZE = 20
-
-        if len(raw) < path_separator + SHA_SIZE + 1:
+        end = path_separator + 1 + SHA_SIZE
+        if len(raw) < end:
             raise ValueError("Raw data too short for SHA")
-        raw_sha = int.from_bytes(
-            raw[path_separator + 1 : path_separator + 1 + SHA_SIZE], "big"
-        )
-        sha = format(raw_sha, "040x")
-
-        consumed_length = path_separator + 1 + SHA_SIZE
 
-        return cls(mode, path, sha), consumed_length
+        leaf = cls.from_oid(
+            raw[pos:mode_separator],
+            raw[mode_separator + 1 : path_separator].decode("utf-8"),
+            raw[path_separator + 1 : end],
+        )
+        return leaf, end
 
     def sort_key(self) -> str:
-        if self.mode.startswith(b"10"):
-            return self.path
-        return self.path + "/"
+        if self.is_tree():
+            return self.path + "/"
+        return self.path
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from .chunk_format import write_atomic
+from .ewah import decode_ewah, encode_ewah, ewah_size, read_ewah
+from .pack import SHA_SIZE, GitPack, map_file
+
+# Reachability bitmaps stored next to a pack, in the format git uses. Bit n
+# of every bitmap stands for the n-th object in pack order. The file holds
+# one bitmap per object type and one bitmap for each selected commit with
+# every object reachable from it, all of which have to be in the pack.
+BITMAP_SIGNATURE = b"BITM"
+BITMAP_VERSION = 1
+
+BITMAP_OPT_FULL_DAG = 0x1
+BITMAP_OPT_HASH_CACHE = 0x4
+
+HEADER_SIZE = 12 + SHA_SIZE
+ENTRY_HEADER_SIZE = 6
+
+TYPE_ORDER = (b"commit", b"tree", b"blob", b"tag")
+
+# (index position of the commit, bitmap of everything reachable from it)
+BitmapEntry = Tuple[int, int]
+
+
+def name_hash(path: str) -> int:
+    # Same hash git uses to group objects by the end of their path, so that
+    # files with the same name in different directories end up close together
+    result = 0
+    for c in path.encode("utf-8"):
+        if c in b" \t\n\r\v\f":
+            continue
+        result = ((result >> 2) + (c << 24)) & 0xFFFFFFFF
+    return result
+
+
+class GitBitmapIndex:
+    def __init__(self, pack: GitPack) -> None:
+        self.pack = pack
+        self.path = bitmap_path(pack)
+        data = map_file(self.path)
+
+        if data[:4] != BITMAP_SIGNATURE:
+            raise ValueError(f"Invalid bitmap signature: {self.path}")
+        version, options, count = struct.unpack_from(">HHI", data, 4)
+        if version != BITMAP_VERSION:
+            raise ValueError(f"Unsupported bitmap version: {version}")
+        if not options & BITMAP_OPT_FULL_DAG:
+            raise ValueError(f"Bitmap is not a full closure: {self.path}")
+        if data[12:HEADER_SIZE] != pack.checksum:
+            raise ValueError(f"Bitmap does not match its pack: {self.path}")
+
+        pos = HEADER_SIZE
+        self.types: Dict[bytes, int] = {}
+        for fmt in TYPE_ORDER:
+            self.types[fmt], pos = read_ewah(data, pos)
+
+        # Entries are decoded on first use; each may be stored as the xor
+        # against an earlier entry
+        self._entries: Dict[str, Tuple[int, int]] = {}
+        self._entry_shas: List[str] = []
+        for n in range(count):
+            position, xor_offset, _ = struct.unpack_from(">IBB", data, pos)
+            sha = pack.oid(position).hex()
+            self._entries[sha] = (n, pos + ENTRY_HEADER_SIZE)
+            self._entry_shas.append(sha)
+            if xor_offset > n:
+                raise ValueError(f"Corrupt bitmap entry {n}: {self.path}")
+            pos += ENTRY_HEADER_SIZE
+            pos += ewah_size(data, pos)
+
+        self._name_hashes = pos if options & BITMAP_OPT_HASH_CACHE else None
+        self._bitmaps: Dict[int, int] = {}
+        self._data = data
+
+        self._order = pack.pack_order()
+        self._positions = pack_positions(pack)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def close(self) -> None:
+        self._data.close()
+
+    def commits(self) -> List[str]:
+        return list(self._entry_shas)
+
+    def position(self, sha: str) -> Optional[int]:
+        n = self.pack.position(sha)
+        if n is None:
+            return None
+        return self._positions[n]
+
+    def oid(self, position: int) -> bytes:
+        return self.pack.oid(self._order[position])
+
+    def name_hash(self, position: int) -> int:
+        if self._name_hashes is None:
+            return 0
+        pos = self._name_hashes + self._order[position] * 4
+        return struct.unpack_from(">I", self._data, pos)[0]
+
+    def bitmap(self, sha: str) -> Optional[int]:
+        entry = self._entries.get(sha)
+        if entry is None:
+            return None
+        return self._entry_bitmap(entry[0])
+
+    def _entry_bitmap(self, n: int) -> int:
+        bits = self._bitmaps.get(n)
+        if bits is None:
+            pos = self._entries[self._entry_shas[n]][1]
+            xor_offset = self._data[pos - ENTRY_HEADER_SIZE + 4]
+            bits = decode_ewah(self._data, pos)
+            if xor_offset:
+                bits ^= self._entry_bitmap(n - xor_offset)
+            self._bitmaps[n] = bits
+        return bits
+
+
+def pack_positions(pack: GitPack) -> List[int]:
+    # Pack position of every object, by index position
+    positions = [0] * len(pack)
+    for pack_position, idx_position in enumerate(pack.pack_order()):
+        positions[idx_position] = pack_position
+    return positions
+
+
+def bitmap_path(pack: GitPack) -> str:
+    return pack.path + ".bitmap"
+
+
+def load_bitmap_index(packs: List[GitPack]) -> Optional[GitBitmapIndex]:
+    # Like git, only the first pack with a bitmap is used
+    for pack in packs:
+        if os.path.isfile(bitmap_path(pack)):
+            return GitBitmapIndex(pack)
+    return None
+
+
+def write_bitmap_index(
+    pack: GitPack,
+    types: Dict[bytes, int],
+    entries: List[BitmapEntry],
+    name_hashes: Optional[List[int]] = None,
+) -> str:
+    options = BITMAP_OPT_FULL_DAG
+    if name_hashes is not None:
+        options |= BITMAP_OPT_HASH_CACHE
+
+    content = bytearray(BITMAP_SIGNATURE)
+    content += struct.pack(">HHI", BITMAP_VERSION, options, len(entries))
+    content += pack.checksum
+
+    for fmt in TYPE_ORDER:
+        content += encode_ewah(types.get(fmt, 0))
+
+    for position, bits in sorted(entries):
+        content += struct.pack(">IBB", position, 0, 0)
+        content += encode_ewah(bits)
+
+    if name_hashes is not None:
+        content += struct.pack(f">{len(name_hashes)}I", *name_hashes)
+
+    content += hashlib.sha1(content).digest()
+
+    path = bitmap_path(pack)
+    write_atomic(path, bytes(content))
+    return path
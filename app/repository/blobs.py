@@ -0,0 +1,68 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from stat import S_ISLNK
+from typing import List, Optional, Tuple
+
+from .objects import GitObjects
+from .repository import GitRepository
+
+# Fewer files than this per worker are not worth starting a pool for
+MIN_FILES_PER_WORKER = 8
+
+# (sha of the written blob, stat taken before the file was read)
+WrittenBlob = Tuple[str, os.stat_result]
+
+
+def write_blob(objects: GitObjects, path: str) -> WrittenBlob:
+    # Stat before reading, so a write racing with us leaves the entry stale
+    # rather than recording new stat data next to the old contents
+    stat = os.lstat(path)
+    if S_ISLNK(stat.st_mode):
+        # The blob of a symbolic link is its target, not what it points to
+        target = os.readlink(os.fsencode(path))
+        return objects.write_stream(b"blob", io.BytesIO(target), len(target)), stat
+    return objects.write_file(path), stat
+
+
+_worker_objects: Optional[GitObjects] = None
+
+
+def _init_worker(worktree: str, gitdir: str) -> None:
+    global _worker_objects
+    _worker_objects = GitRepository(worktree, gitdir).objects
+
+
+def _write_blob_worker(path: str) -> WrittenBlob:
+    assert _worker_objects is not None
+    return write_blob(_worker_objects, path)
+
+
+def write_blobs(
+    repo: GitRepository,
+    paths: List[str],
+    jobs: Optional[int] = None,
+    processes: bool = False,
+) -> List[WrittenBlob]:
+    if jobs is None or jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(paths) // MIN_FILES_PER_WORKER)
+
+    if jobs <= 1:
+        return [write_blob(repo.objects, path) for path in paths]
+
+    # Reading, hashing and compressing happen in the workers; results come
+    # back in the order of paths, so callers see the same output as a serial run
+    if not processes:
+        with ThreadPoolExecutor(max_workers=jobs) as threads:
+            return list(
+                threads.map(lambda path: write_blob(repo.objects, path), paths)
+            )
+
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(repo.worktree, repo.gitdir),
+    ) as pool:
+        chunksize = max(1, len(paths) // (jobs * 16))
+        return list(pool.map(_write_blob_worker, paths, chunksize=chunksize))
@@ -0,0 +1,122 @@
+import math
+import struct
+from typing import Iterable, List, Set
+
+# Changed-path Bloom filters as stored in the commit-graph. Every path a
+# commit changed relative to its first parent, and each of its leading
+# directories, is added to a filter of 10 bits per entry with 7 hashes.
+BLOOM_VERSION = 1
+BLOOM_NUM_HASHES = 7
+BLOOM_BITS_PER_ENTRY = 10
+BLOOM_MAX_CHANGED_PATHS = 512
+
+BLOOM_SEED_0 = 0x293AE76F
+BLOOM_SEED_1 = 0x7E646E2C
+
+BITS_PER_WORD = 8
+
+# Stored for commits with too many changes: every lookup says "maybe"
+TRUNCATED_LARGE_FILTER = b"\xff"
+# Stored for commits that change nothing: every lookup says "no"
+TRUNCATED_EMPTY_FILTER = b"\x00"
+
+MASK32 = 0xFFFFFFFF
+
+
+def _rotate_left(value: int, count: int) -> int:
+    return ((value << count) | (value >> (32 - count))) & MASK32
+
+
+def murmur3(seed: int, data: bytes, version: int = BLOOM_VERSION) -> int:
+    c1 = 0xCC9E2D51
+    c2 = 0x1B873593
+
+    if version == 1:
+        # Version 1 filters were computed with bytes read as signed chars
+        words = [b if b < 0x80 else (b - 0x100) & MASK32 for b in data]
+    else:
+        words = list(data)
+
+    length = len(data)
+    blocks = length // 4
+
+    for i in range(blocks):
+        block = words[4 * i : 4 * i + 4]
+        k = (block[0] | (block[1] << 8) | (block[2] << 16) | (block[3] << 24)) & MASK32
+        k = (k * c1) & MASK32
+        k = _rotate_left(k, 15)
+        k = (k * c2) & MASK32
+        seed ^= k
+        seed = (_rotate_left(seed, 13) * 5 + 0xE6546B64) & MASK32
+
+    tail = words[blocks * 4 :]
+    if tail:
+        k1 = 0
+        for shift, byte in enumerate(tail):
+            k1 ^= (byte << (8 * shift)) & MASK32
+        k1 = (k1 * c1) & MASK32
+        k1 = _rotate_left(k1, 15)
+        k1 = (k1 * c2) & MASK32
+        seed ^= k1
+
+    seed ^= length
+    seed ^= seed >> 16
+    seed = (seed * 0x85EBCA6B) & MASK32
+    seed ^= seed >> 13
+    seed = (seed * 0xC2B2AE35) & MASK32
+    seed ^= seed >> 16
+    return seed
+
+
+def bloom_key(
+    path: str, num_hashes: int = BLOOM_NUM_HASHES, version: int = BLOOM_VERSION
+) -> List[int]:
+    data = path.encode("utf-8")
+    hash0 = murmur3(BLOOM_SEED_0, data, version)
+    hash1 = murmur3(BLOOM_SEED_1, data, version)
+    return [(hash0 + i * hash1) & MASK32 for i in range(num_hashes)]
+
+
+def leading_paths(path: str) -> List[str]:
+    # "a/b/c" -> ["a/b/c", "a/b", "a"]
+    paths = [path]
+    while "/" in path:
+        path = path.rsplit("/", 1)[0]
+        paths.append(path)
+    return paths
+
+
+def bloom_contains(data: bytes, key: List[int]) -> bool:
+    bits = len(data) * BITS_PER_WORD
+    if not bits:
+        return True
+
+    for value in key:
+        pos = value % bits
+        if not data[pos // BITS_PER_WORD] & (1 << (pos % BITS_PER_WORD)):
+            return False
+    return True
+
+
+def build_bloom_filter(changed: Iterable[str], version: int = BLOOM_VERSION) -> bytes:
+    paths: Set[str] = set()
+    for path in changed:
+        paths.update(leading_paths(path))
+    # Git applies the limit to the paths including their leading directories
+    if len(paths) > BLOOM_MAX_CHANGED_PATHS:
+        return TRUNCATED_LARGE_FILTER
+    if not paths:
+        return TRUNCATED_EMPTY_FILTER
+
+    size = math.ceil(len(paths) * BLOOM_BITS_PER_ENTRY / BITS_PER_WORD)
+    bits = size * BITS_PER_WORD
+    data = bytearray(size)
+    for path in paths:
+        for value in bloom_key(path, BLOOM_NUM_HASHES, version):
+            pos = value % bits
+            data[pos // BITS_PER_WORD] |= 1 << (pos % BITS_PER_WORD)
+    return bytes(data)
+
+
+def bloom_header(version: int = BLOOM_VERSION) -> bytes:
+    return struct.pack(">III", version, BLOOM_NUM_HASHES, BLOOM_BITS_PER_ENTRY)
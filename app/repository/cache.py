@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Hashable, Tuple[V, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable) -> Optional[V]:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: Hashable, value: V, size: int) -> None:
+        if size > self.limit:
+            return
+
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.used -= old[1]
+
+        self._items[key] = (value, size)
+        self.used += size
+
+        while self.used > self.limit:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.used -= evicted_size
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.used = 0
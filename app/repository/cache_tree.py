@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+# The TREE index extension: for every directory, the tree object built from
+# it the last time and the number of index entries it covered, or -1 when
+# something inside it changed since. Directories are written depth first,
+# each as its name, the entry and subtree counts and, when valid, the oid.
+CACHE_TREE_SIGNATURE = b"TREE"
+
+SHA_SIZE = 20
+
+
+class GitCacheTree:
+    def __init__(self, entry_count: int = -1, sha: Optional[str] = None) -> None:
+        self.entry_count = entry_count
+        self.sha = sha
+        self.children: Dict[str, GitCacheTree] = {}
+
+    def is_valid(self) -> bool:
+        return self.entry_count >= 0
+
+    def invalidate(self, path: str) -> None:
+        # Only the directories the path is in have to be built again
+        node: Optional[GitCacheTree] = self
+        for part in path.split("/")[:-1]:
+            assert node is not None
+            node.entry_count = -1
+            node = node.children.get(part)
+            if node is None:
+                return
+        assert node is not None
+        node.entry_count = -1
+
+    def sort_children(self) -> None:
+        # git keeps subtrees ordered by name length first, then by name
+        self.children = dict(
+            sorted(
+                self.children.items(),
+                key=lambda item: (len(item[0].encode("utf8")), item[0].encode("utf8")),
+            )
+        )
+
+    @classmethod
+    def parse(cls, data: bytes) -> GitCacheTree:
+        _, root, pos = cls._parse(data, 0)
+        if pos != len(data):
+            raise ValueError("Corrupt cache-tree extension in index")
+        return root
+
+    @classmethod
+    def _parse(cls, data: bytes, pos: int) -> Tuple[str, GitCacheTree, int]:
+        name_end = data.find(b"\x00", pos)
+        line_end = data.find(b"\n", name_end)
+        if name_end == -1 or line_end == -1:
+            raise ValueError("Corrupt cache-tree extension in index")
+
+        name = data[pos:name_end].decode("utf8")
+        entry_count, subtrees = (int(n) for n in data[name_end + 1 : line_end].split())
+        pos = line_end + 1
+
+        node = cls(entry_count)
+        if node.is_valid():
+            node.sha = data[pos : pos + SHA_SIZE].hex()
+            pos += SHA_SIZE
+
+        for _ in range(subtrees):
+            child_name, child, pos = cls._parse(data, pos)
+            node.children[child_name] = child
+
+        return name, node, pos
+
+    def encode(self) -> bytes:
+        parts: List[bytes] = []
+        self._encode("", parts)
+        return b"".join(parts)
+
+    def _encode(self, name: str, parts: List[bytes]) -> None:
+        parts.append(name.encode("utf8") + b"\x00")
+        parts.append(f"{self.entry_count} {len(self.children)}\n".encode("ascii"))
+        if self.is_valid():
+            assert self.sha is not None
+            parts.append(bytes.fromhex(self.sha))
+
+        for child_name, child in self.children.items():
+            child._encode(child_name, parts)
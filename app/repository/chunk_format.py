@@ -0,0 +1,67 @@
+import hashlib
+import os
+import struct
+import tempfile
+from typing import Dict, List, Tuple
+
+from .filesystem import READ_ONLY_MODE
+
+# Shared layout of the multi-pack-index and commit-graph files: a header, a
+# table of (chunk id, offset) entries ending with a zero id, the chunks, and
+# a SHA-1 trailer over everything before it
+CHUNK_ENTRY_SIZE = 12
+
+
+def read_chunks(data, start: int, count: int) -> Dict[bytes, Tuple[int, int]]:
+    chunks: Dict[bytes, Tuple[int, int]] = {}
+    for i in range(count):
+        pos = start + i * CHUNK_ENTRY_SIZE
+        chunk_id = data[pos : pos + 4]
+        offset = struct.unpack_from(">Q", data, pos + 4)[0]
+        end = struct.unpack_from(">Q", data, pos + 4 + CHUNK_ENTRY_SIZE)[0]
+        chunks[chunk_id] = (offset, end)
+    return chunks
+
+
+def chunk_file(header: bytes, chunks: List[Tuple[bytes, bytes]]) -> bytes:
+    content = bytearray(header)
+
+    offset = len(header) + (len(chunks) + 1) * CHUNK_ENTRY_SIZE
+    for chunk_id, data in chunks:
+        content += chunk_id + struct.pack(">Q", offset)
+        offset += len(data)
+    content += b"\0\0\0\0" + struct.pack(">Q", offset)
+
+    for _, data in chunks:
+        content += data
+
+    content += hashlib.sha1(content).digest()
+    return bytes(content)
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix="tmp_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, READ_ONLY_MODE)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fanout_table(oids: List[bytes]) -> bytes:
+    # Entry i counts the sorted oids whose first byte is at most i
+    counts = [0] * 256
+    for oid in oids:
+        counts[oid[0]] += 1
+
+    fanout = []
+    total = 0
+    for count in counts:
+        total += count
+        fanout.append(total)
+    return struct.pack(">256I", *fanout)
@@ -1,68 +1,215 @@
-import os
-from typing import Dict, Union
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from app.objects import GitTree, GitTreeLeaf
+from app.objects.tree import TREE_MODE
 
-from .index import GitIndex, GitIndexEntry
+from .cache_tree import GitCacheTree
+from .index import GitIndex
 from .repository import GitRepository
 
 
-def tree_to_dict(repo: GitRepository, ref: str, prefix=""):
-    result = {}
-
-    sha = repo.objects.find(ref, fmt=b"tree")
+def read_tree(repo: GitRepository, sha: str) -> GitTree:
     tree = repo.objects.read(sha)
+    if not isinstance(tree, GitTree):
+        raise ValueError(f"Object {sha} is not a tree")
+    return tree
 
-    assert isinstance(tree, GitTree)
 
+def find_leaf(tree: GitTree, name: str) -> Optional[GitTreeLeaf]:
     for leaf in tree.items:
-        full_path = os.path.join(prefix, leaf.path)
-
-        is_subtree = leaf.mode.startswith(b"04")
-
-        if is_subtree:
-            result.update(tree_to_dict(repo, leaf.sha, full_path))
+        if leaf.path == name:
+            return leaf
+    return None
+
+
+def path_differs(
+    repo: GitRepository, old_tree: Optional[str], new_tree: Optional[str], path: str
+) -> bool:
+    # Descend both trees along the path and stop at the first level where the
+    # subtrees are identical, without looking at anything beside the path
+    parts = path.split("/")
+    for i, name in enumerate(parts):
+        if old_tree == new_tree:
+            return False
+
+        old = find_leaf(read_tree(repo, old_tree), name) if old_tree else None
+        new = find_leaf(read_tree(repo, new_tree), name) if new_tree else None
+        if old is None and new is None:
+            return False
+        if i == len(parts) - 1:
+            if old is None or new is None:
+                return True
+            return old.sha != new.sha or old.mode != new.mode
+
+        old_tree = old.sha if old is not None and old.is_tree() else None
+        new_tree = new.sha if new is not None and new.is_tree() else None
+
+    return False
+
+
+def changed_paths(
+    repo: GitRepository, old_tree: Optional[str], new_tree: Optional[str], prefix=""
+) -> Iterator[str]:
+    if old_tree == new_tree:
+        return
+
+    old: Dict[str, GitTreeLeaf] = {}
+    new: Dict[str, GitTreeLeaf] = {}
+    if old_tree:
+        old = {leaf.path: leaf for leaf in read_tree(repo, old_tree).items}
+    if new_tree:
+        new = {leaf.path: leaf for leaf in read_tree(repo, new_tree).items}
+
+    for name in sorted(old.keys() | new.keys()):
+        old_leaf = old.get(name)
+        new_leaf = new.get(name)
+        if (
+            old_leaf is not None
+            and new_leaf is not None
+            and old_leaf.sha == new_leaf.sha
+            and old_leaf.mode == new_leaf.mode
+        ):
+            continue
+
+        path = prefix + name
+        old_subtree = old_leaf.sha if old_leaf and old_leaf.is_tree() else None
+        new_subtree = new_leaf.sha if new_leaf and new_leaf.is_tree() else None
+        if old_subtree or new_subtree:
+            yield from changed_paths(repo, old_subtree, new_subtree, path + "/")
+
+        old_file = old_leaf is not None and not old_leaf.is_tree()
+        new_file = new_leaf is not None and not new_leaf.is_tree()
+        if old_file or new_file:
+            yield path
+
+
+def tree_files(repo: GitRepository, sha: str, prefix="") -> Iterator[str]:
+    # Paths of the files in a tree, in index order, reading subtrees lazily
+    for leaf in read_tree(repo, sha).items:
+        if leaf.is_tree():
+            yield from tree_files(repo, leaf.sha, prefix + leaf.path + "/")
         else:
-            result[full_path] = leaf.sha
-    return result
-
-
-TreeDict = Dict[str, Union["TreeDict", GitIndexEntry]]
-
-
-def tree_from_index(repo: GitRepository, index: GitIndex) -> str:
-    root: TreeDict = {}
-
-    for entry in index.entries:
-        parts = entry.name.split("/")
-        current = root
-
-        for part in parts[:-1]:
-            if part not in current:
-                current[part] = {}
-
-            node = current[part]
-
-            if isinstance(node, dict):
-                current = node
-
+            yield prefix + leaf.path
+
+
+# A path that differs between a tree and the index: added, modified or deleted
+Change = Tuple[str, str]
+
+
+def diff_tree_index(
+    repo: GitRepository,
+    index: GitIndex,
+    tree: Optional[str],
+    node: Optional[GitCacheTree],
+    prefix: str,
+    start: int,
+    changes: List[Change],
+) -> int:
+    # Walks the tree and the entries from start on that are under prefix side
+    # by side; both are in the same order, so every step consumes one leaf,
+    # one entry or both. Directories the cache-tree has a valid tree for that
+    # is the same as the one compared against are skipped as a whole. Returns
+    # the position of the first entry after the directory.
+    if node is not None and node.is_valid() and node.sha == tree:
+        return start + node.entry_count
+
+    names = index.names
+    leaves = read_tree(repo, tree).items if tree else []
+    i = start
+    k = 0
+    while True:
+        entry_key = leaf_key = None
+        if i < len(names) and names[i].startswith(prefix):
+            name = names[i][len(prefix) :]
+            slash = name.find("/")
+            entry_key = name if slash == -1 else name[: slash + 1]
+        if k < len(leaves):
+            leaf_key = leaves[k].sort_key()
+        if entry_key is None and leaf_key is None:
+            return i
+
+        if leaf_key is None or (entry_key is not None and entry_key < leaf_key):
+            assert entry_key is not None
+            if entry_key.endswith("/"):
+                child = node.children.get(entry_key[:-1]) if node else None
+                i = diff_tree_index(
+                    repo, index, None, child, prefix + entry_key, i, changes
+                )
+            else:
+                changes.append(("added", names[i]))
+                i += 1
+            continue
+
+        leaf = leaves[k]
+        k += 1
+        if entry_key != leaf_key:
+            # Only in the tree
+            if leaf.is_tree():
+                files = tree_files(repo, leaf.sha, prefix + leaf.path + "/")
+                changes.extend(("deleted", name) for name in files)
             else:
-                raise TypeError(f"Path conflict at {part}")
+                changes.append(("deleted", prefix + leaf.path))
+            continue
 
-        current[parts[-1]] = entry
+        if leaf.is_tree():
+            child = node.children.get(leaf.path) if node else None
+            i = diff_tree_index(
+                repo, index, leaf.sha, child, prefix + leaf.path + "/", i, changes
+            )
+            continue
 
-    def write_tree_recursive(node_dict: dict) -> str:
-        tree = GitTree()
-        for name, value in sorted(node_dict.items()):
-            if isinstance(value, GitIndexEntry):
-                # It is a file
-                mode = f"{value.mode_type:o}{value.mode_perms:04o}".encode("ascii")
-                tree.items.append(GitTreeLeaf(mode, name, value.sha))
-            else:
-                # It is a directory
-                subtree_sha = write_tree_recursive(value)
-                tree.items.append(GitTreeLeaf(b"40000", name, subtree_sha))
+        mode = f"{index.mode(i):o}".encode("ascii")
+        if leaf.oid != index.oid(i) or leaf.mode.lstrip(b"0") != mode:
+            changes.append(("modified", names[i]))
+        i += 1
 
-        return repo.objects.write(tree)
 
-    return write_tree_recursive(root)
+def tree_from_index(repo: GitRepository, index: GitIndex) -> str:
+    # Directories the cache-tree still has a valid tree for are skipped
+    # over as a whole; only the ones something changed in are written again
+    if index.cache_tree is None:
+        index.cache_tree = GitCacheTree()
+    update_cache_tree(repo, index, index.cache_tree, "", 0)
+    assert index.cache_tree.sha is not None
+    return index.cache_tree.sha
+
+
+def update_cache_tree(
+    repo: GitRepository, index: GitIndex, node: GitCacheTree, prefix: str, start: int
+) -> int:
+    # Builds the tree for the entries from start on that are under prefix, and
+    # returns the position of the first entry after them
+    if node.is_valid():
+        return start + node.entry_count
+
+    names = index.names
+    tree = GitTree()
+    children: Dict[str, GitCacheTree] = {}
+    files: Set[str] = set()
+
+    i = start
+    while i < len(names) and names[i].startswith(prefix):
+        name = names[i][len(prefix) :]
+        slash = name.find("/")
+        if slash == -1:
+            mode = f"{index.mode(i):o}".encode("ascii")
+            tree.items.append(GitTreeLeaf.from_oid(mode, name, index.oid(i)))
+            files.add(name)
+            i += 1
+            continue
+
+        dirname = name[:slash]
+        if dirname in files:
+            raise TypeError(f"Path conflict at {prefix}{dirname}")
+
+        child = node.children.get(dirname) or GitCacheTree()
+        children[dirname] = child
+        i = update_cache_tree(repo, index, child, prefix + dirname + "/", i)
+        assert child.sha is not None
+        tree.items.append(GitTreeLeaf(TREE_MODE, dirname, child.sha))
+
+    node.children = children
+    node.sort_children()
+    node.sha = repo.objects.write(tree)
+    node.entry_count = i - start
+    return i
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .bloom import bloom_header
+from .chunk_format import chunk_file, fanout_table, read_chunks, write_atomic
+from .pack import SHA_SIZE, find_oid, map_file
+
+COMMIT_GRAPH_FILE = "commit-graph"
+COMMIT_GRAPH_SIGNATURE = b"CGPH"
+
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_COMMIT_DATA = b"CDAT"
+CHUNK_EXTRA_EDGES = b"EDGE"
+CHUNK_BLOOM_INDEXES = b"BIDX"
+CHUNK_BLOOM_DATA = b"BDAT"
+
+BLOOM_DATA_HEADER_SIZE = 12
+
+HEADER_SIZE = 8
+
+# Root tree, first parent, second parent, generation and date
+COMMIT_DATA = struct.Struct(">20sIIII")
+COMMIT_DATA_SIZE = COMMIT_DATA.size
+
+PARENT_NONE = 0x70000000
+PARENT_EXTRA_EDGES = 0x80000000
+LAST_EDGE = 0x80000000
+
+# Commits outside the graph have no known generation and sort after all others
+GENERATION_INFINITY = 0xFFFFFFFF
+GENERATION_MAX = 0x3FFFFFFF
+
+# (root tree, parents, generation number, commit date)
+CommitInfo = Tuple[str, List[str], int, int]
+
+# (root tree, parents, commit date) of a commit that is about to be written
+GraphCommit = Tuple[str, List[str], int]
+
+
+class GitCommitGraph:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        data = map_file(path)
+
+        if data[:4] != COMMIT_GRAPH_SIGNATURE:
+            raise ValueError(f"Invalid commit-graph signature: {path}")
+        version, hash_version, chunk_count, base_count = struct.unpack_from(
+            ">BBBB", data, 4
+        )
+        if version != 1:
+            raise ValueError(f"Unsupported commit-graph version: {version}")
+        if hash_version != 1:
+            raise ValueError("mgit only supports SHA-1 commit-graphs")
+        if base_count != 0:
+            raise ValueError("mgit does not support split commit-graphs")
+
+        chunks = read_chunks(data, HEADER_SIZE, chunk_count)
+        for required in (CHUNK_OID_FANOUT, CHUNK_OID_LOOKUP, CHUNK_COMMIT_DATA):
+            if required not in chunks:
+                raise ValueError(f"commit-graph is missing {required.decode()}")
+
+        self._fanout = struct.unpack_from(">256I", data, chunks[CHUNK_OID_FANOUT][0])
+        self._oids = chunks[CHUNK_OID_LOOKUP][0]
+        self._commits = chunks[CHUNK_COMMIT_DATA][0]
+        self._edges = chunks.get(CHUNK_EXTRA_EDGES, (0, 0))[0]
+        self._data = data
+
+        # Changed-path Bloom filters are optional
+        self.bloom_version = 0
+        if CHUNK_BLOOM_INDEXES in chunks and CHUNK_BLOOM_DATA in chunks:
+            start = chunks[CHUNK_BLOOM_DATA][0]
+            version, num_hashes, bits_per_entry = struct.unpack_from(
+                ">III", data, start
+            )
+            if version in (1, 2):
+                self.bloom_version = version
+                self.bloom_num_hashes = num_hashes
+                self.bloom_bits_per_entry = bits_per_entry
+                self._bloom_indexes = chunks[CHUNK_BLOOM_INDEXES][0]
+                self._bloom_data = start + BLOOM_DATA_HEADER_SIZE
+
+    def __len__(self) -> int:
+        return self._fanout[255]
+
+    def close(self) -> None:
+        self._data.close()
+
+    def oid(self, n: int) -> bytes:
+        pos = self._oids + n * SHA_SIZE
+        return self._data[pos : pos + SHA_SIZE]
+
+    def find(self, sha: str) -> Optional[int]:
+        return find_oid(self._data, self._oids, self._fanout, bytes.fromhex(sha))
+
+    def tree(self, n: int) -> str:
+        pos = self._commits + n * COMMIT_DATA_SIZE
+        return self._data[pos : pos + SHA_SIZE].hex()
+
+    def parents(self, n: int) -> List[int]:
+        pos = self._commits + n * COMMIT_DATA_SIZE + SHA_SIZE
+        first, second = struct.unpack_from(">II", self._data, pos)
+        return self._parent_list(first, second)
+
+    def _parent_list(self, first: int, second: int) -> List[int]:
+        if first == PARENT_NONE:
+            return []
+        if second == PARENT_NONE:
+            return [first]
+        if not second & PARENT_EXTRA_EDGES:
+            return [first, second]
+
+        # Octopus merges keep every parent after the first in the edge list
+        parents = [first]
+        edge = self._edges + (second & ~PARENT_EXTRA_EDGES) * 4
+        while True:
+            value = struct.unpack_from(">I", self._data, edge)[0]
+            parents.append(value & ~LAST_EDGE)
+            if value & LAST_EDGE:
+                return parents
+            edge += 4
+
+    def generation(self, n: int) -> int:
+        pos = self._commits + n * COMMIT_DATA_SIZE + SHA_SIZE + 8
+        return struct.unpack_from(">I", self._data, pos)[0] >> 2
+
+    def date(self, n: int) -> int:
+        pos = self._commits + n * COMMIT_DATA_SIZE + SHA_SIZE + 8
+        high, low = struct.unpack_from(">II", self._data, pos)
+        return ((high & 0x3) << 32) | low
+
+    def bloom_filter(self, n: int) -> Optional[bytes]:
+        if not self.bloom_version:
+            return None
+
+        pos = self._bloom_indexes + n * 4
+        end = struct.unpack_from(">I", self._data, pos)[0]
+        start = struct.unpack_from(">I", self._data, pos - 4)[0] if n else 0
+        return self._data[self._bloom_data + start : self._bloom_data + end]
+
+    def info(self, n: int) -> CommitInfo:
+        tree, first, second, high, low = COMMIT_DATA.unpack_from(
+            self._data, self._commits + n * COMMIT_DATA_SIZE
+        )
+        parents = [self.oid(p).hex() for p in self._parent_list(first, second)]
+        return tree.hex(), parents, high >> 2, ((high & 0x3) << 32) | low
+
+
+def commit_graph_path(objects_dir: str) -> str:
+    return os.path.join(objects_dir, "info", COMMIT_GRAPH_FILE)
+
+
+def load_commit_graph(objects_dir: str) -> Optional[GitCommitGraph]:
+    path = commit_graph_path(objects_dir)
+    if not os.path.isfile(path):
+        return None
+    return GitCommitGraph(path)
+
+
+def compute_generations(commits: Dict[str, GraphCommit]) -> Dict[str, int]:
+    # Topological levels: one more than the highest parent, computed without
+    # recursion so that long histories do not overflow the stack
+    generations: Dict[str, int] = {}
+
+    for start in commits:
+        if start in generations:
+            continue
+
+        pending = [start]
+        while pending:
+            sha = pending[-1]
+            missing = [p for p in commits[sha][1] if p not in generations]
+            if missing:
+                pending.extend(missing)
+                continue
+
+            pending.pop()
+            level = 1 + max((generations[p] for p in commits[sha][1]), default=0)
+            generations[sha] = min(level, GENERATION_MAX)
+
+    return generations
+
+
+def write_commit_graph(
+    objects_dir: str,
+    commits: Dict[str, GraphCommit],
+    bloom_filters: Optional[Dict[str, bytes]] = None,
+    bloom_version: int = 1,
+) -> Optional[str]:
+    path = commit_graph_path(objects_dir)
+
+    if not commits:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    for sha, (_, parents, _) in commits.items():
+        for parent in parents:
+            if parent not in commits:
+                raise ValueError(f"commit-graph is missing parent {parent} of {sha}")
+
+    generations = compute_generations(commits)
+
+    oids = sorted(bytes.fromhex(sha) for sha in commits)
+    positions = {oid.hex(): n for n, oid in enumerate(oids)}
+
+    commit_data = bytearray()
+    edges = bytearray()
+    for oid in oids:
+        sha = oid.hex()
+        tree, parents, date = commits[sha]
+        parent_ids = [positions[parent] for parent in parents]
+
+        first = parent_ids[0] if parent_ids else PARENT_NONE
+        if len(parent_ids) <= 1:
+            second = PARENT_NONE
+        elif len(parent_ids) == 2:
+            second = parent_ids[1]
+        else:
+            second = PARENT_EXTRA_EDGES | (len(edges) // 4)
+            for parent_id in parent_ids[1:-1]:
+                edges += struct.pack(">I", parent_id)
+            edges += struct.pack(">I", LAST_EDGE | parent_ids[-1])
+
+        generation = generations[sha]
+        commit_data += COMMIT_DATA.pack(
+            bytes.fromhex(tree),
+            first,
+            second,
+            (generation << 2) | (date >> 32 & 0x3),
+            date & 0xFFFFFFFF,
+        )
+
+    chunks = [
+        (CHUNK_OID_FANOUT, fanout_table(oids)),
+        (CHUNK_OID_LOOKUP, b"".join(oids)),
+        (CHUNK_COMMIT_DATA, bytes(commit_data)),
+    ]
+    if edges:
+        chunks.append((CHUNK_EXTRA_EDGES, bytes(edges)))
+
+    if bloom_filters is not None:
+        indexes = bytearray()
+        filters = [bloom_filters[oid.hex()] for oid in oids]
+        end = 0
+        for bloom_filter in filters:
+            end += len(bloom_filter)
+            indexes += struct.pack(">I", end)
+        chunks.append((CHUNK_BLOOM_INDEXES, bytes(indexes)))
+        chunks.append(
+            (CHUNK_BLOOM_DATA, bloom_header(bloom_version) + b"".join(filters))
+        )
+
+    header = COMMIT_GRAPH_SIGNATURE + struct.pack(">BBBB", 1, 1, len(chunks), 0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, chunk_file(header, chunks))
+
+    return path
+
+
+def verify_commit_graph(
+    graph: GitCommitGraph, parse: Callable[[str], CommitInfo]
+) -> List[str]:
+    errors: List[str] = []
+
+    previous = b""
+    for n in range(len(graph)):
+        oid = bytes(graph.oid(n))
+        sha = oid.hex()
+        if oid <= previous:
+            errors.append(f"commit-graph has incorrect OID order: {sha}")
+        previous = oid
+
+        tree, parents, _, date = parse(sha)
+        graph_tree, graph_parents, generation, graph_date = graph.info(n)
+
+        if graph_tree != tree:
+            errors.append(f"root tree OID for commit {sha} in commit-graph is wrong")
+        if graph_parents != parents:
+            errors.append(f"commit-graph parent list for commit {sha} is wrong")
+        if graph_date != date:
+            errors.append(f"commit date for commit {sha} in commit-graph is wrong")
+
+        expected = 1 + max(
+            (graph.generation(p) for p in graph.parents(n)), default=0
+        )
+        if generation != min(expected, GENERATION_MAX):
+            errors.append(f"commit-graph generation for commit {sha} is wrong")
+
+    return errors
@@ -1,6 +1,7 @@
 import os
 import textwrap
 from configparser import ConfigParser
+from typing import TextIO
 
 from app.cli import logger
 
@@ -14,6 +15,16 @@ def default_config() -> ConfigParser:
     return config
 
 
+def write_config(config: ConfigParser, file: TextIO) -> None:
+    # Indented like git's own files: git indents the keys it adds, and
+    # ConfigParser reads an indented line after an unindented key as part of
+    # that key's value
+    for section in config.sections():
+        file.write(f"[{section}]\n")
+        for key, value in config.items(section, raw=True):
+            file.write(f"\t{key} = {value}\n")
+
+
 def read_all_configs(gitdir: str):
     gitdir = os.path.realpath(gitdir)
 
@@ -35,6 +46,28 @@ def read_all_configs(gitdir: str):
     return config
 
 
+def parse_size(value: str) -> int:
+    units = {"k": 1024, "m": 1024**2, "g": 1024**3}
+
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+def get_size_from_config(
+    config: ConfigParser, section: str, option: str, fallback: int
+) -> int:
+    value = config.get(section, option, fallback=None)
+    if value is None:
+        return fallback
+
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise ValueError(f"bad numeric config value '{value}' for '{section}.{option}'")
+
+
 def get_user_from_config(config: ConfigParser) -> str:
     name = config.get("user", "name", fallback=None)
     email = config.get("user", "email", fallback=None)
@@ -0,0 +1,166 @@
+from typing import Dict, Optional, Tuple
+
+DELTA_BLOCK = 16
+MAX_COPY = 0x10000
+MAX_INSERT = 0x7F
+
+
+def _decode_size(delta: bytes, pos: int) -> Tuple[int, int]:
+    size = 0
+    shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+
+def _encode_size(size: int) -> bytes:
+    result = bytearray()
+    while True:
+        c = size & 0x7F
+        size >>= 7
+        if not size:
+            result.append(c)
+            return bytes(result)
+        result.append(c | 0x80)
+
+
+def delta_sizes(delta: bytes) -> Tuple[int, int]:
+    base_size, pos = _decode_size(delta, 0)
+    result_size, _ = _decode_size(delta, pos)
+    return base_size, result_size
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_size, pos = _decode_size(delta, 0)
+    if base_size != len(base):
+        raise ValueError("Delta base size mismatch")
+    result_size, pos = _decode_size(delta, pos)
+
+    source = memoryview(base)
+    result = bytearray()
+    end = len(delta)
+
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+
+        if op & 0x80:
+            copy_offset = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_offset |= delta[pos] << (8 * i)
+                    pos += 1
+
+            copy_size = 0
+            for i in range(3):
+                if op & (0x10 << i):
+                    copy_size |= delta[pos] << (8 * i)
+                    pos += 1
+            if copy_size == 0:
+                copy_size = 0x10000
+
+            result += source[copy_offset : copy_offset + copy_size]
+        elif op:
+            result += delta[pos : pos + op]
+            pos += op
+        else:
+            raise ValueError("Invalid delta opcode 0")
+
+    if len(result) != result_size:
+        raise ValueError("Delta result size mismatch")
+    return bytes(result)
+
+
+def _emit_insert(delta: bytearray, data: bytes, start: int, end: int) -> None:
+    while start < end:
+        size = min(end - start, MAX_INSERT)
+        delta.append(size)
+        delta += data[start : start + size]
+        start += size
+
+
+def _emit_copy(delta: bytearray, offset: int, size: int) -> None:
+    while size:
+        chunk = min(size, MAX_COPY)
+        op = 0x80
+        args = bytearray()
+
+        for i in range(4):
+            byte = (offset >> (8 * i)) & 0xFF
+            if byte:
+                op |= 1 << i
+                args.append(byte)
+
+        # A copy of exactly 0x10000 bytes is encoded with no size bytes at all
+        encoded_size = chunk if chunk != MAX_COPY else 0
+        for i in range(3):
+            byte = (encoded_size >> (8 * i)) & 0xFF
+            if byte:
+                op |= 0x10 << i
+                args.append(byte)
+
+        delta.append(op)
+        delta += args
+        offset += chunk
+        size -= chunk
+
+
+def _match_length(base: bytes, base_pos: int, target: bytes, target_pos: int) -> int:
+    limit = min(len(base) - base_pos, len(target) - target_pos)
+    length = 0
+
+    step = 256
+    while length + step <= limit and (
+        base[base_pos + length : base_pos + length + step]
+        == target[target_pos + length : target_pos + length + step]
+    ):
+        length += step
+    while length < limit and base[base_pos + length] == target[target_pos + length]:
+        length += 1
+
+    return length
+
+
+def create_delta(base: bytes, target: bytes, max_size: int) -> Optional[bytes]:
+    if len(base) < DELTA_BLOCK:
+        return None
+
+    index: Dict[bytes, int] = {}
+    for start in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        index.setdefault(base[start : start + DELTA_BLOCK], start)
+
+    delta = bytearray(_encode_size(len(base)) + _encode_size(len(target)))
+
+    size = len(target)
+    pos = 0
+    pending = 0
+
+    while pos <= size - DELTA_BLOCK:
+        offset = index.get(target[pos : pos + DELTA_BLOCK])
+        if offset is None:
+            pos += 1
+            continue
+
+        while pos > pending and offset > 0 and target[pos - 1] == base[offset - 1]:
+            pos -= 1
+            offset -= 1
+
+        length = _match_length(base, offset, target, pos)
+
+        _emit_insert(delta, target, pending, pos)
+        _emit_copy(delta, offset, length)
+        if len(delta) > max_size:
+            return None
+
+        pos += length
+        pending = pos
+
+    _emit_insert(delta, target, pending, size)
+    if len(delta) > max_size:
+        return None
+
+    return bytes(delta)
@@ -0,0 +1,101 @@
+import struct
+from typing import List, Tuple
+
+# EWAH compressed bitmaps as git stores them: the bit count, the number of
+# 64-bit words, the words, and the position of the last marker word. Each
+# marker word describes a run of identical all-zero or all-one words followed
+# by a number of literal words copied as is.
+WORD_BITS = 64
+ALL_ONES = (1 << WORD_BITS) - 1
+
+RUNNING_LENGTH_BITS = 32
+LITERAL_BITS = 31
+MAX_RUNNING_LENGTH = (1 << RUNNING_LENGTH_BITS) - 1
+MAX_LITERAL_WORDS = (1 << LITERAL_BITS) - 1
+
+
+def ewah_size(data, pos: int) -> int:
+    # Number of bytes the serialized bitmap at pos takes up
+    words = struct.unpack_from(">I", data, pos + 4)[0]
+    return 8 + words * 8 + 4
+
+
+def decode_ewah(data, pos: int) -> int:
+    # Bitmaps are returned as ints, bit n set when object n is in the set,
+    # so that they can be combined with the native bitwise operators
+    count = struct.unpack_from(">I", data, pos + 4)[0]
+    words = struct.unpack_from(f">{count}Q", data, pos + 8)
+
+    chunks: List[bytes] = []
+    i = 0
+    while i < count:
+        marker = words[i]
+        i += 1
+
+        running = (marker >> 1) & MAX_RUNNING_LENGTH
+        literals = marker >> (1 + RUNNING_LENGTH_BITS)
+        if running:
+            chunks.append((b"\xff" if marker & 1 else b"\x00") * (8 * running))
+        if literals:
+            chunks.append(struct.pack(f"<{literals}Q", *words[i : i + literals]))
+            i += literals
+
+    return int.from_bytes(b"".join(chunks), "little")
+
+
+def encode_ewah(bits: int) -> bytes:
+    bit_size = bits.bit_length()
+    count = (bit_size + WORD_BITS - 1) // WORD_BITS
+    words = struct.unpack(f"<{count}Q", bits.to_bytes(count * 8, "little"))
+
+    buffer: List[int] = []
+    last_marker = 0
+    i = 0
+    while i < count or not buffer:
+        running_bit = 0
+        running = 0
+        if i < count and words[i] in (0, ALL_ONES):
+            running_bit = 1 if words[i] else 0
+            start = i
+            while (
+                i < count
+                and words[i] == words[start]
+                and running < MAX_RUNNING_LENGTH
+            ):
+                i += 1
+                running += 1
+
+        start = i
+        while (
+            i < count
+            and words[i] not in (0, ALL_ONES)
+            and i - start < MAX_LITERAL_WORDS
+        ):
+            i += 1
+
+        last_marker = len(buffer)
+        buffer.append(
+            running_bit | (running << 1) | ((i - start) << (1 + RUNNING_LENGTH_BITS))
+        )
+        buffer.extend(words[start:i])
+
+    return (
+        struct.pack(">II", bit_size, len(buffer))
+        + struct.pack(f">{len(buffer)}Q", *buffer)
+        + struct.pack(">I", last_marker)
+    )
+
+
+def set_bits(bits: int) -> List[int]:
+    # Positions of the set bits, lowest first
+    binary = bin(bits)[:1:-1]
+    positions: List[int] = []
+    pos = binary.find("1")
+    while pos >= 0:
+        positions.append(pos)
+        pos = binary.find("1", pos + 1)
+    return positions
+
+
+def read_ewah(data, pos: int) -> Tuple[int, int]:
+    return decode_ewah(data, pos), pos + ewah_size(data, pos)
@@ -3,6 +3,19 @@ import shutil
 from typing import Literal, Union, overload
 
 
+def _read_umask() -> int:
+    # The umask can only be read by setting it, which is done once at import,
+    # before any threads that create files are started
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Like git, object and pack files are read-only, and readable by whoever
+# the umask allows
+READ_ONLY_MODE = 0o444 & ~_read_umask()
+
+
 class GitFilesystem:
     def __init__(self, worktree: str, gitdir: str):
         self.worktree = os.path.realpath(worktree)
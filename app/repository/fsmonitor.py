@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .repository import GitRepository
+
+# A daemon that watches the worktree with inotify and tells clients which
+# paths changed since a token it handed out earlier. Tokens name the daemon
+# instance and a sequence number; a token from another instance, or from
+# before the kernel dropped events, gets "/" back, meaning everything.
+FSMONITOR_SOCKET = "fsmonitor--daemon.ipc"
+FSMONITOR_COOKIE_DIR = ("fsmonitor--daemon", "cookies")
+TOKEN_PREFIX = "mgit"
+EVERYTHING = "/"
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# wd, mask, cookie and name length, followed by the NUL-padded name
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+# (watch descriptor, event mask, name inside the watched directory)
+InotifyEvent = Tuple[int, int, str]
+
+
+class GitInotify:
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this system")
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._rm_watch.restype = ctypes.c_int
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str) -> Optional[int]:
+        # None when the directory is gone again before it could be watched
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        return wd if wd >= 0 else None
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)
+
+    def read(self) -> List[InotifyEvent]:
+        events: List[InotifyEvent] = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\x00"))
+                pos += length
+                events.append((wd, mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class GitFsmonitorDaemon:
+    def __init__(self, repo: GitRepository) -> None:
+        self.repo = repo
+        self.inotify = GitInotify()
+        self.server: Optional[socket.socket] = None
+        self.running = False
+
+        # Directory prefix ("" or ending in "/") of every watched directory
+        self.dirs: Dict[int, str] = {}
+        # Every path that changed, with the sequence number of its last change
+        self.changes: Dict[str, int] = {}
+        self.seq = 0
+        self.instance = f"{os.getpid()}.{time.time_ns()}"
+
+        # Before answering, the daemon creates a cookie file and waits for
+        # its event, so that every change made before the query is included
+        self.cookie_dir = self.repo.fs.dir_ensure(*FSMONITOR_COOKIE_DIR)
+        self.cookie_wd = self.inotify.add_watch(self.cookie_dir)
+        self.cookies = 0
+        self.pending: Dict[str, Tuple[socket.socket, str]] = {}
+
+        self.watch_tree("")
+
+    @property
+    def token(self) -> str:
+        return f"{TOKEN_PREFIX}:{self.instance}:{self.seq}"
+
+    def record(self, path: str) -> None:
+        self.seq += 1
+        self.changes[path] = self.seq
+
+    def watch_tree(self, prefix: str, report: bool = False) -> None:
+        # Watches the directory and everything below it; a directory that
+        # appears while running may already have files that had no watch yet
+        pending = [prefix]
+        while pending:
+            prefix = pending.pop()
+            path = os.path.join(self.repo.worktree, prefix)
+            wd = self.inotify.add_watch(path)
+            if wd is None:
+                continue
+            self.dirs[wd] = prefix
+
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.name == ".git":
+                    continue
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if report:
+                    self.record(prefix + entry.name + ("/" if is_dir else ""))
+                if is_dir:
+                    pending.append(prefix + entry.name + "/")
+
+    def unwatch_tree(self, prefix: str) -> None:
+        # A directory moved elsewhere keeps its watches, which would report
+        # changes under its old path
+        for wd, dir_prefix in list(self.dirs.items()):
+            if dir_prefix.startswith(prefix):
+                del self.dirs[wd]
+                self.inotify.rm_watch(wd)
+
+    def handle_events(self) -> None:
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so no earlier token can be answered
+                self.instance = f"{os.getpid()}.{time.time_ns()}"
+                self.changes.clear()
+                continue
+
+            if wd == self.cookie_wd:
+                if mask & IN_CREATE and name in self.pending:
+                    self.answer(name)
+                continue
+
+            prefix = self.dirs.get(wd)
+            if prefix is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                if not prefix:
+                    self.running = False
+                continue
+            if not name or name == ".git":
+                # Changes to a directory itself are reported by its parent
+                continue
+
+            path = prefix + name
+            if not mask & IN_ISDIR:
+                self.record(path)
+                continue
+
+            self.record(path + "/")
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                self.unwatch_tree(path + "/")
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path + "/", report=True)
+
+    def changed_since(self, token: str) -> List[str]:
+        parts = token.split(":")
+        if (
+            len(parts) != 3
+            or parts[0] != TOKEN_PREFIX
+            or parts[1] != self.instance
+            or not parts[2].isdigit()
+            or int(parts[2]) > self.seq
+        ):
+            return [EVERYTHING]
+
+        since = int(parts[2])
+        return [path for path, seq in self.changes.items() if seq > since]
+
+    def answer(self, cookie: str) -> None:
+        conn, token = self.pending.pop(cookie)
+        response = "\x00".join([self.token, *self.changed_since(token)])
+        try:
+            conn.sendall(response.encode("utf8", "surrogateescape"))
+        except OSError:
+            pass
+        finally:
+            conn.close()
+            os.remove(os.path.join(self.cookie_dir, cookie))
+
+    def handle_client(self, conn: socket.socket) -> None:
+        conn.settimeout(1.0)
+        try:
+            request = read_all(conn).decode("utf8", "surrogateescape")
+        except OSError:
+            conn.close()
+            return
+
+        command, _, argument = request.partition(" ")
+        if command == "query":
+            self.cookies += 1
+            cookie = f"{os.getpid()}-{self.cookies}"
+            self.pending[cookie] = (conn, argument)
+            open(os.path.join(self.cookie_dir, cookie), "w").close()
+            return
+
+        if command == "status":
+            conn.sendall(os.fsencode(self.repo.worktree))
+        elif command == "quit":
+            conn.sendall(b"ok")
+            self.running = False
+        conn.close()
+
+    def listen(self) -> None:
+        path = self.repo.fs.resolve(FSMONITOR_SOCKET)
+        if os.path.exists(path):
+            if fsmonitor_request(self.repo, "status") is not None:
+                raise Exception("fsmonitor--daemon is already running")
+            # Left behind by a daemon that did not shut down cleanly
+            os.remove(path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+
+    def serve(self) -> None:
+        assert self.server is not None
+        self.running = True
+        try:
+            while self.running:
+                readable, _, _ = select.select([self.inotify.fd, self.server], [], [])
+                if self.inotify.fd in readable:
+                    self.handle_events()
+                if self.server in readable:
+                    conn, _ = self.server.accept()
+                    self.handle_client(conn)
+        finally:
+            self.close()
+            os.remove(self.repo.fs.resolve(FSMONITOR_SOCKET))
+            # Clients still waiting get no answer and fall back to a full scan
+            for cookie, (conn, _) in self.pending.items():
+                conn.close()
+                os.remove(os.path.join(self.cookie_dir, cookie))
+
+    def close(self) -> None:
+        # The parent of a daemon started in the background drops its copies
+        if self.server is not None:
+            self.server.close()
+        self.inotify.close()
+
+
+def read_all(conn: socket.socket) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        data = conn.recv(READ_SIZE)
+        if not data:
+            return b"".join(chunks)
+        chunks.append(data)
+
+
+def fsmonitor_request(
+    repo: GitRepository, request: str, timeout: float = 5.0
+) -> Optional[bytes]:
+    # None when no daemon is listening for this repository
+    path = repo.fs.resolve(FSMONITOR_SOCKET)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(path)
+            conn.sendall(request.encode("utf8", "surrogateescape"))
+            conn.shutdown(socket.SHUT_WR)
+            return read_all(conn)
+    except OSError:
+        return None
+
+
+def query_fsmonitor(
+    repo: GitRepository, token: str
+) -> Optional[Tuple[str, Optional[List[str]]]]:
+    # The new token and the paths changed since the given one, or no paths
+    # when the daemon cannot tell and everything has to be looked at
+    response = fsmonitor_request(repo, f"query {token}")
+    if not response:
+        return None
+
+    new_token, *paths = response.decode("utf8", "surrogateescape").split("\x00")
+    if EVERYTHING in paths:
+        return new_token, None
+    return new_token, paths
+
+
+def start_fsmonitor_daemon(repo: GitRepository) -> int:
+    # Set up in the foreground so that errors are reported, then served by
+    # a detached child; the socket accepts queries as soon as this returns
+    daemon = GitFsmonitorDaemon(repo)
+    try:
+        daemon.listen()
+    except Exception:
+        daemon.close()
+        raise
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            daemon.serve()
+        finally:
+            os._exit(0)
+
+    daemon.close()
+    return pid
+
+
+def run_fsmonitor_daemon(repo: GitRepository) -> None:
+    daemon = GitFsmonitorDaemon(repo)
+    try:
+        daemon.listen()
+    except Exception:
+        daemon.close()
+        raise
+    daemon.serve()
+
+
+def stop_fsmonitor_daemon(repo: GitRepository) -> bool:
+    return fsmonitor_request(repo, "quit") is not None
@@ -16,14 +16,15 @@ class GitIgnore:
         self.scoped = scoped
 
     @staticmethod
-    def _check_rules(rules: List[Rule], path: str) -> Optional[bool]:
+    def _check_rules(rules: List[Rule], path: str, is_dir: bool) -> Optional[bool]:
         result = None
         for pattern, is_ignored in rules:
-            if fnmatch(path, pattern):
+            # Patterns ending in a slash only match directories
+            if fnmatch(path, pattern) or (is_dir and fnmatch(path + "/", pattern)):
                 result = is_ignored
         return result
 
-    def check_ignore(self, path: str) -> bool:
+    def check_ignore(self, path: str, is_dir: bool = False) -> bool:
         if os.path.isabs(path):
             raise ValueError(
                 "The path should be relative to the root of the repository"
@@ -32,18 +33,18 @@ class GitIgnore:
         parent = os.path.dirname(path)
         while True:
             if parent in self.scoped:
-                result = self._check_rules(self.scoped[parent], path)
+                result = self._check_rules(self.scoped[parent], path, is_dir)
                 if result is not None:
                     return result
             if not parent:
                 break
             parent = os.path.dirname(parent)
 
-        result = self._check_rules(self.absolute, path)
+        result = self._check_rules(self.absolute, path, is_dir)
         return result if result is not None else False
 
     @classmethod
-    def read(cls, repo: GitRepository) -> GitIgnore:
+    def read(cls, repo: GitRepository, index: Optional[GitIndex] = None) -> GitIgnore:
         absolute_rules: List[Rule] = []
         scoped_rules: Dict[str, List[Rule]] = {}
 
@@ -53,17 +54,17 @@ class GitIgnore:
         except FileNotFoundError:
             pass
 
-        config_home = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
-        global_file = os.path.join(config_home, "git/ignore")
+        global_file = global_ignore_path()
         if os.path.exists(global_file):
             with open(global_file, "r") as f:
                 absolute_rules.extend(cls._parse_lines(f.readlines()))
 
-        index = GitIndex.read(repo)
-        for entry in index.entries:
-            if entry.name == ".gitignore" or entry.name.endswith("/.gitignore"):
-                dir_name = os.path.dirname(entry.name)
-                blob = repo.objects.read(entry.sha)
+        if index is None:
+            index = GitIndex.read(repo)
+        for i, name in enumerate(index.names):
+            if name == ".gitignore" or name.endswith("/.gitignore"):
+                dir_name = os.path.dirname(name)
+                blob = repo.objects.read(index.sha(i))
                 if isinstance(blob, GitBlob):
                     content = blob.data.decode("utf8")
                     scoped_rules[dir_name] = cls._parse_lines(content.splitlines())
@@ -93,3 +94,8 @@ class GitIgnore:
             return (line[1:], True)
 
         return (line, True)
+
+
+def global_ignore_path() -> str:
+    config_home = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+    return os.path.join(config_home, "git/ignore")
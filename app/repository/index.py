@@ -1,15 +1,116 @@
 from __future__ import annotations
 
 import hashlib
-from math import ceil
-from typing import List, Optional, Tuple
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from stat import S_ISLNK
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from app.cli import logger
-from app.repository import GitRepository
+from app.repository import GitObjects, GitRepository
+
+from .cache_tree import CACHE_TREE_SIGNATURE, GitCacheTree
+from .ewah import encode_ewah, read_ewah, set_bits
+from .untracked_cache import UNTRACKED_CACHE_SIGNATURE, GitUntrackedCache
+from .varint import decode_varint, encode_varint
+
+INDEX_HEADER = struct.Struct(">II")
+INDEX_HEADER_SIZE = 4 + INDEX_HEADER.size
+EXTENSION_HEADER = struct.Struct(">4sI")
+
+# Every entry starts with ten 32-bit stat words, the oid and 16 bits of flags
+STAT_WORDS = 10
+STAT_MTIME = 2
+STAT_MODE = 6
+STAT_FSIZE = 9
+STAT_SIZE = STAT_WORDS * 4
+SHA_SIZE = 20
+ENTRY_STATS = struct.Struct(f">{STAT_WORDS}I")
+ENTRY_FLAGS = struct.Struct(">H")
+FLAGS_OFFSET = STAT_SIZE + SHA_SIZE
+ENTRY_HEADER_SIZE = FLAGS_OFFSET + ENTRY_FLAGS.size
+
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE = 0x3000
+NAME_MASK = 0xFFF
+
+# Versions 3 and 4 add 16 more bits of flags to entries with FLAG_EXTENDED set
+EXTENDED_SKIP_WORKTREE = 0x4000
+EXTENDED_INTENT_TO_ADD = 0x2000
+EXTENDED_UNUSED = 0x1FFF
+
+SUPPORTED_VERSIONS = (2, 3, 4)
+
+# The FSMN extension: the token of the last filesystem monitor query and a
+# bitmap of the entries the monitor cannot vouch for
+FSMONITOR_SIGNATURE = b"FSMN"
+FSMONITOR_VERSION_TIMESTAMP = 1
+FSMONITOR_VERSION_TOKEN = 2
+FSMONITOR_DIRTY = bytes.maketrans(b"\x00\x01", b"10")
+
+# An entry with size 0 and any other blob was smudged as racily clean
+EMPTY_BLOB_OID = bytes.fromhex("e69de29bb2d1d6434b8b29ae775ad8c2e48c5391")
+GITLINK_MODE_TYPE = 0b1110
+
+# NUL bytes ending an entry of the given length modulo 8
+PADDING = [b"\x00" * (8 - n) for n in range(8)]
 
 Timestamp = Tuple[int, int]
 
 
+class IndexLocked(Exception):
+    pass
+
+
+class GitIndexLock:
+    # index.lock, created exclusively. Taken before the index is read and
+    # held until the new index is renamed over the old one, so that no other
+    # process can write the index in between and have its changes undone.
+    def __init__(self, repo: GitRepository) -> None:
+        self.index_path = repo.fs.resolve("index")
+        self.path = self.index_path + ".lock"
+        self.fd: Optional[int] = None
+
+    def acquire(self) -> GitIndexLock:
+        try:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            raise IndexLocked(
+                f"Unable to create '{self.path}': File exists. "
+                "Another mgit process seems to be running in this repository"
+            )
+        return self
+
+    def commit(self, content: bytes) -> None:
+        # The new index is written to the lock file and renamed into place,
+        # which also releases the lock
+        assert self.fd is not None, "index.lock is not held"
+        fd, self.fd = self.fd, None
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(self.path, self.index_path)
+        except BaseException:
+            os.remove(self.path)
+            raise
+
+    def release(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            os.remove(self.path)
+
+    def __enter__(self) -> GitIndexLock:
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
 class GitIndexEntry:
     def __init__(
         self,
@@ -26,6 +127,8 @@ class GitIndexEntry:
         assume_valid: bool,
         stage: int,
         name: str,
+        skip_worktree: bool = False,
+        intent_to_add: bool = False,
     ):
         self.ctime = ctime
         self.mtime = mtime
@@ -40,150 +143,593 @@ class GitIndexEntry:
         self.assume_valid = assume_valid
         self.stage = stage
         self.name = name
+        self.skip_worktree = skip_worktree
+        self.intent_to_add = intent_to_add
+
+    @classmethod
+    def from_stat(cls, name: str, sha: str, stat: os.stat_result) -> GitIndexEntry:
+        # Symbolic links are recorded as links, with no permissions
+        is_link = S_ISLNK(stat.st_mode)
+        return cls(
+            ctime=split_ns(stat.st_ctime_ns),
+            mtime=split_ns(stat.st_mtime_ns),
+            dev=stat.st_dev,
+            ino=stat.st_ino,
+            mode_type=0b1010 if is_link else 0b1000,
+            mode_perms=0 if is_link else 0o644,
+            uid=stat.st_uid,
+            gid=stat.st_gid,
+            fsize=stat.st_size,
+            sha=sha,
+            assume_valid=False,
+            stage=0,
+            name=name,
+        )
+
+
+def split_ns(ns: int) -> Timestamp:
+    return ns // 10**9, ns % 10**9
 
 
 class GitIndex:
-    def __init__(self, version: int = 2, entries: Optional[List[GitIndexEntry]] = None):
+    # Entries are kept column by column: the ten 32-bit stat words of every
+    # entry in one array, raw 20-byte oids, flags, extended flags and names in
+    # sorted order. GitIndexEntry objects are only built for entries that are
+    # looked at.
+    def __init__(
+        self,
+        version: int = 2,
+        entries: Optional[List[GitIndexEntry]] = None,
+        mtime: Optional[Timestamp] = None,
+    ):
         self.version = version
-        self.entries = entries if entries is not None else []
+        self._stats = array("I")
+        self._oids: List[bytes] = []
+        self._flags = array("H")
+        self._extended = array("H")
+        self._names: List[str] = []
+        # Each entry as it was read or last written in the current version, so
+        # that saving the index only encodes entries that changed; None for
+        # entries still to encode
+        self._records: List[Optional[bytes]] = []
+        self.cache_tree: Optional[GitCacheTree] = None
+        self.untracked_cache: Optional[GitUntrackedCache] = None
+        # Entries known unchanged since the token, according to the monitor
+        self.fsmonitor_token: Optional[str] = None
+        self._fsmonitor_valid = bytearray()
+        # When the index file was last written, used to detect racily clean entries
+        self.mtime = mtime
+        # Entries whose stat data was checked against their contents since
+        self._uptodate: Set[str] = set()
+
+        if entries:
+            self.update(entries)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> Iterator[GitIndexEntry]:
+        for i in range(len(self._names)):
+            yield self.entry(i)
+
+    @property
+    def names(self) -> List[str]:
+        return self._names
+
+    def find(self, name: str) -> Optional[int]:
+        i = bisect_left(self._names, name)
+        if i < len(self._names) and self._names[i] == name:
+            return i
+        return None
+
+    def sha(self, i: int) -> str:
+        return self._oids[i].hex()
+
+    def oid(self, i: int) -> bytes:
+        return self._oids[i]
+
+    def mode(self, i: int) -> int:
+        return self._stats[i * STAT_WORDS + STAT_MODE] & 0xFFFF
+
+    def mode_type(self, i: int) -> int:
+        return self.mode(i) >> 12
+
+    def times(self, i: int) -> Tuple[Timestamp, Timestamp]:
+        # ctime and mtime, without building the whole entry
+        k = i * STAT_WORDS
+        ctime_s, ctime_ns, mtime_s, mtime_ns = self._stats[k : k + 4]
+        return (ctime_s, ctime_ns), (mtime_s, mtime_ns)
+
+    def entry(self, i: int) -> GitIndexEntry:
+        k = i * STAT_WORDS
+        (
+            ctime_s,
+            ctime_ns,
+            mtime_s,
+            mtime_ns,
+            dev,
+            ino,
+            mode,
+            uid,
+            gid,
+            fsize,
+        ) = self._stats[k : k + STAT_WORDS]
+        mode &= 0xFFFF
+        flags = self._flags[i]
+        extended = self._extended[i]
+
+        return GitIndexEntry(
+            ctime=(ctime_s, ctime_ns),
+            mtime=(mtime_s, mtime_ns),
+            dev=dev,
+            ino=ino,
+            mode_type=mode >> 12,
+            mode_perms=mode & 0o777,
+            uid=uid,
+            gid=gid,
+            fsize=fsize,
+            sha=self._oids[i].hex(),
+            assume_valid=bool(flags & FLAG_ASSUME_VALID),
+            stage=(flags & FLAG_STAGE) >> 12,
+            name=self._names[i],
+            skip_worktree=bool(extended & EXTENDED_SKIP_WORKTREE),
+            intent_to_add=bool(extended & EXTENDED_INTENT_TO_ADD),
+        )
+
+    def _append(self, entry: GitIndexEntry) -> None:
+        self._stats.extend(_stat_words(entry))
+        self._oids.append(bytes.fromhex(entry.sha))
+        self._flags.append(_flags(entry))
+        self._extended.append(_extended_flags(entry))
+        self._names.append(entry.name)
+        self._records.append(None)
+        self._fsmonitor_valid.append(0)
+
+    def update(self, entries: Iterable[GitIndexEntry]) -> None:
+        # Entries replace the ones with the same name in place; new names are
+        # appended and the columns sorted once at the end
+        added: Dict[str, GitIndexEntry] = {}
+        for entry in entries:
+            self._uptodate.add(entry.name)
+            i = self.find(entry.name)
+            if i is None:
+                added[entry.name] = entry
+                self._invalidate(entry.name)
+                continue
+
+            oid = bytes.fromhex(entry.sha)
+            stats = _stat_words(entry)
+            if oid != self._oids[i] or stats[STAT_MODE] != self.mode(i):
+                self._invalidate(entry.name)
+
+            k = i * STAT_WORDS
+            self._stats[k : k + STAT_WORDS] = array("I", stats)
+            self._oids[i] = oid
+            self._flags[i] = _flags(entry)
+            self._extended[i] = _extended_flags(entry)
+            self._records[i] = None
+            self._fsmonitor_valid[i] = 0
+
+        if added:
+            for entry in added.values():
+                self._append(entry)
+            self._sort()
+
+    def remove(self, names: Set[str]) -> None:
+        for name in names:
+            self._invalidate(name)
+        self._select([i for i, name in enumerate(self._names) if name not in names])
+
+    def _invalidate(self, name: str) -> None:
+        if self.cache_tree is not None:
+            self.cache_tree.invalidate(name)
+        if self.untracked_cache is not None:
+            self.untracked_cache.invalidate(name)
+
+    def _sort(self) -> None:
+        self._select(sorted(range(len(self._names)), key=self._names.__getitem__))
+
+    def _select(self, order: List[int]) -> None:
+        stats = self._stats
+        self._stats = array("I")
+        for i in order:
+            self._stats.extend(stats[i * STAT_WORDS : (i + 1) * STAT_WORDS])
+        self._oids = [self._oids[i] for i in order]
+        self._flags = array("H", [self._flags[i] for i in order])
+        self._extended = array("H", [self._extended[i] for i in order])
+        self._names = [self._names[i] for i in order]
+        self._fsmonitor_valid = bytearray([self._fsmonitor_valid[i] for i in order])
+        records = self._records
+        if self.version == 4:
+            # Names are stored relative to the previous entry, so an entry
+            # that follows a different one than before has to be encoded again
+            self._records = [
+                records[i] if i == (order[n - 1] + 1 if n else 0) else None
+                for n, i in enumerate(order)
+            ]
+        else:
+            self._records = [records[i] for i in order]
+
+    def matches_stat(self, i: int, stat: os.stat_result) -> bool:
+        k = i * STAT_WORDS
+        ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, _, uid, gid, fsize = (
+            self._stats[k : k + STAT_WORDS]
+        )
+        if fsize == 0 and self._oids[i] != EMPTY_BLOB_OID:
+            return False
+        return (
+            (mtime_s, mtime_ns) == split_ns(stat.st_mtime_ns)
+            and (ctime_s, ctime_ns) == split_ns(stat.st_ctime_ns)
+            and fsize == stat.st_size & 0xFFFFFFFF
+            and ino == stat.st_ino & 0xFFFFFFFF
+            and dev == stat.st_dev & 0xFFFFFFFF
+            and uid == stat.st_uid & 0xFFFFFFFF
+            and gid == stat.st_gid & 0xFFFFFFFF
+        )
+
+    def refresh(self, i: int, stat: os.stat_result) -> None:
+        # Records new stat data for an entry whose contents were found to be
+        # unchanged; everything else about the entry stays as it is
+        entry = self.entry(i)
+        entry.ctime = split_ns(stat.st_ctime_ns)
+        entry.mtime = split_ns(stat.st_mtime_ns)
+        entry.dev = stat.st_dev
+        entry.ino = stat.st_ino
+        entry.uid = stat.st_uid
+        entry.gid = stat.st_gid
+        entry.fsize = stat.st_size
+
+        k = i * STAT_WORDS
+        self._stats[k : k + STAT_WORDS] = array("I", _stat_words(entry))
+        self._records[i] = None
+        self._uptodate.add(entry.name)
+
+    def fsmonitor_valid(self, i: int) -> bool:
+        return bool(self._fsmonitor_valid[i])
+
+    def mark_fsmonitor_valid(self, i: int) -> None:
+        if self.fsmonitor_token is not None:
+            self._fsmonitor_valid[i] = 1
+
+    def invalidate_fsmonitor(self, path: str) -> None:
+        # Paths are reported for files and directories alike, a directory
+        # with a trailing slash when the monitor knows it is one
+        name = path.rstrip("/")
+        i = self.find(name)
+        if i is not None:
+            self._fsmonitor_valid[i] = 0
+
+        prefix = name + "/" if name else ""
+        i = bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            self._fsmonitor_valid[i] = 0
+            i += 1
+
+    def clear_fsmonitor(self) -> None:
+        self.fsmonitor_token = None
+        self._fsmonitor_valid = bytearray(len(self._names))
+
+    def is_racy(self, mtime: Timestamp) -> bool:
+        # A file modified in the same timestamp tick the index was written in
+        # can have changed without its stat data showing it
+        return self.mtime is not None and mtime >= self.mtime
 
     @classmethod
     def read(cls, repo: GitRepository) -> GitIndex:
         if not repo.fs.file_exists("index"):
             return cls()
 
+        mtime = split_ns(os.stat(repo.fs.resolve("index")).st_mtime_ns)
         raw: bytes = repo.fs.file_read("index", binary=True)
-        header = raw[:12]
 
-        if header[:4] != b"DIRC":
+        if raw[:4] != b"DIRC":
             raise ValueError("Invalid index file signature")
 
-        version = int.from_bytes(header[4:8], "big")
-        if version != 2:
-            raise ValueError("mgit only supports index file version 2")
-
-        count = int.from_bytes(header[8:12], "big")
-        entries: List[GitIndexEntry] = []
-        content = raw[12:]
-        idx = 0
-
-        for i in range(count):
-            ctime_s = int.from_bytes(content[idx : idx + 4], "big")
-            ctime_ns = int.from_bytes(content[idx + 4 : idx + 8], "big")
-            mtime_s = int.from_bytes(content[idx + 8 : idx + 12], "big")
-            mtime_ns = int.from_bytes(content[idx + 12 : idx + 16], "big")
-            dev = int.from_bytes(content[idx + 16 : idx + 20], "big")
-            ino = int.from_bytes(content[idx + 20 : idx + 24], "big")
-            unused = int.from_bytes(content[idx + 24 : idx + 26], "big")
-            if unused != 0:
-                logger.warning(f"Index entry {i} has non-zero unused field")
-
-            mode = int.from_bytes(content[idx + 26 : idx + 28], "big")
-            mode_type = mode >> 12
-            if mode_type not in [0b1000, 0b1010, 0b1110]:
-                raise ValueError(f"Unknown index entry mode type: {mode_type}")
-            mode_perms = mode & 0o777
-
-            uid = int.from_bytes(content[idx + 28 : idx + 32], "big")
-            gid = int.from_bytes(content[idx + 32 : idx + 36], "big")
-            fsize = int.from_bytes(content[idx + 36 : idx + 40], "big")
-            sha = format(int.from_bytes(content[idx + 40 : idx + 60], "big"), "040x")
-            flags = int.from_bytes(content[idx + 60 : idx + 62], "big")
-
-            assume_valid = (flags & 0b1000000000000000) != 0
-            extended = (flags & 0b0100000000000000) != 0
-            if extended:
-                logger.warning(f"Index entry {i} has unsupported extended flags")
-            stage = (flags & 0b0011000000000000) >> 12
-            name_length = flags & 0b0000111111111111
-
-            idx += 62
-
-            if name_length < 0xFFF:
-                raw_name = content[idx : idx + name_length]
-                idx += name_length
-                if content[idx] != 0x00:
-                    raise ValueError("Index entry name not null-terminated")
-                idx += 1
-            else:
-                null_idx = content.find(b"\x00", idx + name_length)
-                if null_idx == -1:
-                    raise ValueError("Long index entry name not null-terminated")
-                raw_name = content[idx:null_idx]
-                idx = null_idx + 1
-
-            name = raw_name.decode("utf8")
-            padding_needed = 8 * ceil(idx / 8) - idx
-            idx += padding_needed
-
-            entries.append(
-                GitIndexEntry(
-                    ctime=(ctime_s, ctime_ns),
-                    mtime=(mtime_s, mtime_ns),
-                    dev=dev,
-                    ino=ino,
-                    mode_type=mode_type,
-                    mode_perms=mode_perms,
-                    uid=uid,
-                    gid=gid,
-                    fsize=fsize,
-                    sha=sha,
-                    assume_valid=assume_valid,
-                    stage=stage,
-                    name=name,
+        version, count = INDEX_HEADER.unpack_from(raw, 4)
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported index file version: {version}")
+
+        index = cls(version=version, mtime=mtime)
+
+        # Only the flags and names are looked at one entry at a time, to find
+        # where each entry starts; the columns are then filled in bulk
+        starts: List[int] = []
+        extended: List[Tuple[int, int]] = []
+        pos = INDEX_HEADER_SIZE
+        if version == 4:
+            names: List[bytes] = []
+            previous = b""
+            for i in range(count):
+                starts.append(pos)
+                flags = (raw[pos + FLAGS_OFFSET] << 8) | raw[pos + FLAGS_OFFSET + 1]
+                pos += ENTRY_HEADER_SIZE
+                if flags & FLAG_EXTENDED:
+                    extended.append((i, ENTRY_FLAGS.unpack_from(raw, pos)[0]))
+                    pos += ENTRY_FLAGS.size
+                # Each name is the previous one with some bytes dropped from
+                # its end and a NUL-terminated suffix appended
+                strip, pos = decode_varint(raw, pos)
+                end = raw.find(b"\x00", pos)
+                if strip > len(previous) or end == -1:
+                    raise ValueError(f"Corrupt path in index entry {i}")
+                previous = previous[: len(previous) - strip] + raw[pos:end]
+                names.append(previous)
+                pos = end + 1
+            ends = starts[1:] + [pos]
+        else:
+            name_starts: List[int] = []
+            for i in range(count):
+                starts.append(pos)
+                flags = (raw[pos + FLAGS_OFFSET] << 8) | raw[pos + FLAGS_OFFSET + 1]
+                name_start = pos + ENTRY_HEADER_SIZE
+                if flags & FLAG_EXTENDED:
+                    extended.append((i, ENTRY_FLAGS.unpack_from(raw, name_start)[0]))
+                    name_start += ENTRY_FLAGS.size
+                name_starts.append(name_start)
+                name_length = flags & NAME_MASK
+                if name_length == NAME_MASK:
+                    end = raw.find(b"\x00", name_start + NAME_MASK)
+                    if end == -1:
+                        raise ValueError("Long index entry name not null-terminated")
+                    name_length = end - name_start
+                # Entries are padded with 1 to 8 NUL bytes to a multiple of 8
+                pos += (name_start - pos + name_length + 8) & ~7
+            ends = starts[1:] + [pos]
+
+            # Names never contain NUL, so stripping the padding leaves the name
+            names = [
+                raw[start:end].rstrip(b"\x00") for start, end in zip(name_starts, ends)
+            ]
+
+        if extended and version == 2:
+            raise ValueError("Index version 2 cannot have extended flags")
+
+        records: List[Optional[bytes]] = [
+            raw[start:end] for start, end in zip(starts, ends)
+        ]
+        index._records = records
+
+        if names:
+            index._names = b"\x00".join(names).decode("utf8").split("\x00")
+
+        stats = index._stats
+        stats.frombytes(b"".join([raw[s : s + STAT_SIZE] for s in starts]))
+        index._oids = [raw[s + STAT_SIZE : s + FLAGS_OFFSET] for s in starts]
+        index._flags.frombytes(
+            b"".join([raw[s + FLAGS_OFFSET : s + ENTRY_HEADER_SIZE] for s in starts])
+        )
+        if sys.byteorder == "little":
+            stats.byteswap()
+            index._flags.byteswap()
+
+        index._extended = array("H", bytes(2 * count))
+        for i, value in extended:
+            if value & EXTENDED_UNUSED:
+                raise ValueError(f"Unknown extended flags in index entry {i}")
+            index._extended[i] = value
+
+        for mode in set(stats[STAT_MODE::STAT_WORDS]):
+            if mode >> 16:
+                logger.warning("Index entry has non-zero unused field")
+            if (mode & 0xFFFF) >> 12 not in [0b1000, 0b1010, 0b1110]:
+                raise ValueError(
+                    f"Unknown index entry mode type: {(mode & 0xFFFF) >> 12}"
                 )
-            )
-
-        return cls(version=version, entries=entries)
-
-    def write(self, repo: GitRepository):
-        content = bytearray()
 
-        content += b"DIRC"
-        content += self.version.to_bytes(4, "big")
-        content += len(self.entries).to_bytes(4, "big")
-
-        idx = 0
-
-        for entry in self.entries:
-            content += entry.ctime[0].to_bytes(4, "big")
-            content += entry.ctime[1].to_bytes(4, "big")
-            content += entry.mtime[0].to_bytes(4, "big")
-            content += entry.mtime[1].to_bytes(4, "big")
-            content += entry.dev.to_bytes(4, "big")
-            content += entry.ino.to_bytes(4, "big")
-
-            mode = (entry.mode_type << 12) | entry.mode_perms
-            content += mode.to_bytes(4, "big")
-
-            content += entry.uid.to_bytes(4, "big")
-            content += entry.gid.to_bytes(4, "big")
-
-            content += entry.fsize.to_bytes(4, "big")
-            content += int(entry.sha, 16).to_bytes(20, "big")
-
-            assume_valid = 0x1 << 15 if entry.assume_valid else 0
-
-            name_bytes = entry.name.encode("utf8")
-            bytes_len = len(name_bytes)
-            if bytes_len >= 0xFFF:
-                name_length = 0xFFF
-            else:
-                name_length = bytes_len
-
-            content += (assume_valid | entry.stage | name_length).to_bytes(2, "big")
-
-            content += name_bytes
-            content += (0).to_bytes(1, "big")
-
-            idx += 62 + len(name_bytes) + 1
-
-            if idx % 8 != 0:
-                pad = 8 - (idx % 8)
-                content += (0).to_bytes(pad, "big")
-                idx += pad
-
-        checksum = hashlib.sha1(content).digest()
-        content += checksum
+        index._fsmonitor_valid = bytearray(count)
+        index._read_extensions(raw, pos)
+
+        return index
+
+    def _read_extensions(self, raw: bytes, pos: int) -> None:
+        end = len(raw) - SHA_SIZE
+        while pos + EXTENSION_HEADER.size <= end:
+            signature, size = EXTENSION_HEADER.unpack_from(raw, pos)
+            pos += EXTENSION_HEADER.size
+            data = raw[pos : pos + size]
+            pos += size
+
+            if signature == CACHE_TREE_SIGNATURE:
+                self.cache_tree = GitCacheTree.parse(data)
+            elif signature == UNTRACKED_CACHE_SIGNATURE:
+                self.untracked_cache = GitUntrackedCache.parse(data)
+            elif signature == FSMONITOR_SIGNATURE:
+                self._read_fsmonitor(data)
+            elif not b"A" <= signature[:1] <= b"Z":
+                # Extensions not starting with a capital letter are required
+                raise ValueError(
+                    f"Index uses the unsupported {signature.decode(errors='replace')}"
+                    " extension"
+                )
 
-        repo.fs.file_write("index", content=bytes(content), root="git", overwrite=True)
+    def _read_fsmonitor(self, data: bytes) -> None:
+        version = struct.unpack_from(">I", data)[0]
+        if version == FSMONITOR_VERSION_TIMESTAMP:
+            token = str(struct.unpack_from(">Q", data, 4)[0])
+            pos = 12
+        elif version == FSMONITOR_VERSION_TOKEN:
+            end = data.index(b"\x00", 4)
+            token = data[4:end].decode("utf8")
+            pos = end + 1
+        else:
+            raise ValueError(f"Unsupported fsmonitor extension version: {version}")
+
+        dirty, _ = read_ewah(data, pos + 4)
+        if dirty.bit_length() > len(self._names):
+            raise ValueError("fsmonitor bitmap has more entries than the index")
+
+        self.fsmonitor_token = token
+        self._fsmonitor_valid = bytearray(b"\x01" * len(self._names))
+        for i in set_bits(dirty):
+            self._fsmonitor_valid[i] = 0
+
+    def _encode_fsmonitor(self) -> bytes:
+        assert self.fsmonitor_token is not None
+        dirty = 0
+        if self._fsmonitor_valid:
+            # Bit n is set when entry n is not valid, lowest bit first
+            digits = self._fsmonitor_valid.translate(FSMONITOR_DIRTY)
+            dirty = int(digits[::-1], 2)
+        bitmap = encode_ewah(dirty)
+        return b"".join(
+            [
+                struct.pack(">I", FSMONITOR_VERSION_TOKEN),
+                self.fsmonitor_token.encode("utf8") + b"\x00",
+                struct.pack(">I", len(bitmap)),
+                bitmap,
+            ]
+        )
+
+    def _encode(self, i: int) -> bytes:
+        k = i * STAT_WORDS
+        name = self._names[i].encode("utf8")
+        parts = [
+            ENTRY_STATS.pack(*self._stats[k : k + STAT_WORDS]),
+            self._oids[i],
+            ENTRY_FLAGS.pack(self._flags[i]),
+        ]
+        if self._flags[i] & FLAG_EXTENDED:
+            parts.append(ENTRY_FLAGS.pack(self._extended[i]))
+
+        if self.version == 4:
+            previous = self._names[i - 1].encode("utf8") if i else b""
+            common = _common_prefix_length(previous, name)
+            parts += [
+                encode_varint(len(previous) - common),
+                name[common:],
+                b"\x00",
+            ]
+        else:
+            size = sum(len(part) for part in parts) + len(name)
+            parts += [name, PADDING[size & 7]]
+
+        return b"".join(parts)
+
+    def _smudge_racily_clean(self, repo: GitRepository) -> None:
+        # An entry modified in the tick the index was last written in looks
+        # clean as long as that index is around. The index written now is
+        # newer, so such an entry that was not checked since and whose
+        # contents did change gets size 0, which no stat data matches.
+        if self.mtime is None:
+            return
+        mtimes = self._stats[STAT_MTIME::STAT_WORDS]
+        for i, mtime_s in enumerate(mtimes):
+            if mtime_s < self.mtime[0] or not self.is_racy(self.times(i)[1]):
+                continue
+            name = self._names[i]
+            k = i * STAT_WORDS
+            if (
+                name in self._uptodate
+                or self._stats[k + STAT_FSIZE] == 0
+                or self.mode_type(i) == GITLINK_MODE_TYPE
+            ):
+                continue
+
+            path = os.path.join(repo.worktree, name)
+            try:
+                sha = GitObjects.hash_path(path, os.lstat(path))
+            except OSError:
+                sha = None
+            if sha != self.sha(i):
+                self._stats[k + STAT_FSIZE] = 0
+                self._records[i] = None
+
+    def write(self, repo: GitRepository, lock: Optional[GitIndexLock] = None):
+        # Callers that read the index to write it back pass the lock they took
+        # before reading; otherwise it is only held for the write itself
+        self._smudge_racily_clean(repo)
+
+        version = self.configured_version(repo)
+        if version in (2, 3):
+            # Version 3 is only needed when some entry has extended flags
+            version = 3 if any(self._extended) else 2
+        if version != self.version:
+            self.version = version
+            self._records = [None] * len(self._names)
+
+        encoded: List[bytes] = []
+        for i, record in enumerate(self._records):
+            if record is None:
+                record = self._records[i] = self._encode(i)
+            encoded.append(record)
+
+        content = b"".join(
+            [b"DIRC", INDEX_HEADER.pack(self.version, len(encoded)), *encoded]
+        )
+        if self.cache_tree is not None:
+            content += self._extension(CACHE_TREE_SIGNATURE, self.cache_tree.encode())
+        if self.untracked_cache is not None:
+            content += self._extension(
+                UNTRACKED_CACHE_SIGNATURE, self.untracked_cache.encode()
+            )
+            self.untracked_cache.changed = False
+        if self.fsmonitor_token is not None:
+            content += self._extension(FSMONITOR_SIGNATURE, self._encode_fsmonitor())
+        content += hashlib.sha1(content).digest()
+
+        if lock is not None:
+            lock.commit(content)
+        else:
+            with GitIndexLock(repo) as lock:
+                lock.commit(content)
+        self.mtime = split_ns(os.stat(repo.fs.resolve("index")).st_mtime_ns)
+
+    @staticmethod
+    def _extension(signature: bytes, data: bytes) -> bytes:
+        return EXTENSION_HEADER.pack(signature, len(data)) + data
+
+    def configured_version(self, repo: GitRepository) -> int:
+        # index.version wins; feature.manyFiles asks for the smallest format
+        version = repo.config.get("index", "version", fallback=None)
+        if version is None:
+            if repo.config.getboolean("feature", "manyFiles", fallback=False):
+                return 4
+            return self.version
+
+        if not version.strip().isdigit() or int(version) not in SUPPORTED_VERSIONS:
+            logger.warning(
+                "index.version set, but the value is invalid. "
+                f"Using version {self.version}"
+            )
+            return self.version
+        return int(version)
+
+
+def _stat_words(entry: GitIndexEntry) -> Tuple[int, ...]:
+    # Fields are stored truncated to 32 bits in the index file
+    return tuple(
+        value & 0xFFFFFFFF
+        for value in (
+            entry.ctime[0],
+            entry.ctime[1],
+            entry.mtime[0],
+            entry.mtime[1],
+            entry.dev,
+            entry.ino,
+            (entry.mode_type << 12) | entry.mode_perms,
+            entry.uid,
+            entry.gid,
+            entry.fsize,
+        )
+    )
+
+
+def _flags(entry: GitIndexEntry) -> int:
+    name_length = min(len(entry.name.encode("utf8")), NAME_MASK)
+    assume_valid = FLAG_ASSUME_VALID if entry.assume_valid else 0
+    extended = FLAG_EXTENDED if _extended_flags(entry) else 0
+    return assume_valid | extended | (entry.stage << 12) | name_length
+
+
+def _extended_flags(entry: GitIndexEntry) -> int:
+    skip_worktree = EXTENDED_SKIP_WORKTREE if entry.skip_worktree else 0
+    intent_to_add = EXTENDED_INTENT_TO_ADD if entry.intent_to_add else 0
+    return skip_worktree | intent_to_add
+
+
+def _common_prefix_length(a: bytes, b: bytes) -> int:
+    # The highest differing bit of the two as numbers gives the first byte
+    # they differ in
+    n = min(len(a), len(b))
+    diff = int.from_bytes(a[:n], "big") ^ int.from_bytes(b[:n], "big")
+    return n - (diff.bit_length() + 7) // 8
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from .chunk_format import chunk_file, fanout_table, read_chunks, write_atomic
+from .pack import (
+    SHA_SIZE,
+    GitPack,
+    find_oid,
+    map_file,
+    oids_with_prefix,
+)
+
+MIDX_FILE = "multi-pack-index"
+MIDX_SIGNATURE = b"MIDX"
+
+CHUNK_PACK_NAMES = b"PNAM"
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_OBJECT_OFFSETS = b"OOFF"
+CHUNK_LARGE_OFFSETS = b"LOFF"
+
+HEADER_SIZE = 12
+
+
+class GitMultiPackIndex:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        data = map_file(path)
+
+        if data[:4] != MIDX_SIGNATURE:
+            raise ValueError(f"Invalid multi-pack-index signature: {path}")
+        version, oid_version, chunk_count, base_count, pack_count = (
+            struct.unpack_from(">BBBBI", data, 4)
+        )
+        if version != 1:
+            raise ValueError(f"Unsupported multi-pack-index version: {version}")
+        if oid_version != 1:
+            raise ValueError("mgit only supports SHA-1 multi-pack-indexes")
+        if base_count != 0:
+            raise ValueError("mgit does not support incremental multi-pack-indexes")
+
+        chunks = read_chunks(data, HEADER_SIZE, chunk_count)
+        for required in (
+            CHUNK_PACK_NAMES,
+            CHUNK_OID_FANOUT,
+            CHUNK_OID_LOOKUP,
+            CHUNK_OBJECT_OFFSETS,
+        ):
+            if required not in chunks:
+                raise ValueError(f"multi-pack-index is missing {required.decode()}")
+
+        start, end = chunks[CHUNK_PACK_NAMES]
+        names = data[start:end].split(b"\0")
+        self.pack_names = [name.decode("utf-8") for name in names if name]
+        if len(self.pack_names) != pack_count:
+            raise ValueError("multi-pack-index pack count mismatch")
+
+        self._fanout = struct.unpack_from(">256I", data, chunks[CHUNK_OID_FANOUT][0])
+        self._oids = chunks[CHUNK_OID_LOOKUP][0]
+        self._offsets = chunks[CHUNK_OBJECT_OFFSETS][0]
+        self._large_offsets = chunks.get(CHUNK_LARGE_OFFSETS, (0, 0))[0]
+        self._data = data
+
+    def __len__(self) -> int:
+        return self._fanout[255]
+
+    def close(self) -> None:
+        self._data.close()
+
+    def oid(self, n: int) -> bytes:
+        pos = self._oids + n * SHA_SIZE
+        return self._data[pos : pos + SHA_SIZE]
+
+    def entry(self, n: int) -> Tuple[str, int]:
+        pack_id, offset = struct.unpack_from(">II", self._data, self._offsets + n * 8)
+        if offset & 0x80000000:
+            large = self._large_offsets + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack_from(">Q", self._data, large)[0]
+        return self.pack_names[pack_id], offset
+
+    def find(self, sha: str) -> Optional[Tuple[str, int]]:
+        n = find_oid(self._data, self._oids, self._fanout, bytes.fromhex(sha))
+        if n is None:
+            return None
+        return self.entry(n)
+
+    def find_prefix(self, prefix: str) -> List[str]:
+        return oids_with_prefix(self._data, self._oids, self._fanout, prefix)
+
+
+def load_multi_pack_index(pack_dir: str) -> Optional[GitMultiPackIndex]:
+    path = os.path.join(pack_dir, MIDX_FILE)
+    if not os.path.isfile(path):
+        return None
+    return GitMultiPackIndex(path)
+
+
+def write_multi_pack_index(pack_dir: str, packs: List[GitPack]) -> Optional[str]:
+    path = os.path.join(pack_dir, MIDX_FILE)
+
+    if not packs:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    packs = sorted(packs, key=lambda pack: pack.name)
+
+    # When an object is stored in several packs, point at the newest copy
+    entries: Dict[bytes, Tuple[float, int, int]] = {}
+    for pack_id, pack in enumerate(packs):
+        mtime = os.path.getmtime(pack.path + ".pack")
+        for oid, offset in pack.iter_entries():
+            current = entries.get(oid)
+            if current is None or current[0] < mtime:
+                entries[oid] = (mtime, pack_id, offset)
+
+    oids = sorted(entries)
+
+    names = b"".join(pack.name.encode("utf-8") + b"\0" for pack in packs)
+    names += b"\0" * (-len(names) % 4)
+
+    offsets = bytearray()
+    large_offsets = bytearray()
+    for oid in oids:
+        _, pack_id, offset = entries[oid]
+        if offset < 0x80000000:
+            offsets += struct.pack(">II", pack_id, offset)
+        else:
+            large = 0x80000000 | (len(large_offsets) // 8)
+            offsets += struct.pack(">II", pack_id, large)
+            large_offsets += struct.pack(">Q", offset)
+
+    chunks = [
+        (CHUNK_PACK_NAMES, names),
+        (CHUNK_OID_FANOUT, fanout_table(oids)),
+        (CHUNK_OID_LOOKUP, b"".join(oids)),
+        (CHUNK_OBJECT_OFFSETS, bytes(offsets)),
+    ]
+    if large_offsets:
+        chunks.append((CHUNK_LARGE_OFFSETS, bytes(large_offsets)))
+
+    header = MIDX_SIGNATURE + struct.pack(">BBBBI", 1, 1, len(chunks), 0, len(packs))
+    write_atomic(path, chunk_file(header, chunks))
+
+    return path
+
+
+def verify_multi_pack_index(
+    midx: GitMultiPackIndex, packs: List[GitPack]
+) -> List[str]:
+    by_name = {pack.name: pack for pack in packs}
+    errors: List[str] = []
+
+    for name in midx.pack_names:
+        if name not in by_name:
+            errors.append(f"failed to load pack '{name}'")
+    if errors:
+        return errors
+
+    previous = b""
+    for n in range(len(midx)):
+        oid = bytes(midx.oid(n))
+        if oid <= previous:
+            errors.append(f"oid lookup out of order: oid[{n}] = {oid.hex()}")
+        previous = oid
+
+        name, offset = midx.entry(n)
+        expected = by_name[name].find(oid.hex())
+        if expected != offset:
+            errors.append(
+                f"incorrect object offset for oid[{n}] = {oid.hex()}: "
+                f"{offset} != {expected}"
+            )
+
+    return errors
@@ -1,37 +1,231 @@
 import hashlib
+import io
 import os
 import re
+import tempfile
 import zlib
-from typing import Optional
+from configparser import ConfigParser
+from stat import S_ISLNK
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 
 from app.objects import GitBlob, GitCommit, GitObject, GitTag, GitTree
 
-from .filesystem import GitFilesystem
+from .bitmap import GitBitmapIndex, load_bitmap_index
+from .cache import LRUCache
+from .commit_graph import (
+    GENERATION_INFINITY,
+    CommitInfo,
+    GitCommitGraph,
+    load_commit_graph,
+)
+from .config import get_size_from_config
+from .filesystem import READ_ONLY_MODE, GitFilesystem
+from .midx import GitMultiPackIndex, load_multi_pack_index
+from .oid_index import GitObjectIdIndex
+from .pack import DeltaBaseCache, GitPack, list_packs
 from .references import GitReferences
 
 
+DEFAULT_DELTA_BASE_CACHE_LIMIT = 96 * 1024 * 1024
+DEFAULT_OBJECT_CACHE_LIMIT = 32 * 1024 * 1024
+DEFAULT_OBJECT_CACHE_TYPES = "commit,tree,tag"
+
+CHUNK_SIZE = 1024 * 1024
+
+HASH_RE = re.compile(r"^[0-9A-Fa-f]{4,40}$")
+
+
+def parse_header(raw: bytes) -> Tuple[bytes, int, int]:
+    fmt_sep = raw.find(b" ")
+    if fmt_sep < 0:
+        raise ValueError("Missing type separator")
+    fmt = raw[:fmt_sep]
+    size_sep = raw.find(b"\x00", fmt_sep)
+    if size_sep < 0:
+        raise ValueError("Missing size separator")
+    size = int(raw[fmt_sep + 1 : size_sep].decode("ascii"))
+    return fmt, size, size_sep + 1
+
+
 class GitObjects:
-    def __init__(self, fs: GitFilesystem, refs: GitReferences) -> None:
+    def __init__(
+        self, fs: GitFilesystem, refs: GitReferences, config: ConfigParser
+    ) -> None:
         self.fs = fs
         self.refs = refs
+        self.delta_base_cache = DeltaBaseCache(
+            get_size_from_config(
+                config,
+                "core",
+                "deltaBaseCacheLimit",
+                fallback=DEFAULT_DELTA_BASE_CACHE_LIMIT,
+            )
+        )
+        self.object_cache: LRUCache[GitObject] = LRUCache(
+            get_size_from_config(
+                config,
+                "core",
+                "objectCacheLimit",
+                fallback=DEFAULT_OBJECT_CACHE_LIMIT,
+            )
+        )
+        self.object_cache_types = set(
+            fmt.strip().encode("ascii")
+            for fmt in config.get(
+                "core", "objectCacheTypes", fallback=DEFAULT_OBJECT_CACHE_TYPES
+            ).split(",")
+            if fmt.strip()
+        )
+        self.use_multi_pack_index = config.getboolean(
+            "core", "multiPackIndex", fallback=True
+        )
+        self.ids = GitObjectIdIndex(fs)
+        self._packs: Optional[List[GitPack]] = None
+        self._packs_mtime: Optional[int] = None
+        self._midx: Optional[GitMultiPackIndex] = None
+        self._midx_packs: Dict[str, GitPack] = {}
+        self._uncovered_packs: List[GitPack] = []
+        self.use_commit_graph = config.getboolean(
+            "core", "commitGraph", fallback=True
+        )
+        self._commit_graph: Optional[GitCommitGraph] = None
+        self._commit_graph_loaded = False
+        self.use_bitmaps = config.getboolean("pack", "useBitmaps", fallback=True)
+        self._bitmap_index: Optional[GitBitmapIndex] = None
+        self._bitmap_index_loaded = False
+
+    @property
+    def packs(self) -> List[GitPack]:
+        if self._packs is None:
+            self._load_packs()
+            assert self._packs is not None
+        return self._packs
+
+    def _load_packs(self) -> None:
+        pack_dir = self.fs.resolve("objects", "pack")
+        self._packs_mtime = self._mtime(pack_dir)
+        self._packs = list_packs(pack_dir)
+
+        by_name = {pack.name: pack for pack in self._packs}
+        midx = load_multi_pack_index(pack_dir) if self.use_multi_pack_index else None
+        if midx is not None and not all(name in by_name for name in midx.pack_names):
+            # A stale multi-pack-index refers to packs that have been removed
+            midx.close()
+            midx = None
+
+        self._midx = midx
+        if midx is None:
+            self._midx_packs = {}
+            self._uncovered_packs = self._packs
+        else:
+            covered = set(midx.pack_names)
+            self._midx_packs = {name: by_name[name] for name in covered}
+            self._uncovered_packs = [p for p in self._packs if p.name not in covered]
+
+    def pack_sources(self) -> List[Union[GitMultiPackIndex, GitPack]]:
+        self.packs
+        sources: List[Union[GitMultiPackIndex, GitPack]] = []
+        if self._midx is not None:
+            sources.append(self._midx)
+        sources.extend(self._uncovered_packs)
+        return sources
+
+    def locate(self, sha: str) -> Optional[Tuple[GitPack, int]]:
+        self.packs
+
+        if self._midx is not None:
+            found = self._midx.find(sha)
+            if found is not None:
+                name, offset = found
+                return self._midx_packs[name], offset
+
+        for pack in self._uncovered_packs:
+            pack_offset = pack.find(sha)
+            if pack_offset is not None:
+                return pack, pack_offset
+        return None
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh_packs(self) -> bool:
+        if self._packs is None:
+            return False
+        if self._mtime(self.fs.resolve("objects", "pack")) == self._packs_mtime:
+            return False
+        self.reload_packs()
+        return True
+
+    def reload_packs(self) -> None:
+        if self._packs is not None:
+            for pack in self._packs:
+                pack.close()
+        if self._midx is not None:
+            self._midx.close()
+        if self._bitmap_index is not None:
+            self._bitmap_index.close()
+        self._packs = None
+        self._midx = None
+        self._midx_packs = {}
+        self._uncovered_packs = []
+        self._bitmap_index = None
+        self._bitmap_index_loaded = False
+        self.delta_base_cache.clear()
+
+    @property
+    def bitmap_index(self) -> Optional[GitBitmapIndex]:
+        if not self._bitmap_index_loaded:
+            self._bitmap_index_loaded = True
+            if self.use_bitmaps:
+                self._bitmap_index = load_bitmap_index(self.packs)
+        return self._bitmap_index
+
+    @property
+    def commit_graph(self) -> Optional[GitCommitGraph]:
+        if not self._commit_graph_loaded:
+            self._commit_graph_loaded = True
+            if self.use_commit_graph:
+                self._commit_graph = load_commit_graph(self.fs.resolve("objects"))
+        return self._commit_graph
+
+    def reload_commit_graph(self) -> None:
+        if self._commit_graph is not None:
+            self._commit_graph.close()
+        self._commit_graph = None
+        self._commit_graph_loaded = False
+
+    def commit_info(self, sha: str) -> CommitInfo:
+        # Commits in the commit-graph are answered without inflating anything
+        graph = self.commit_graph
+        if graph is not None:
+            n = graph.find(sha)
+            if n is not None:
+                return graph.info(n)
+        return self.parse_commit_info(sha)
+
+    def parse_commit_info(self, sha: str) -> CommitInfo:
+        commit = self.read(sha)
+        if not isinstance(commit, GitCommit) or isinstance(commit, GitTag):
+            raise ValueError(f"Object {sha} is not a commit")
+
+        tree = commit.tree
+        if tree is None:
+            raise ValueError(f"invalid commit {sha}: no tree")
+        return tree, commit.parents, GENERATION_INFINITY, commit.committer_time
 
     def file(self, sha: str) -> str:
         return self.fs.file_require("objects", sha[:2], sha[2:])
 
     def read(self, sha: str) -> GitObject:
-        path = self.file(sha)
-        with open(path, "rb") as f:
-            raw = zlib.decompress(f.read())
-        fmt_sep = raw.find(b" ")
-        if fmt_sep < 0:
-            raise ValueError("Missing type separator")
-        fmt = raw[:fmt_sep]
-        size_sep = raw.find(b"\x00", fmt_sep)
-        if size_sep < 0:
-            raise ValueError("Missing size separator")
-        size = int(raw[fmt_sep + 1 : size_sep].decode("ascii"))
-        if size != len(raw) - size_sep - 1:
-            raise ValueError(f"Malformed object {sha}: bad length")
+        cached = self.object_cache.get(sha)
+        if cached is not None:
+            return cached
+
+        fmt, data = self.read_raw(sha)
 
         object_class: type[GitObject]
         match fmt:
@@ -46,7 +240,146 @@ class GitObjects:
             case _:
                 raise ValueError(f"Unknown object type: {fmt.decode('ascii')}")
 
-        return object_class.deserialize(raw[size_sep + 1 :])
+        obj = object_class.deserialize(data)
+        if fmt in self.object_cache_types:
+            self.object_cache.put(sha, obj, len(data))
+        return obj
+
+    def read_raw(self, sha: str) -> Tuple[bytes, bytes]:
+        packed = self._read_packed(sha)
+        if packed is not None:
+            return packed
+
+        try:
+            return self._read_loose(sha)
+        except FileNotFoundError:
+            # A concurrent repack may have moved the object into a new pack
+            if not self.refresh_packs():
+                raise
+            packed = self._read_packed(sha)
+            if packed is None:
+                raise
+            return packed
+
+    def is_packed(self, sha: str) -> bool:
+        return self.locate(sha) is not None
+
+    def contains(self, sha: str) -> bool:
+        if self.is_packed(sha):
+            return True
+        if self.fs.file_exists("objects", sha[:2], sha[2:]):
+            return True
+        return self.refresh_packs() and self.is_packed(sha)
+
+    def iter_loose(self) -> Iterator[str]:
+        objects_dir = self.fs.resolve("objects")
+        for prefix in sorted(os.listdir(objects_dir)):
+            if len(prefix) != 2 or not os.path.isdir(os.path.join(objects_dir, prefix)):
+                continue
+            for file in sorted(os.listdir(os.path.join(objects_dir, prefix))):
+                if len(file) == 38:
+                    yield prefix + file
+
+    def remove_loose(self, sha: str) -> None:
+        self.fs.file_delete("objects", sha[:2], sha[2:])
+
+        directory = self.fs.resolve("objects", sha[:2])
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+    def _read_packed(self, sha: str) -> Optional[Tuple[bytes, bytes]]:
+        located = self.locate(sha)
+        if located is None:
+            return None
+        pack, offset = located
+        return pack.read(offset, self.delta_base_cache, self.read_raw)
+
+    def _read_loose(self, sha: str) -> Tuple[bytes, bytes]:
+        path = self.file(sha)
+        with open(path, "rb") as f:
+            raw = zlib.decompress(f.read())
+        fmt, size, start = parse_header(raw)
+        if size != len(raw) - start:
+            raise ValueError(f"Malformed object {sha}: bad length")
+
+        return fmt, raw[start:]
+
+    def read_header(self, sha: str) -> Tuple[bytes, int]:
+        located = self.locate(sha)
+        if located is not None:
+            pack, offset = located
+            return pack.read_header(offset, self.read_header)
+
+        try:
+            path = self.file(sha)
+        except FileNotFoundError:
+            # A concurrent repack may have moved the object into a new pack
+            if not self.refresh_packs():
+                raise
+            located = self.locate(sha)
+            if located is None:
+                raise
+            pack, offset = located
+            return pack.read_header(offset, self.read_header)
+
+        decompressor = zlib.decompressobj()
+        head = b""
+        with open(path, "rb") as f:
+            while b"\x00" not in head:
+                compressed = decompressor.unconsumed_tail or f.read(64)
+                if not compressed or decompressor.eof:
+                    raise ValueError(f"Malformed object {sha}: missing header")
+                head += decompressor.decompress(compressed, 64)
+
+        fmt, size, _ = parse_header(head)
+        return fmt, size
+
+    def read_stream(self, sha: str, out: BinaryIO) -> bytes:
+        located = self.locate(sha)
+        if located is not None:
+            pack, offset = located
+            streamed = pack.read_stream(offset, out)
+            if streamed is not None:
+                return streamed
+            # Deltified entries have to be rebuilt in memory anyway
+            fmt, data = pack.read(offset, self.delta_base_cache, self.read_raw)
+            out.write(data)
+            return fmt
+
+        try:
+            path = self.file(sha)
+        except FileNotFoundError:
+            fmt, data = self.read_raw(sha)
+            out.write(data)
+            return fmt
+
+        decompressor = zlib.decompressobj()
+        head = b""
+        fmt = b""
+        remaining = -1
+
+        with open(path, "rb") as f:
+            while not decompressor.eof:
+                compressed = decompressor.unconsumed_tail or f.read(CHUNK_SIZE)
+                if not compressed:
+                    raise ValueError(f"Malformed object {sha}: truncated")
+                data = decompressor.decompress(compressed, CHUNK_SIZE)
+
+                if remaining < 0:
+                    head += data
+                    if b"\x00" not in head:
+                        continue
+                    fmt, remaining, start = parse_header(head)
+                    data = head[start:]
+
+                remaining -= len(data)
+                if remaining < 0:
+                    raise ValueError(f"Malformed object {sha}: bad length")
+                out.write(data)
+
+        if remaining != 0:
+            raise ValueError(f"Malformed object {sha}: bad length")
+        return fmt
 
     def find(
         self,
@@ -69,14 +402,14 @@ class GitObjects:
         if fmt is None:
             return sha
         while True:
-            obj = self.read(sha)
-
-            if obj.fmt == fmt:
+            if self.read_header(sha)[0] == fmt:
                 return sha
 
             if not follow:
                 raise FileNotFoundError("The object cannot be found")
 
+            obj = self.read(sha)
+
             if isinstance(obj, GitTag):
                 obj_sha = obj.kvlm.get_one(b"object")
 
@@ -85,12 +418,12 @@ class GitObjects:
 
                 sha = obj_sha.decode("ascii")
             elif isinstance(obj, GitCommit) and fmt == b"tree":
-                tree_sha = obj.kvlm.get_one(b"tree")
+                tree_sha = obj.tree
 
                 if tree_sha is None:
                     raise ValueError("invalid commit: no tree")
 
-                sha = tree_sha.decode("ascii")
+                sha = tree_sha
             else:
                 raise FileNotFoundError("The object cannot be found")
 
@@ -103,6 +436,70 @@ class GitObjects:
         data = obj.serialize()
         return obj.fmt + b" " + str(len(data)).encode() + b"\x00" + data
 
+    @staticmethod
+    def hash_stream(fmt: bytes, stream: BinaryIO, size: int) -> str:
+        hasher = hashlib.sha1(fmt + b" " + str(size).encode() + b"\x00")
+
+        total = 0
+        while chunk := stream.read(CHUNK_SIZE):
+            total += len(chunk)
+            hasher.update(chunk)
+
+        if total != size:
+            raise ValueError("file size changed while hashing")
+        return hasher.hexdigest()
+
+    @classmethod
+    def hash_file(cls, path: str, fmt: bytes = b"blob") -> str:
+        with open(path, "rb") as f:
+            return cls.hash_stream(fmt, f, os.fstat(f.fileno()).st_size)
+
+    @classmethod
+    def hash_path(cls, path: str, stat: os.stat_result) -> str:
+        # A symbolic link is hashed as its target, which is what its blob holds
+        if S_ISLNK(stat.st_mode):
+            target = os.readlink(os.fsencode(path))
+            return cls.hash_stream(b"blob", io.BytesIO(target), len(target))
+        return cls.hash_file(path)
+
+    def write_stream(self, fmt: bytes, stream: BinaryIO, size: int) -> str:
+        header = fmt + b" " + str(size).encode() + b"\x00"
+        hasher = hashlib.sha1(header)
+        compressor = zlib.compressobj()
+
+        objects_dir = self.fs.dir_ensure("objects")
+        fd, tmp_path = tempfile.mkstemp(prefix="tmp_obj_", dir=objects_dir)
+
+        try:
+            total = 0
+            with os.fdopen(fd, "wb") as object_file:
+                object_file.write(compressor.compress(header))
+                while chunk := stream.read(CHUNK_SIZE):
+                    total += len(chunk)
+                    hasher.update(chunk)
+                    object_file.write(compressor.compress(chunk))
+                object_file.write(compressor.flush())
+
+            if total != size:
+                raise ValueError("file size changed while writing object")
+
+            sha = hasher.hexdigest()
+            self.fs.dir_ensure("objects", sha[:2])
+            path = self.fs.resolve("objects", sha[:2], sha[2:])
+            if not os.path.exists(path):
+                # mkstemp creates the file readable by its owner only
+                os.chmod(tmp_path, READ_ONLY_MODE)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return sha
+
+    def write_file(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self.write_stream(b"blob", f, os.fstat(f.fileno()).st_size)
+
     def write(self, obj: GitObject) -> str:
         raw = self.raw(obj)
         sha = self.hash(raw)
@@ -112,6 +509,7 @@ class GitObjects:
         if not os.path.exists(path):
             with open(path, "wb") as object_file:
                 object_file.write(zlib.compress(raw))
+            os.chmod(path, READ_ONLY_MODE)
 
         return sha
 
@@ -126,16 +524,15 @@ class GitObjects:
             candidates.append(ref)
             return candidates
 
-        hash_re = re.compile(r"^[0-9A-Fa-f]{4,40}$")
-
-        if hash_re.match(name):
+        if HASH_RE.match(name):
             name = name.lower()
-            prefix = name[:2]
-            remainder = name[2:]
-            if self.fs.dir_exists("objects", prefix):
-                for file in os.listdir(self.fs.resolve("objects", prefix)):
-                    if file.startswith(remainder):
-                        candidates.append(prefix + file)
+            if len(name) == 40:
+                if self.contains(name):
+                    candidates.append(name)
+            else:
+                candidates.extend(self.ids.lookup(name, self.pack_sources()))
+                if not candidates and self.refresh_packs():
+                    candidates.extend(self.ids.lookup(name, self.pack_sources()))
 
         for ref in ["refs/tags/" + name, "refs/heads/" + name, "refs/remotes/" + name]:
             try:
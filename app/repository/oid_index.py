@@ -0,0 +1,49 @@
+import os
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple, Union
+
+from .filesystem import GitFilesystem
+from .midx import GitMultiPackIndex
+from .pack import GitPack
+
+
+class GitObjectIdIndex:
+    def __init__(self, fs: GitFilesystem) -> None:
+        self.fs = fs
+        # Sorted loose object ids per fanout directory, together with the
+        # directory mtime they were listed at
+        self._loose: Dict[str, Tuple[int, List[str]]] = {}
+
+    def loose_ids(self, fanout: str) -> List[str]:
+        path = self.fs.resolve("objects", fanout)
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._loose.pop(fanout, None)
+            return []
+
+        cached = self._loose.get(fanout)
+        if cached is None or cached[0] != mtime:
+            ids = sorted(fanout + file for file in os.listdir(path) if len(file) == 38)
+            cached = (mtime, ids)
+            self._loose[fanout] = cached
+
+        return cached[1]
+
+    def lookup(
+        self, prefix: str, packs: Sequence[Union[GitMultiPackIndex, GitPack]]
+    ) -> List[str]:
+        prefix = prefix.lower()
+        result: List[str] = []
+
+        ids = self.loose_ids(prefix[:2])
+        for sha in ids[bisect_left(ids, prefix) :]:
+            if not sha.startswith(prefix):
+                break
+            result.append(sha)
+
+        for pack in packs:
+            result.extend(pack.find_prefix(prefix))
+
+        return sorted(set(result))
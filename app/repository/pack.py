@@ -0,0 +1,548 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .cache import LRUCache
+from .chunk_format import write_atomic
+from .delta import apply_delta, delta_sizes
+from .filesystem import READ_ONLY_MODE
+
+IDX_SIGNATURE = b"\377tOc"
+PACK_SIGNATURE = b"PACK"
+REV_SIGNATURE = b"RIDX"
+SHA_SIZE = 20
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES: Dict[int, bytes] = {
+    OBJ_COMMIT: b"commit",
+    OBJ_TREE: b"tree",
+    OBJ_BLOB: b"blob",
+    OBJ_TAG: b"tag",
+}
+TYPE_NUMBERS: Dict[bytes, int] = {name: num for num, name in TYPE_NAMES.items()}
+
+# Two size varints of up to 10 bytes each start every delta
+DELTA_HEADER_SIZE = 20
+
+# Layout of a version 2 pack index: header, 256 fanout entries, then the
+# sorted object names followed by the CRC32 and offset tables
+IDX_FANOUT = 8
+IDX_OIDS = IDX_FANOUT + 256 * 4
+
+# A reverse index lists the index position of every object in the order
+# the objects are stored in the pack
+REV_HEADER_SIZE = 12
+
+INFLATE_CHUNK = 64 * 1024
+
+RawObject = Tuple[bytes, bytes]
+DeltaBaseCache = LRUCache[RawObject]
+
+# (sha, type number, payload, delta base sha); the payload is the delta
+# against the base when one is given, the full object data otherwise
+PackEntry = Tuple[str, int, bytes, Optional[str]]
+
+
+def map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def bisect_oid(
+    table: mmap.mmap, oids: int, fanout: Tuple[int, ...], oid: bytes
+) -> int:
+    first = oid[0]
+    lo = fanout[first - 1] if first else 0
+    hi = fanout[first]
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = oids + mid * SHA_SIZE
+        if table[pos : pos + SHA_SIZE] < oid:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def find_oid(
+    table: mmap.mmap, oids: int, fanout: Tuple[int, ...], oid: bytes
+) -> Optional[int]:
+    n = bisect_oid(table, oids, fanout, oid)
+    pos = oids + n * SHA_SIZE
+    if n < fanout[255] and table[pos : pos + SHA_SIZE] == oid:
+        return n
+    return None
+
+
+def oids_with_prefix(
+    table: mmap.mmap, oids: int, fanout: Tuple[int, ...], prefix: str
+) -> List[str]:
+    lower = bytes.fromhex(prefix if len(prefix) % 2 == 0 else prefix + "0")
+
+    result = []
+    n = bisect_oid(table, oids, fanout, lower)
+    while n < fanout[255]:
+        pos = oids + n * SHA_SIZE
+        sha = table[pos : pos + SHA_SIZE].hex()
+        if not sha.startswith(prefix):
+            break
+        result.append(sha)
+        n += 1
+    return result
+
+
+class GitPack:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._idx: Optional[mmap.mmap] = None
+        self._pack: Optional[mmap.mmap] = None
+        self._fanout: Tuple[int, ...] = ()
+        self._pack_order: Optional[List[int]] = None
+
+    @property
+    def idx(self) -> mmap.mmap:
+        if self._idx is None:
+            idx = map_file(self.path + ".idx")
+
+            if idx[:4] != IDX_SIGNATURE:
+                raise ValueError(f"Invalid pack index signature: {self.path}.idx")
+            version = struct.unpack_from(">I", idx, 4)[0]
+            if version != 2:
+                raise ValueError(f"mgit only supports pack index version 2: {version}")
+
+            self._fanout = struct.unpack_from(">256I", idx, IDX_FANOUT)
+            self._idx = idx
+        return self._idx
+
+    @property
+    def pack(self) -> mmap.mmap:
+        if self._pack is None:
+            pack = map_file(self.path + ".pack")
+
+            if pack[:4] != PACK_SIGNATURE:
+                raise ValueError(f"Invalid pack signature: {self.path}.pack")
+            version = struct.unpack_from(">I", pack, 4)[0]
+            if version not in (2, 3):
+                raise ValueError(f"Unsupported pack version: {version}")
+
+            self._pack = pack
+        return self._pack
+
+    def __len__(self) -> int:
+        self.idx
+        return self._fanout[255]
+
+    def close(self) -> None:
+        if self._idx is not None:
+            self._idx.close()
+            self._idx = None
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def oid(self, n: int) -> bytes:
+        pos = IDX_OIDS + n * SHA_SIZE
+        return self.idx[pos : pos + SHA_SIZE]
+
+    def offset(self, n: int) -> int:
+        idx = self.idx
+        count = self._fanout[255]
+
+        offsets = IDX_OIDS + count * (SHA_SIZE + 4)
+        offset = struct.unpack_from(">I", idx, offsets + n * 4)[0]
+        if offset & 0x80000000:
+            large_offsets = offsets + count * 4
+            large = offset & 0x7FFFFFFF
+            offset = struct.unpack_from(">Q", idx, large_offsets + large * 8)[0]
+        return offset
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path) + ".idx"
+
+    @property
+    def checksum(self) -> bytes:
+        # The index trailer repeats the pack checksum before its own
+        return self.idx[-2 * SHA_SIZE : -SHA_SIZE]
+
+    def position(self, sha: str) -> Optional[int]:
+        return find_oid(self.idx, IDX_OIDS, self._fanout, bytes.fromhex(sha))
+
+    def find(self, sha: str) -> Optional[int]:
+        n = self.position(sha)
+        if n is None:
+            return None
+        return self.offset(n)
+
+    def offsets(self) -> List[int]:
+        idx = self.idx
+        count = self._fanout[255]
+
+        table = IDX_OIDS + count * (SHA_SIZE + 4)
+        offsets = list(struct.unpack_from(f">{count}I", idx, table))
+        for n, offset in enumerate(offsets):
+            if offset & 0x80000000:
+                offsets[n] = self.offset(n)
+        return offsets
+
+    def pack_order(self) -> List[int]:
+        # Index positions of the objects sorted by their offset in the pack,
+        # read from the reverse index when there is one
+        if self._pack_order is None:
+            count = len(self)
+            rev_path = self.path + ".rev"
+            if os.path.isfile(rev_path):
+                with open(rev_path, "rb") as f:
+                    data = f.read()
+                if data[:4] != REV_SIGNATURE:
+                    raise ValueError(f"Invalid reverse index signature: {rev_path}")
+                order = list(struct.unpack_from(f">{count}I", data, REV_HEADER_SIZE))
+            else:
+                offsets = self.offsets()
+                order = sorted(range(count), key=offsets.__getitem__)
+            self._pack_order = order
+        return self._pack_order
+
+    def find_prefix(self, prefix: str) -> List[str]:
+        return oids_with_prefix(self.idx, IDX_OIDS, self._fanout, prefix)
+
+    def iter_entries(self) -> Iterator[Tuple[bytes, int]]:
+        for n in range(len(self)):
+            yield self.oid(n), self.offset(n)
+
+    def entry_header(self, offset: int) -> Tuple[int, int, int]:
+        pack = self.pack
+
+        c = pack[offset]
+        type_num = (c >> 4) & 0x7
+        size = c & 0x0F
+        shift = 4
+        pos = offset + 1
+
+        while c & 0x80:
+            c = pack[pos]
+            pos += 1
+            size |= (c & 0x7F) << shift
+            shift += 7
+
+        return type_num, size, pos
+
+    def inflate(self, pos: int, size: int) -> bytes:
+        pack = self.pack
+        decompressor = zlib.decompressobj()
+        chunks = []
+
+        step = min(size + 64, INFLATE_CHUNK)
+        while not decompressor.eof:
+            block = pack[pos : pos + step]
+            if not block:
+                raise ValueError(f"Truncated pack entry at {pos} in {self.path}")
+            chunks.append(decompressor.decompress(block))
+            pos += len(block)
+            step = INFLATE_CHUNK
+
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise ValueError(f"Malformed pack entry at {pos} in {self.path}: bad length")
+        return data
+
+    def inflate_head(self, pos: int, length: int) -> bytes:
+        pack = self.pack
+        decompressor = zlib.decompressobj()
+        head = b""
+
+        while len(head) < length and not decompressor.eof:
+            compressed = decompressor.unconsumed_tail
+            if not compressed:
+                compressed = pack[pos : pos + 64]
+                if not compressed:
+                    raise ValueError(f"Truncated pack entry at {pos} in {self.path}")
+                pos += len(compressed)
+            head += decompressor.decompress(compressed, length - len(head))
+
+        return head
+
+    def read_header(
+        self,
+        offset: int,
+        external: Optional[Callable[[str], Tuple[bytes, int]]] = None,
+    ) -> Tuple[bytes, int]:
+        type_num, size, pos = self.entry_header(offset)
+        if type_num in TYPE_NAMES:
+            return TYPE_NAMES[type_num], size
+
+        # The size of a deltified object is recorded at the start of its
+        # delta, and its type is the type of the object at the end of the chain
+        result_size: Optional[int] = None
+        while True:
+            if type_num == OBJ_OFS_DELTA:
+                base_offset, pos = self.delta_base_offset(offset, pos)
+            elif type_num == OBJ_REF_DELTA:
+                base_sha = self.pack[pos : pos + SHA_SIZE].hex()
+                pos += SHA_SIZE
+                found = self.find(base_sha)
+                if found is None:
+                    if external is None:
+                        raise ValueError(f"Missing delta base {base_sha}")
+                    fmt = external(base_sha)[0]
+                    break
+                base_offset = found
+            elif type_num in TYPE_NAMES:
+                fmt = TYPE_NAMES[type_num]
+                break
+            else:
+                raise ValueError(f"Unknown pack entry type {type_num} at {offset}")
+
+            if result_size is None:
+                head = self.inflate_head(pos, min(size, DELTA_HEADER_SIZE))
+                result_size = delta_sizes(head)[1]
+
+            offset = base_offset
+            type_num, size, pos = self.entry_header(offset)
+
+        assert result_size is not None
+        return fmt, result_size
+
+    def read_stream(self, offset: int, out: BinaryIO) -> Optional[bytes]:
+        type_num, size, pos = self.entry_header(offset)
+        if type_num not in TYPE_NAMES:
+            return None
+
+        pack = self.pack
+        decompressor = zlib.decompressobj()
+        written = 0
+
+        while not decompressor.eof:
+            compressed = decompressor.unconsumed_tail
+            if not compressed:
+                compressed = pack[pos : pos + INFLATE_CHUNK]
+                if not compressed:
+                    raise ValueError(f"Truncated pack entry at {pos} in {self.path}")
+                pos += len(compressed)
+
+            data = decompressor.decompress(compressed, INFLATE_CHUNK)
+            written += len(data)
+            out.write(data)
+
+        if written != size:
+            raise ValueError(f"Malformed pack entry at {offset} in {self.path}")
+        return TYPE_NAMES[type_num]
+
+    def delta_base_offset(self, offset: int, pos: int) -> Tuple[int, int]:
+        pack = self.pack
+
+        c = pack[pos]
+        pos += 1
+        distance = c & 0x7F
+        while c & 0x80:
+            c = pack[pos]
+            pos += 1
+            distance = ((distance + 1) << 7) | (c & 0x7F)
+
+        return offset - distance, pos
+
+    def read(
+        self,
+        offset: int,
+        cache: Optional[DeltaBaseCache] = None,
+        external: Optional[Callable[[str], RawObject]] = None,
+    ) -> RawObject:
+        # Walk down the delta chain iteratively until a full object is found,
+        # either stored whole in the pack or already inflated in the cache
+        chain: List[Tuple[int, int, int]] = []
+        base_offset: Optional[int] = offset
+        base: Optional[RawObject] = None
+
+        while base is None:
+            if cache is not None:
+                base = cache.get((self.path, base_offset))
+                if base is not None:
+                    break
+
+            assert base_offset is not None
+            type_num, size, pos = self.entry_header(base_offset)
+
+            if type_num == OBJ_OFS_DELTA:
+                next_offset, pos = self.delta_base_offset(base_offset, pos)
+                chain.append((base_offset, pos, size))
+                base_offset = next_offset
+            elif type_num == OBJ_REF_DELTA:
+                base_sha = self.pack[pos : pos + SHA_SIZE].hex()
+                chain.append((base_offset, pos + SHA_SIZE, size))
+                base_offset = self.find(base_sha)
+                if base_offset is None:
+                    if external is None:
+                        raise ValueError(f"Missing delta base {base_sha}")
+                    base = external(base_sha)
+            elif type_num in TYPE_NAMES:
+                base = (TYPE_NAMES[type_num], self.inflate(pos, size))
+            else:
+                raise ValueError(f"Unknown pack entry type {type_num} at {base_offset}")
+
+        fmt, data = base
+        key = base_offset
+        for delta_offset, pos, size in reversed(chain):
+            if cache is not None and key is not None:
+                cache.put((self.path, key), (fmt, data), len(data))
+            data = apply_delta(data, self.inflate(pos, size))
+            key = delta_offset
+
+        return fmt, data
+
+
+def list_packs(pack_dir: str) -> List[GitPack]:
+    if not os.path.isdir(pack_dir):
+        return []
+
+    packs = []
+    for entry in sorted(os.listdir(pack_dir)):
+        if not entry.endswith(".idx"):
+            continue
+        path = os.path.join(pack_dir, entry[: -len(".idx")])
+        if os.path.isfile(path + ".pack"):
+            packs.append(GitPack(path))
+    return packs
+
+
+def encode_entry_header(type_num: int, size: int) -> bytes:
+    result = bytearray()
+
+    c = (type_num << 4) | (size & 0x0F)
+    size >>= 4
+    while size:
+        result.append(c | 0x80)
+        c = size & 0x7F
+        size >>= 7
+    result.append(c)
+
+    return bytes(result)
+
+
+def encode_delta_base_offset(distance: int) -> bytes:
+    result = bytearray([distance & 0x7F])
+    distance >>= 7
+    while distance:
+        distance -= 1
+        result.insert(0, 0x80 | (distance & 0x7F))
+        distance >>= 7
+    return bytes(result)
+
+
+def write_pack_index(
+    path: str, index: List[Tuple[bytes, int, int]], pack_checksum: bytes
+) -> None:
+    index = sorted(index)
+
+    counts = [0] * 256
+    for oid, _, _ in index:
+        counts[oid[0]] += 1
+    fanout = []
+    total = 0
+    for count in counts:
+        total += count
+        fanout.append(total)
+
+    content = bytearray(IDX_SIGNATURE + struct.pack(">I", 2))
+    content += struct.pack(">256I", *fanout)
+    content += b"".join(oid for oid, _, _ in index)
+    content += b"".join(struct.pack(">I", crc) for _, crc, _ in index)
+
+    large_offsets: List[int] = []
+    for _, _, offset in index:
+        if offset < 0x80000000:
+            content += struct.pack(">I", offset)
+        else:
+            content += struct.pack(">I", 0x80000000 | len(large_offsets))
+            large_offsets.append(offset)
+    for offset in large_offsets:
+        content += struct.pack(">Q", offset)
+
+    content += pack_checksum
+    content += hashlib.sha1(content).digest()
+
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def write_reverse_index(pack: GitPack) -> str:
+    order = pack.pack_order()
+    content = bytearray(REV_SIGNATURE + struct.pack(">II", 1, 1))
+    content += struct.pack(f">{len(order)}I", *order)
+    content += pack.checksum
+    content += hashlib.sha1(content).digest()
+
+    path = pack.path + ".rev"
+    write_atomic(path, bytes(content))
+    return path
+
+
+def write_pack(pack_dir: str, count: int, entries: Iterable[PackEntry]) -> str:
+    os.makedirs(pack_dir, exist_ok=True)
+    fd, tmp_pack = tempfile.mkstemp(prefix="tmp_pack_", dir=pack_dir)
+
+    try:
+        checksum = hashlib.sha1()
+        index: List[Tuple[bytes, int, int]] = []
+        offsets: Dict[str, int] = {}
+
+        with os.fdopen(fd, "wb") as f:
+            header = PACK_SIGNATURE + struct.pack(">II", 2, count)
+            f.write(header)
+            checksum.update(header)
+            offset = len(header)
+
+            for sha, type_num, payload, base_sha in entries:
+                if base_sha is None:
+                    entry = encode_entry_header(type_num, len(payload))
+                else:
+                    entry = encode_entry_header(OBJ_OFS_DELTA, len(payload))
+                    entry += encode_delta_base_offset(offset - offsets[base_sha])
+                entry += zlib.compress(payload)
+
+                f.write(entry)
+                checksum.update(entry)
+                index.append((bytes.fromhex(sha), zlib.crc32(entry), offset))
+                offsets[sha] = offset
+                offset += len(entry)
+
+            if len(index) != count:
+                raise ValueError(f"Expected {count} pack entries, got {len(index)}")
+
+            pack_checksum = checksum.digest()
+            f.write(pack_checksum)
+
+        path = os.path.join(pack_dir, f"pack-{pack_checksum.hex()}")
+        write_pack_index(tmp_pack + ".idx", index, pack_checksum)
+        # mkstemp creates the pack readable by its owner only
+        os.chmod(tmp_pack, READ_ONLY_MODE)
+        os.chmod(tmp_pack + ".idx", READ_ONLY_MODE)
+        os.replace(tmp_pack, path + ".pack")
+        os.replace(tmp_pack + ".idx", path + ".idx")
+    finally:
+        for leftover in (tmp_pack, tmp_pack + ".idx"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return path
@@ -0,0 +1,479 @@
+from __future__ import annotations
+
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.objects import GitCommit, GitTag, GitTree
+
+from .bitmap import (
+    TYPE_ORDER,
+    GitBitmapIndex,
+    name_hash,
+    pack_positions,
+    write_bitmap_index,
+)
+from .bloom import BLOOM_NUM_HASHES, BLOOM_VERSION, build_bloom_filter
+from .commit import changed_paths
+from .commit_graph import GraphCommit, compute_generations, write_commit_graph
+from .ewah import set_bits
+from .cache_tree import GitCacheTree
+from .index import GitIndex
+from .pack import GitPack, write_reverse_index
+from .references import RefTree
+from .repository import GitRepository
+
+# (sha, object type, path the object was reached through)
+ReachableObject = Tuple[str, bytes, str]
+
+# (sha, object type, name hash of the path the object was reached through)
+EnumeratedObject = Tuple[str, bytes, int]
+
+# Objects outside the bitmapped pack: sha -> (object type, name hash)
+ExtraObjects = Dict[str, Tuple[bytes, int]]
+
+# Besides every ref tip, one commit in this many gets a bitmap, so that a
+# walk from a commit without one soon reaches a commit with one
+BITMAP_COMMIT_INTERVAL = 100
+
+
+def ref_tips(repo: GitRepository) -> List[str]:
+    tips: List[str] = []
+
+    def collect(refs: RefTree) -> None:
+        for value in refs.values():
+            if isinstance(value, str):
+                tips.append(value)
+            else:
+                collect(value)
+
+    collect(repo.refs.list())
+
+    try:
+        tips.append(repo.refs.resolve("HEAD"))
+    except FileNotFoundError:
+        pass
+
+    return list(dict.fromkeys(tips))
+
+
+def peel_to_commit(repo: GitRepository, sha: str) -> Optional[str]:
+    while True:
+        fmt, _ = repo.objects.read_header(sha)
+        if fmt == b"commit":
+            return sha
+        if fmt != b"tag":
+            return None
+
+        tag = repo.objects.read(sha)
+        assert isinstance(tag, GitTag)
+        target = tag.kvlm.get_one(b"object")
+        if target is None:
+            raise ValueError(f"invalid tag {sha}: no object")
+        sha = target.decode("ascii")
+
+
+def list_commits(repo: GitRepository, tips: List[str]) -> Dict[str, GraphCommit]:
+    commits: Dict[str, GraphCommit] = {}
+    pending: List[str] = []
+    for tip in tips:
+        commit = peel_to_commit(repo, tip)
+        if commit is not None:
+            pending.append(commit)
+
+    while pending:
+        sha = pending.pop()
+        if sha in commits:
+            continue
+
+        tree, parents, _, date = repo.objects.commit_info(sha)
+        commits[sha] = (tree, parents, date)
+        pending.extend(parent for parent in parents if parent not in commits)
+
+    return commits
+
+
+def list_objects(
+    repo: GitRepository,
+    tips: List[str],
+    index: Optional[GitIndex] = None,
+) -> Iterator[ReachableObject]:
+    seen: Set[str] = set()
+    pending: List[Tuple[str, Optional[bytes], str]] = []
+    if index is not None:
+        # Walked after everything the tips reach
+        for sha, path in reversed(cache_tree_roots(index)):
+            pending.append((sha, b"tree", path))
+    pending.extend((sha, None, "") for sha in reversed(tips))
+
+    while pending:
+        sha, fmt, path = pending.pop()
+        if sha in seen:
+            continue
+        seen.add(sha)
+
+        if fmt == b"blob":
+            yield sha, fmt, path
+            continue
+
+        obj = repo.objects.read(sha)
+        yield sha, obj.fmt, path
+
+        if isinstance(obj, GitTag):
+            target = obj.kvlm.get_one(b"object")
+            if target is None:
+                raise ValueError(f"invalid tag {sha}: no object")
+            pending.append((target.decode("ascii"), None, ""))
+        elif isinstance(obj, GitCommit):
+            for parent in reversed(obj.parents):
+                pending.append((parent, b"commit", ""))
+            tree = obj.tree
+            if tree is None:
+                raise ValueError(f"invalid commit {sha}: no tree")
+            pending.append((tree, b"tree", ""))
+        elif isinstance(obj, GitTree):
+            for leaf in reversed(obj.items):
+                if leaf.is_gitlink():
+                    # Submodule commits live in another repository
+                    continue
+                leaf_fmt = b"tree" if leaf.is_tree() else b"blob"
+                pending.append((leaf.sha, leaf_fmt, os.path.join(path, leaf.path)))
+
+    if index is not None:
+        for i, name in enumerate(index.names):
+            sha = index.sha(i)
+            if index.mode_type(i) == 0b1110 or sha in seen:
+                continue
+            seen.add(sha)
+            yield sha, b"blob", name
+
+
+def cache_tree_roots(index: GitIndex) -> List[Tuple[str, str]]:
+    # Trees the cache-tree of the index holds on to, which a commit may reuse
+    # without looking at them again, so they must survive a gc. A valid
+    # directory covers every directory below it.
+    roots: List[Tuple[str, str]] = []
+    pending: List[Tuple[str, GitCacheTree]] = []
+    if index.cache_tree is not None:
+        pending.append(("", index.cache_tree))
+    while pending:
+        path, node = pending.pop()
+        if node.is_valid():
+            assert node.sha is not None
+            roots.append((node.sha, path))
+            continue
+        for name, child in reversed(node.children.items()):
+            pending.append((os.path.join(path, name), child))
+    return roots
+
+
+class ReachableObjects:
+    def __init__(
+        self,
+        bitmap_index: Optional[GitBitmapIndex],
+        bits: int,
+        extra: ExtraObjects,
+    ) -> None:
+        self.bitmap_index = bitmap_index
+        self.bits = bits
+        self.extra = extra
+        self._bytes: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return self.bits.bit_count() + len(self.extra)
+
+    def __contains__(self, sha: str) -> bool:
+        if sha in self.extra:
+            return True
+        if self.bitmap_index is None:
+            return False
+
+        pos = self.bitmap_index.position(sha)
+        if pos is None:
+            return False
+        if self._bytes is None:
+            size = (len(self.bitmap_index) + 7) // 8
+            self._bytes = self.bits.to_bytes(size, "little")
+        return bool(self._bytes[pos >> 3] & (1 << (pos & 7)))
+
+    def count(self, fmt: bytes) -> int:
+        total = sum(1 for obj_fmt, _ in self.extra.values() if obj_fmt == fmt)
+        if self.bitmap_index is not None:
+            total += (self.bits & self.bitmap_index.types[fmt]).bit_count()
+        return total
+
+    def objects(self, fmt: Optional[bytes] = None) -> Iterator[EnumeratedObject]:
+        bitmap_index = self.bitmap_index
+        if bitmap_index is not None:
+            for obj_fmt in TYPE_ORDER:
+                if fmt is not None and obj_fmt != fmt:
+                    continue
+                for pos in set_bits(self.bits & bitmap_index.types[obj_fmt]):
+                    sha = bitmap_index.oid(pos).hex()
+                    yield sha, obj_fmt, bitmap_index.name_hash(pos)
+
+        for sha, (obj_fmt, hash_value) in self.extra.items():
+            if fmt is None or obj_fmt == fmt:
+                yield sha, obj_fmt, hash_value
+
+    def difference(self, other: ReachableObjects) -> ReachableObjects:
+        extra = {sha: value for sha, value in self.extra.items() if sha not in other}
+        return ReachableObjects(self.bitmap_index, self.bits & ~other.bits, extra)
+
+
+def walk_uncovered(
+    repo: GitRepository,
+    tips: List[str],
+    position: Callable[[str], Optional[int]],
+    bitmap: Callable[[str], Optional[int]],
+    covered: int,
+    size: int,
+) -> Tuple[int, ExtraObjects]:
+    # Marks everything reachable from the tips that is not covered yet. A
+    # commit with a bitmap of its own is taken in whole instead of walked,
+    # and a marked tree is never entered again, as all it contains is marked
+    nbytes = (size + 7) // 8
+    seen = bytearray(covered.to_bytes(nbytes, "little"))
+    extra: ExtraObjects = {}
+
+    def is_marked(sha: str) -> bool:
+        pos = position(sha)
+        if pos is None:
+            return sha in extra
+        return bool(seen[pos >> 3] & (1 << (pos & 7)))
+
+    def mark(sha: str, fmt: bytes, path: str) -> bool:
+        pos = position(sha)
+        if pos is None:
+            if sha in extra:
+                return False
+            extra[sha] = (fmt, name_hash(path))
+            return True
+
+        mask = 1 << (pos & 7)
+        if seen[pos >> 3] & mask:
+            return False
+        seen[pos >> 3] |= mask
+        return True
+
+    commits: List[str] = []
+    trees: List[Tuple[str, str]] = []
+    for tip in tips:
+        sha: Optional[str] = tip
+        fmt, _ = repo.objects.read_header(tip)
+        while sha is not None and fmt == b"tag":
+            if not mark(sha, fmt, ""):
+                sha = None
+                break
+            tag = repo.objects.read(sha)
+            assert isinstance(tag, GitTag)
+            target = tag.kvlm.get_one(b"object")
+            if target is None:
+                raise ValueError(f"invalid tag {sha}: no object")
+            sha = target.decode("ascii")
+            fmt, _ = repo.objects.read_header(sha)
+
+        if sha is None:
+            continue
+        if fmt == b"commit":
+            commits.append(sha)
+        elif fmt == b"tree":
+            trees.append((sha, ""))
+        else:
+            mark(sha, fmt, "")
+
+    pending = list(reversed(commits))
+    while pending:
+        sha = pending.pop()
+        if is_marked(sha):
+            continue
+
+        bits = bitmap(sha)
+        if bits is not None:
+            merged = int.from_bytes(seen, "little") | bits
+            seen[:] = merged.to_bytes(nbytes, "little")
+            continue
+
+        mark(sha, b"commit", "")
+        tree, parents, _, _ = repo.objects.commit_info(sha)
+        trees.append((tree, ""))
+        pending.extend(reversed(parents))
+
+    trees.reverse()
+    while trees:
+        sha, path = trees.pop()
+        if not mark(sha, b"tree", path):
+            continue
+
+        obj = repo.objects.read(sha)
+        assert isinstance(obj, GitTree)
+        for leaf in reversed(obj.items):
+            if leaf.is_gitlink():
+                continue
+            leaf_path = os.path.join(path, leaf.path)
+            if leaf.is_tree():
+                trees.append((leaf.sha, leaf_path))
+            else:
+                mark(leaf.sha, b"blob", leaf_path)
+
+    return int.from_bytes(seen, "little"), extra
+
+
+def find_reachable(
+    repo: GitRepository,
+    tips: List[str],
+    index: Optional[GitIndex] = None,
+) -> ReachableObjects:
+    bitmap_index = repo.objects.bitmap_index
+    if bitmap_index is None:
+        extra = {
+            sha: (fmt, name_hash(path))
+            for sha, fmt, path in list_objects(repo, tips, index)
+        }
+        return ReachableObjects(None, 0, extra)
+
+    # Tips with a bitmap are answered straight from it, and only what the
+    # others reach beyond those bitmaps is walked
+    covered = 0
+    uncovered: List[str] = []
+    for tip in tips:
+        bits = bitmap_index.bitmap(tip)
+        if bits is None:
+            uncovered.append(tip)
+        else:
+            covered |= bits
+
+    if uncovered:
+        bits, extra = walk_uncovered(
+            repo,
+            uncovered,
+            bitmap_index.position,
+            bitmap_index.bitmap,
+            covered,
+            len(bitmap_index),
+        )
+    else:
+        bits, extra = covered, {}
+    reachable = ReachableObjects(bitmap_index, bits, extra)
+
+    if index is not None:
+        roots = [sha for sha, _ in cache_tree_roots(index) if sha not in reachable]
+        for sha, fmt, path in list_objects(repo, roots):
+            if sha not in reachable:
+                extra[sha] = (fmt, name_hash(path))
+        for i, name in enumerate(index.names):
+            sha = index.sha(i)
+            if index.mode_type(i) == 0b1110 or sha in reachable:
+                continue
+            extra[sha] = (b"blob", name_hash(name))
+
+    return reachable
+
+
+def select_bitmap_commits(
+    commits: Dict[str, GraphCommit], tips: List[str]
+) -> List[str]:
+    by_date = sorted(commits, key=lambda sha: commits[sha][2], reverse=True)
+    selected = dict.fromkeys(tips)
+    selected.update(dict.fromkeys(by_date[::BITMAP_COMMIT_INTERVAL]))
+    return list(selected)
+
+
+def write_reachability_bitmaps(
+    repo: GitRepository, pack: GitPack, objects: List[EnumeratedObject]
+) -> str:
+    # Every object reachable from the ref tips has to be in the pack
+    tips: List[str] = []
+    for tip in ref_tips(repo):
+        commit = peel_to_commit(repo, tip)
+        if commit is not None:
+            tips.append(commit)
+    commits = list_commits(repo, tips)
+    generations = compute_generations(commits)
+
+    size = len(pack)
+    positions = pack_positions(pack)
+
+    def position(sha: str) -> Optional[int]:
+        n = pack.position(sha)
+        return None if n is None else positions[n]
+
+    types = {fmt: bytearray((size + 7) // 8) for fmt in TYPE_ORDER}
+    name_hashes = [0] * size
+    for sha, fmt, hash_value in objects:
+        n = pack.position(sha)
+        if n is None:
+            continue
+        pos = positions[n]
+        types[fmt][pos >> 3] |= 1 << (pos & 7)
+        name_hashes[n] = hash_value
+
+    # Ancestors first, so that each walk stops at the bitmaps already built
+    selected = select_bitmap_commits(commits, tips)
+    selected.sort(key=generations.__getitem__)
+
+    bitmaps: Dict[str, int] = {}
+    for sha in selected:
+        bits, missing = walk_uncovered(repo, [sha], position, bitmaps.get, 0, size)
+        if missing:
+            raise ValueError(
+                f"cannot write bitmaps: {next(iter(missing))} is not in the pack"
+            )
+        bitmaps[sha] = bits
+
+    # The walks above found every selected commit in the pack
+    commit_bitmaps: List[Tuple[int, int]] = []
+    for sha, bits in bitmaps.items():
+        n = pack.position(sha)
+        if n is None:
+            raise ValueError(f"cannot write bitmaps: {sha} is not in the pack")
+        commit_bitmaps.append((n, bits))
+
+    write_reverse_index(pack)
+    return write_bitmap_index(
+        pack,
+        {fmt: int.from_bytes(bits, "little") for fmt, bits in types.items()},
+        commit_bitmaps,
+        name_hashes,
+    )
+
+
+def changed_path_filters(
+    repo: GitRepository, commits: Dict[str, GraphCommit]
+) -> Dict[str, bytes]:
+    graph = repo.objects.commit_graph
+    reuse = (
+        graph is not None
+        and graph.bloom_version == BLOOM_VERSION
+        and graph.bloom_num_hashes == BLOOM_NUM_HASHES
+    )
+
+    filters: Dict[str, bytes] = {}
+    for sha, (tree, parents, _) in commits.items():
+        if reuse:
+            assert graph is not None
+            n = graph.find(sha)
+            if n is not None:
+                filters[sha] = bytes(graph.bloom_filter(n) or b"")
+                continue
+
+        # Filters describe the changes against the first parent only
+        parent_tree = repo.objects.commit_info(parents[0])[0] if parents else None
+        filters[sha] = build_bloom_filter(changed_paths(repo, parent_tree, tree))
+
+    return filters
+
+
+def write_reachable_commit_graph(
+    repo: GitRepository, changed_paths: Optional[bool] = None
+) -> Optional[str]:
+    if changed_paths is None:
+        # Keep changed-path filters if the current graph already has them
+        graph = repo.objects.commit_graph
+        changed_paths = graph is not None and graph.bloom_version != 0
+
+    commits = list_commits(repo, ref_tips(repo))
+    filters = changed_path_filters(repo, commits) if changed_paths else None
+
+    path = write_commit_graph(repo.fs.resolve("objects"), commits, filters)
+    repo.objects.reload_commit_graph()
+    return path
@@ -0,0 +1,296 @@
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from .config import get_size_from_config
+from .delta import create_delta
+from .index import GitIndex
+from .midx import MIDX_FILE, write_multi_pack_index
+from .objects import GitObjects
+from .pack import TYPE_NUMBERS, GitPack, PackEntry, write_pack
+from .reachability import (
+    ReachableObjects,
+    find_reachable,
+    ref_tips,
+    write_reachability_bitmaps,
+    write_reachable_commit_graph,
+)
+from .repository import GitRepository
+from .revision import parse_date
+
+DEFAULT_WINDOW = 10
+DEFAULT_DEPTH = 50
+DEFAULT_BIG_FILE_THRESHOLD = 512 * 1024 * 1024
+DEFAULT_PRUNE_EXPIRE = "2.weeks.ago"
+
+# Objects this small are cheaper to store whole than as a delta
+MIN_DELTA_SIZE = 50
+
+# (base sha, delta against that base)
+Delta = Tuple[str, bytes]
+
+
+class PackObject:
+    def __init__(self, sha: str, fmt: bytes, name_hash: int, size: int):
+        self.sha = sha
+        self.fmt = fmt
+        self.name_hash = name_hash
+        self.size = size
+
+
+class RepackResult:
+    def __init__(self, path: str, total: int, deltas: int):
+        self.path = path
+        self.total = total
+        self.deltas = deltas
+
+
+def find_deltas(
+    objects: GitObjects,
+    candidates: List[PackObject],
+    window: int,
+    depth: int,
+    big_file_threshold: int,
+) -> Dict[str, Delta]:
+    deltas: Dict[str, Delta] = {}
+    depths: Dict[str, int] = {}
+    recent: Deque[Tuple[PackObject, bytes]] = deque(maxlen=window)
+
+    for obj in candidates:
+        if obj.size < MIN_DELTA_SIZE or obj.size > big_file_threshold:
+            continue
+
+        _, data = objects.read_raw(obj.sha)
+
+        best: Optional[Delta] = None
+        max_size = obj.size // 2 - 20
+
+        for base, base_data in reversed(recent):
+            if base.fmt != obj.fmt or depths.get(base.sha, 0) >= depth:
+                continue
+            if abs(base.size - obj.size) >= max_size:
+                continue
+
+            delta = create_delta(base_data, data, max_size)
+            if delta is not None:
+                best = (base.sha, delta)
+                max_size = len(delta) - 1
+
+        if best is not None:
+            deltas[obj.sha] = best
+            depths[obj.sha] = depths.get(best[0], 0) + 1
+
+        recent.append((obj, data))
+
+    return deltas
+
+
+_worker_objects: Optional[GitObjects] = None
+
+
+def _init_worker(worktree: str, gitdir: str) -> None:
+    global _worker_objects
+    _worker_objects = GitRepository(worktree, gitdir).objects
+
+
+def _find_deltas_worker(
+    args: Tuple[List[PackObject], int, int, int],
+) -> Dict[str, Delta]:
+    assert _worker_objects is not None
+    return find_deltas(_worker_objects, *args)
+
+
+def search_deltas(
+    repo: GitRepository,
+    candidates: List[PackObject],
+    window: int,
+    depth: int,
+    jobs: int,
+    big_file_threshold: int,
+) -> Dict[str, Delta]:
+    if jobs <= 1 or len(candidates) < jobs * max(window, 1) * 4:
+        return find_deltas(repo.objects, candidates, window, depth, big_file_threshold)
+
+    # Every worker searches its own contiguous slice of the sorted list, so
+    # only objects on either side of a slice boundary miss out on a base
+    segment = ceil(len(candidates) / jobs)
+    work = [
+        (candidates[i : i + segment], window, depth, big_file_threshold)
+        for i in range(0, len(candidates), segment)
+    ]
+
+    deltas: Dict[str, Delta] = {}
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(repo.worktree, repo.gitdir),
+    ) as pool:
+        for result in pool.map(_find_deltas_worker, work):
+            deltas.update(result)
+
+    return deltas
+
+
+def repack(
+    repo: GitRepository,
+    all_objects: bool = False,
+    delete: bool = False,
+    window: Optional[int] = None,
+    depth: Optional[int] = None,
+    jobs: Optional[int] = None,
+    write_bitmaps: Optional[bool] = None,
+    loosen_unreachable: bool = False,
+) -> Optional[RepackResult]:
+    config = repo.config
+    if window is None:
+        window = config.getint("pack", "window", fallback=DEFAULT_WINDOW)
+    if depth is None:
+        depth = config.getint("pack", "depth", fallback=DEFAULT_DEPTH)
+    if jobs is None:
+        jobs = config.getint("pack", "threads", fallback=0)
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    big_file_threshold = get_size_from_config(
+        config, "core", "bigFileThreshold", fallback=DEFAULT_BIG_FILE_THRESHOLD
+    )
+    if write_bitmaps is None:
+        # Like git, only bare repositories write bitmaps unless configured
+        bare = config.getboolean("core", "bare", fallback=False)
+        write_bitmaps = config.getboolean("repack", "writeBitmaps", fallback=bare)
+    # Bitmaps need every reachable object in the one pack they describe
+    write_bitmaps = write_bitmaps and all_objects
+
+    index = GitIndex.read(repo)
+
+    candidates: List[PackObject] = []
+    reachable = find_reachable(repo, ref_tips(repo), index)
+    for sha, fmt, hash_value in reachable.objects():
+        if not all_objects and repo.objects.is_packed(sha):
+            continue
+        _, size = repo.objects.read_header(sha)
+        candidates.append(PackObject(sha, fmt, hash_value, size))
+
+    if not candidates:
+        return None
+
+    candidates.sort(key=lambda o: (TYPE_NUMBERS[o.fmt], o.name_hash, -o.size))
+
+    deltas = search_deltas(repo, candidates, window, depth, jobs, big_file_threshold)
+
+    def entries() -> Iterator[PackEntry]:
+        for obj in candidates:
+            delta = deltas.get(obj.sha)
+            if delta is not None:
+                yield obj.sha, TYPE_NUMBERS[obj.fmt], delta[1], delta[0]
+            else:
+                _, data = repo.objects.read_raw(obj.sha)
+                yield obj.sha, TYPE_NUMBERS[obj.fmt], data, None
+
+    old_packs = [pack.path for pack in repo.objects.packs]
+    path = write_pack(repo.fs.resolve("objects", "pack"), len(candidates), entries())
+    repo.objects.reload_packs()
+
+    if write_bitmaps:
+        pack = next(p for p in repo.objects.packs if p.path == path)
+        write_reachability_bitmaps(
+            repo, pack, [(o.sha, o.fmt, o.name_hash) for o in candidates]
+        )
+        repo.objects.reload_packs()
+
+    if delete:
+        if all_objects:
+            if loosen_unreachable:
+                packs = [p for p in repo.objects.packs if p.path in old_packs]
+                loosen_objects(repo, packs, reachable)
+            for old_path in old_packs:
+                if old_path != path:
+                    remove_pack(old_path)
+            repo.objects.reload_packs()
+        prune_packed(repo)
+
+    # Keep an existing multi-pack-index in sync with the new set of packs
+    pack_dir = repo.fs.resolve("objects", "pack")
+    if os.path.exists(os.path.join(pack_dir, MIDX_FILE)):
+        write_multi_pack_index(pack_dir, repo.objects.packs)
+        repo.objects.reload_packs()
+
+    return RepackResult(path, len(candidates), len(deltas))
+
+
+def remove_pack(path: str) -> None:
+    for ext in (".idx", ".pack", ".rev", ".bitmap"):
+        if os.path.exists(path + ext):
+            os.remove(path + ext)
+
+
+def loosen_objects(
+    repo: GitRepository, packs: List[GitPack], reachable: ReachableObjects
+) -> int:
+    # Unreachable objects in packs about to be deleted are written out loose,
+    # dated like their pack, so that prune only drops them once they are
+    # older than gc.pruneExpire
+    loosened = 0
+    for pack in packs:
+        mtime = os.path.getmtime(pack.path + ".pack")
+        for oid, _ in pack.iter_entries():
+            sha = oid.hex()
+            if sha in reachable or repo.fs.file_exists("objects", sha[:2], sha[2:]):
+                continue
+            fmt, data = repo.objects.read_raw(sha)
+            repo.objects.write_stream(fmt, io.BytesIO(data), len(data))
+            os.utime(repo.objects.file(sha), (mtime, mtime))
+            loosened += 1
+    return loosened
+
+
+def prune_packed(repo: GitRepository) -> int:
+    pruned = 0
+    for sha in list(repo.objects.iter_loose()):
+        if repo.objects.is_packed(sha):
+            repo.objects.remove_loose(sha)
+            pruned += 1
+    return pruned
+
+
+def parse_expiry(value: str) -> Optional[float]:
+    if value.strip().lower() == "never":
+        return None
+
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise ValueError(f"malformed expiration date '{value}'")
+
+
+def prune_unreachable(repo: GitRepository, expire: Optional[float]) -> int:
+    if expire is None:
+        return 0
+
+    index = GitIndex.read(repo)
+    reachable = find_reachable(repo, ref_tips(repo), index)
+
+    pruned = 0
+    for sha in list(repo.objects.iter_loose()):
+        if sha in reachable:
+            continue
+        if os.path.getmtime(repo.objects.file(sha)) < expire:
+            repo.objects.remove_loose(sha)
+            pruned += 1
+    return pruned
+
+
+def gc(repo: GitRepository, prune: Optional[str] = None) -> Optional[RepackResult]:
+    if prune is None:
+        prune = repo.config.get("gc", "pruneExpire", fallback=DEFAULT_PRUNE_EXPIRE)
+    expire = parse_expiry(prune)
+
+    result = repack(repo, all_objects=True, delete=True, loosen_unreachable=True)
+    prune_unreachable(repo, expire)
+
+    if repo.config.getboolean("gc", "writeCommitGraph", fallback=True):
+        write_reachable_commit_graph(repo)
+
+    return result
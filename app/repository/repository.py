@@ -4,7 +4,7 @@ import os
 from configparser import ConfigParser
 from typing import Dict, Optional, Union
 
-from .config import default_config, read_all_configs
+from .config import default_config, read_all_configs, write_config
 from .filesystem import GitFilesystem
 from .objects import GitObjects
 from .references import GitReferences
@@ -29,7 +29,7 @@ class GitRepository:
 
         self.fs = GitFilesystem(self.worktree, self.gitdir)
         self.refs = GitReferences(self.fs)
-        self.objects = GitObjects(self.fs, self.refs)
+        self.objects = GitObjects(self.fs, self.refs, self.config)
 
     @classmethod
     def _create_initial_structure(cls, worktree: str, gitdir: str):
@@ -51,7 +51,7 @@ class GitRepository:
 
         config_path = fs.resolve("config")
         with open(config_path, "w", encoding="utf-8") as config_file:
-            default_config().write(config_file)
+            write_config(default_config(), config_file)
 
     @classmethod
     def init(cls, path: str) -> GitRepository:
@@ -0,0 +1,153 @@
+import heapq
+import re
+import time
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
+
+from .bloom import bloom_contains, bloom_key, leading_paths
+from .commit import path_differs
+from .repository import GitRepository
+
+DATE_UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 604800,
+    "month": 2592000,
+    "year": 31536000,
+}
+
+RELATIVE_DATE_RE = re.compile(
+    r"^(\d+)[. ](second|minute|hour|day|week|month|year)s?[. ]ago$"
+)
+
+
+def parse_date(value: str) -> int:
+    value = value.strip().lower()
+
+    if value == "now":
+        return int(time.time())
+
+    match = re.match(r"^@?(\d+)$", value)
+    if match:
+        return int(match.group(1))
+
+    match = RELATIVE_DATE_RE.match(value)
+    if match:
+        return int(time.time()) - int(match.group(1)) * DATE_UNITS[match.group(2)]
+
+    try:
+        # Dates without a timezone are taken as local time, like git does
+        return int(datetime.fromisoformat(value.upper()).timestamp())
+    except ValueError:
+        raise ValueError(f"malformed date '{value}'")
+
+
+def walk_commits(
+    repo: GitRepository,
+    starts: List[str],
+    first_parent: bool = False,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    paths: Optional[List[str]] = None,
+) -> Iterator[str]:
+    # Newest commit first, ties broken by the order commits were queued in,
+    # which is the order git log uses when no other ordering is asked for
+    queue: List[Tuple[int, int, str, str, List[str]]] = []
+    queued: Set[str] = set()
+    limit = PathLimit(repo, paths) if paths else None
+
+    def push(sha: str) -> None:
+        tree, parents, _, date = repo.objects.commit_info(sha)
+        queued.add(sha)
+        heapq.heappush(queue, (-date, len(queued), sha, tree, parents))
+
+    for sha in starts:
+        if sha not in queued:
+            push(sha)
+
+    while queue:
+        negative_date, _, sha, tree, parents = heapq.heappop(queue)
+        date = -negative_date
+
+        if since is not None and date < since:
+            # Everything reachable from here is normally older still, so
+            # its ancestry is not walked at all
+            continue
+
+        if first_parent:
+            parents = parents[:1]
+
+        show = True
+        if limit is not None:
+            show, parents = limit.simplify(sha, tree, parents)
+
+        for parent in parents:
+            if parent not in queued:
+                push(parent)
+
+        if show and (until is None or date <= until):
+            yield sha
+
+
+class PathLimit:
+    def __init__(self, repo: GitRepository, paths: List[str]):
+        self.repo = repo
+        self.paths = paths
+
+        # Bloom keys for each path and its leading directories; a filter has
+        # to contain all of them for the path to have possibly changed
+        self.graph = repo.objects.commit_graph
+        self.keys: List[List[List[int]]] = []
+        if self.graph is not None and self.graph.bloom_version:
+            version = self.graph.bloom_version
+            num_hashes = self.graph.bloom_num_hashes
+            for path in paths:
+                if version == 1 and not path.isascii():
+                    # Version 1 filters hash non-ASCII paths differently per platform
+                    self.keys = []
+                    break
+                self.keys.append(
+                    [bloom_key(p, num_hashes, version) for p in leading_paths(path)]
+                )
+
+    def unchanged_by_bloom(self, sha: str) -> bool:
+        if not self.keys:
+            return False
+        assert self.graph is not None
+
+        n = self.graph.find(sha)
+        if n is None:
+            return False
+        data = self.graph.bloom_filter(n)
+        if data is None:
+            return False
+
+        return not any(
+            all(bloom_contains(data, key) for key in path_keys)
+            for path_keys in self.keys
+        )
+
+    def differs(self, old_tree: Optional[str], new_tree: str) -> bool:
+        return any(
+            path_differs(self.repo, old_tree, new_tree, path) for path in self.paths
+        )
+
+    def simplify(
+        self, sha: str, tree: str, parents: List[str]
+    ) -> Tuple[bool, List[str]]:
+        # Like git's default history simplification: a commit that leaves the
+        # paths as one of its parents had them is hidden, and only that
+        # parent is followed
+        if not parents:
+            return self.differs(None, tree), parents
+
+        for i, parent in enumerate(parents):
+            if i == 0 and self.unchanged_by_bloom(sha):
+                return False, [parent]
+            parent_tree = self.repo.objects.commit_info(parent)[0]
+            if not self.differs(parent_tree, tree):
+                return False, [parent]
+
+        return True, parents
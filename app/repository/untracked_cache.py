@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from .ewah import encode_ewah, read_ewah, set_bits
+from .varint import decode_varint, encode_varint
+
+# The UNTR index extension, in the format git uses. It remembers, for every
+# directory of the worktree, its stat data, the oid of its .gitignore and the
+# untracked files found in it. As long as a directory's stat data and the
+# ignore rules that apply to it are unchanged, the files in it are too, and
+# the directory does not have to be read again.
+UNTRACKED_CACHE_SIGNATURE = b"UNTR"
+EXCLUDE_PER_DIR = ".gitignore"
+
+# ctime, mtime, dev, ino, uid, gid and size, like an index entry without mode
+STAT_DATA = struct.Struct(">9I")
+SHA_SIZE = 20
+NULL_OID = b"\x00" * SHA_SIZE
+
+# Untracked files are listed one by one, never as whole untracked directories
+DIR_FLAGS = 0
+
+StatData = Tuple[int, ...]
+NULL_STAT: StatData = (0,) * 9
+
+# Stat data and oid of a file the ignore rules are read from
+FileState = Tuple[StatData, bytes]
+
+
+def stat_data(stat: os.stat_result) -> StatData:
+    # Fields are stored truncated to 32 bits, as in index entries
+    return tuple(
+        value & 0xFFFFFFFF
+        for value in (
+            stat.st_ctime_ns // 10**9,
+            stat.st_ctime_ns % 10**9,
+            stat.st_mtime_ns // 10**9,
+            stat.st_mtime_ns % 10**9,
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_uid,
+            stat.st_gid,
+            stat.st_size,
+        )
+    )
+
+
+def untracked_ident(worktree: str) -> bytes:
+    # A cache is only valid for the worktree and system it was made on
+    return f"Location {worktree}, system {os.uname().sysname}".encode("utf8") + b"\x00"
+
+
+class GitUntrackedDir:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # Whether stat and untracked describe the directory as last read
+        self.valid = False
+        self.check_only = False
+        self.stat: StatData = NULL_STAT
+        # The .gitignore the untracked files were filtered with, if any
+        self.exclude_oid: Optional[bytes] = None
+        self.untracked: List[str] = []
+        self.dirs: Dict[str, GitUntrackedDir] = {}
+
+    def invalidate(self) -> None:
+        self.valid = False
+        self.untracked = []
+
+
+class GitUntrackedCache:
+    def __init__(self, ident: bytes, dir_flags: int = DIR_FLAGS) -> None:
+        self.ident = ident
+        self.dir_flags = dir_flags
+        self.info_exclude: FileState = (NULL_STAT, NULL_OID)
+        self.excludes_file: FileState = (NULL_STAT, NULL_OID)
+        self.exclude_per_dir = EXCLUDE_PER_DIR
+        self.root: Optional[GitUntrackedDir] = None
+        # Set when the cache differs from what was read from the index
+        self.changed = False
+
+    def reset(self) -> None:
+        self.root = None
+        self.changed = True
+
+    def invalidate(self, path: str) -> None:
+        # A path entering or leaving the index changes whether it is
+        # untracked, without changing the stat data of its directory
+        node = self.root
+        for part in path.split("/")[:-1]:
+            if node is None:
+                return
+            node = node.dirs.get(part)
+        if node is not None and node.valid:
+            node.invalidate()
+            self.changed = True
+
+    @classmethod
+    def parse(cls, data: bytes) -> GitUntrackedCache:
+        ident_size, pos = decode_varint(data, 0)
+        cache = cls(data[pos : pos + ident_size])
+        pos += ident_size
+
+        info_exclude_stat = STAT_DATA.unpack_from(data, pos)
+        pos += STAT_DATA.size
+        excludes_file_stat = STAT_DATA.unpack_from(data, pos)
+        pos += STAT_DATA.size
+        cache.dir_flags = struct.unpack_from(">I", data, pos)[0]
+        pos += 4
+        cache.info_exclude = (info_exclude_stat, data[pos : pos + SHA_SIZE])
+        pos += SHA_SIZE
+        cache.excludes_file = (excludes_file_stat, data[pos : pos + SHA_SIZE])
+        pos += SHA_SIZE
+        end = data.index(b"\x00", pos)
+        cache.exclude_per_dir = data[pos:end].decode("utf8")
+        pos = end + 1
+
+        count, pos = decode_varint(data, pos)
+        if not count:
+            return cache
+
+        # Directories come depth first, followed by everything that is
+        # stored for them as a whole: bitmaps, then stat data and oids
+        dirs: List[GitUntrackedDir] = []
+        cache.root, pos = cls._parse_dir(data, pos, dirs)
+        if len(dirs) != count:
+            raise ValueError("Corrupt untracked cache extension in index")
+
+        valid, pos = read_ewah(data, pos)
+        check_only, pos = read_ewah(data, pos)
+        exclude_valid, pos = read_ewah(data, pos)
+
+        for n in set_bits(check_only):
+            dirs[n].check_only = True
+        for n in set_bits(valid):
+            dirs[n].valid = True
+            dirs[n].stat = STAT_DATA.unpack_from(data, pos)
+            pos += STAT_DATA.size
+        for n in set_bits(exclude_valid):
+            dirs[n].exclude_oid = data[pos : pos + SHA_SIZE]
+            pos += SHA_SIZE
+
+        if pos + 1 != len(data):
+            raise ValueError("Corrupt untracked cache extension in index")
+
+        return cache
+
+    @classmethod
+    def _parse_dir(
+        cls, data: bytes, pos: int, dirs: List[GitUntrackedDir]
+    ) -> Tuple[GitUntrackedDir, int]:
+        untracked_count, pos = decode_varint(data, pos)
+        dir_count, pos = decode_varint(data, pos)
+
+        end = data.index(b"\x00", pos)
+        node = GitUntrackedDir(data[pos:end].decode("utf8"))
+        dirs.append(node)
+        pos = end + 1
+
+        for _ in range(untracked_count):
+            end = data.index(b"\x00", pos)
+            node.untracked.append(data[pos:end].decode("utf8"))
+            pos = end + 1
+
+        for _ in range(dir_count):
+            child, pos = cls._parse_dir(data, pos, dirs)
+            node.dirs[child.name] = child
+
+        return node, pos
+
+    def encode(self) -> bytes:
+        parts = [
+            encode_varint(len(self.ident)),
+            self.ident,
+            STAT_DATA.pack(*self.info_exclude[0]),
+            STAT_DATA.pack(*self.excludes_file[0]),
+            struct.pack(">I", self.dir_flags),
+            self.info_exclude[1],
+            self.excludes_file[1],
+            self.exclude_per_dir.encode("utf8") + b"\x00",
+        ]
+        if self.root is None:
+            parts.append(encode_varint(0))
+            return b"".join(parts)
+
+        dirs: List[GitUntrackedDir] = []
+        blocks: List[bytes] = []
+        self._encode_dir(self.root, dirs, blocks)
+
+        valid = check_only = exclude_valid = 0
+        stats: List[bytes] = []
+        oids: List[bytes] = []
+        for n, node in enumerate(dirs):
+            if node.valid:
+                valid |= 1 << n
+                stats.append(STAT_DATA.pack(*node.stat))
+            if node.check_only:
+                check_only |= 1 << n
+            if node.exclude_oid is not None:
+                exclude_valid |= 1 << n
+                oids.append(node.exclude_oid)
+
+        parts += [encode_varint(len(dirs)), *blocks]
+        parts += [encode_ewah(bits) for bits in (valid, check_only, exclude_valid)]
+        parts += [*stats, *oids, b"\x00"]
+        return b"".join(parts)
+
+    def _encode_dir(
+        self, node: GitUntrackedDir, dirs: List[GitUntrackedDir], blocks: List[bytes]
+    ) -> None:
+        dirs.append(node)
+        blocks.append(encode_varint(len(node.untracked)))
+        blocks.append(encode_varint(len(node.dirs)))
+        blocks.append(node.name.encode("utf8") + b"\x00")
+        blocks.extend(name.encode("utf8") + b"\x00" for name in node.untracked)
+        for child in node.dirs.values():
+            self._encode_dir(child, dirs, blocks)
@@ -0,0 +1,27 @@
+from typing import Tuple
+
+# The variable-length integers of the index file: seven bits per byte, most
+# significant group first, with each continuation adding one so that every
+# value has a single encoding. Pack files use the same scheme for the base
+# offsets of deltas.
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    c = data[pos]
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7F)
+    return value, pos
+
+
+def encode_varint(value: int) -> bytes:
+    result = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        value -= 1
+        result.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(result))
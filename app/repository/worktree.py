@@ -0,0 +1,275 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from .commit import Change
+from .fsmonitor import query_fsmonitor
+from .ignore import GitIgnore, global_ignore_path
+from .index import GitIndex
+from .objects import GitObjects
+from .repository import GitRepository
+from .untracked_cache import (
+    DIR_FLAGS,
+    EXCLUDE_PER_DIR,
+    NULL_OID,
+    NULL_STAT,
+    FileState,
+    GitUntrackedCache,
+    GitUntrackedDir,
+    stat_data,
+    untracked_ident,
+)
+
+FALSE_VALUES = ("false", "no", "off", "0")
+TRUE_VALUES = ("true", "yes", "on", "1")
+
+# Like git's core.preloadIndex: entries are checked by up to this many
+# threads, each given at least a shard of this many entries
+PRELOAD_MAX_THREADS = 20
+PRELOAD_ENTRIES_PER_THREAD = 500
+
+# Stat data of the file of an entry, or None if it is gone, and the sha of
+# its contents when the stat data did not match and it had to be hashed
+EntryCheck = Tuple[Optional[os.stat_result], Optional[str]]
+
+
+def check_entry(worktree: str, index: GitIndex, i: int) -> EntryCheck:
+    full_path = os.path.join(worktree, index.names[i])
+    try:
+        stat = os.lstat(full_path)
+    except OSError:
+        return None, None
+
+    # A racily clean entry has to be compared by contents
+    if index.matches_stat(i, stat) and not index.is_racy(index.times(i)[1]):
+        return stat, None
+
+    try:
+        return stat, GitObjects.hash_path(full_path, stat)
+    except OSError:
+        return None, None
+
+
+def preload_index(
+    repo: GitRepository, index: GitIndex, indices: List[int]
+) -> List[EntryCheck]:
+    # The entries are split into contiguous shards so that each thread stays
+    # within a few directories; their stat and read calls overlap, which is
+    # what matters on network filesystems and with cold caches. Results come
+    # back in the order of indices.
+    setting = repo.config.get("core", "preloadIndex", fallback="true").lower()
+    threads = min(PRELOAD_MAX_THREADS, len(indices) // PRELOAD_ENTRIES_PER_THREAD)
+    if setting in FALSE_VALUES or threads <= 1:
+        return [check_entry(repo.worktree, index, i) for i in indices]
+
+    size = -(-len(indices) // threads)
+    shards = [indices[n : n + size] for n in range(0, len(indices), size)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        checked = pool.map(
+            lambda shard: [check_entry(repo.worktree, index, i) for i in shard],
+            shards,
+        )
+        return [check for shard in checked for check in shard]
+
+
+def refresh_fsmonitor(repo: GitRepository, index: GitIndex) -> bool:
+    # Asks the daemon what changed since the token kept in the index, so that
+    # only those entries have to be looked at; returns whether the fsmonitor
+    # state of the index changed. Without a daemon every entry is checked.
+    had_token = index.fsmonitor_token is not None
+    enabled = repo.config.get("core", "fsmonitor", fallback="false").lower()
+    if enabled not in TRUE_VALUES:
+        index.clear_fsmonitor()
+        return had_token
+
+    result = query_fsmonitor(repo, index.fsmonitor_token or "")
+    if result is None:
+        index.clear_fsmonitor()
+        return had_token
+
+    token, paths = result
+    if paths is None or not had_token:
+        index.clear_fsmonitor()
+    else:
+        for path in paths:
+            index.invalidate_fsmonitor(path)
+    index.fsmonitor_token = token
+    return True
+
+
+def refresh_index(repo: GitRepository, index: GitIndex) -> Tuple[List[Change], bool]:
+    # Tracked files that were deleted or modified in the worktree, and whether
+    # the index changed and is worth writing back. Entries whose stat data
+    # changed but whose contents did not get the new stat data, so that they
+    # are not hashed again next time.
+    changed = refresh_fsmonitor(repo, index)
+
+    indices = [i for i in range(len(index)) if not index.fsmonitor_valid(i)]
+    checks = preload_index(repo, index, indices)
+
+    changes: List[Change] = []
+    for i, (stat, sha) in zip(indices, checks):
+        if stat is None:
+            changes.append(("deleted", index.names[i]))
+            continue
+
+        if sha is not None:
+            if sha != index.sha(i):
+                changes.append(("modified", index.names[i]))
+                continue
+            index.refresh(i, stat)
+            changed = True
+
+        # Entries the filesystem monitor saw no change to since the last run
+        # are not looked at; the others are marked once they are found clean
+        if index.fsmonitor_token is not None:
+            index.mark_fsmonitor_valid(i)
+            changed = True
+
+    return changes, changed
+
+
+def find_untracked(
+    repo: GitRepository, index: GitIndex, ignore: GitIgnore
+) -> Tuple[List[str], bool]:
+    # Untracked files that are not ignored, and whether the untracked cache
+    # of the index changed so that the index is worth writing back, which the
+    # caller may only do under the index.lock it took before reading. Like git,
+    # core.untrackedCache adds or removes the cache, and an existing cache is
+    # kept up to date when the option is not set.
+    setting = repo.config.get("core", "untrackedCache", fallback="keep").lower()
+    ident = untracked_ident(repo.worktree)
+    changed = False
+
+    cache = index.untracked_cache
+    if setting in FALSE_VALUES:
+        changed = cache is not None
+        index.untracked_cache = cache = None
+    elif cache is not None and (
+        cache.ident != ident
+        or cache.dir_flags != DIR_FLAGS
+        or cache.exclude_per_dir != EXCLUDE_PER_DIR
+    ):
+        # Made somewhere else or with other settings, so start over
+        index.untracked_cache = cache = GitUntrackedCache(ident)
+        changed = True
+    elif cache is None and setting in TRUE_VALUES:
+        index.untracked_cache = cache = GitUntrackedCache(ident)
+        changed = True
+
+    if cache is None:
+        # Without a cache to keep, every directory is read
+        cache = GitUntrackedCache(ident)
+
+    if index.untracked_cache is cache:
+        check_exclude_files(repo, cache)
+
+    if cache.root is None:
+        cache.root = GitUntrackedDir("")
+        cache.changed = True
+
+    files: List[str] = []
+    scan_dir(repo, index, ignore, cache, cache.root, "", False, files)
+
+    return files, changed or (index.untracked_cache is cache and cache.changed)
+
+
+def check_exclude_files(repo: GitRepository, cache: GitUntrackedCache) -> None:
+    # Rules that apply to every directory changing means starting over
+    info_exclude = check_exclude_file(
+        repo.fs.resolve("info", "exclude"), cache.info_exclude
+    )
+    if info_exclude is not None:
+        if info_exclude[1] != cache.info_exclude[1]:
+            cache.reset()
+        cache.info_exclude = info_exclude
+        cache.changed = True
+    excludes_file = check_exclude_file(global_ignore_path(), cache.excludes_file)
+    if excludes_file is not None:
+        if excludes_file[1] != cache.excludes_file[1]:
+            cache.reset()
+        cache.excludes_file = excludes_file
+        cache.changed = True
+
+
+def check_exclude_file(path: str, state: FileState) -> Optional[FileState]:
+    # The new state of a file global ignore rules come from, or None if it
+    # did not change; the file is only hashed when its stat data changed
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        missing = (NULL_STAT, NULL_OID)
+        return missing if state != missing else None
+
+    data = stat_data(stat)
+    if data == state[0]:
+        return None
+    return data, bytes.fromhex(GitObjects.hash_file(path))
+
+
+def scan_dir(
+    repo: GitRepository,
+    index: GitIndex,
+    ignore: GitIgnore,
+    cache: GitUntrackedCache,
+    node: GitUntrackedDir,
+    prefix: str,
+    force: bool,
+    files: List[str],
+) -> None:
+    path = os.path.join(repo.worktree, prefix)
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        node.invalidate()
+        return
+
+    # Rules from a .gitignore apply to everything below it, so when one
+    # changes the whole subtree is read again
+    i = index.find(prefix + EXCLUDE_PER_DIR)
+    exclude_oid = index.oid(i) if i is not None else None
+    if exclude_oid != node.exclude_oid:
+        node.exclude_oid = exclude_oid
+        force = True
+
+    # The mtime of a directory changes whenever an entry is added to it or
+    # removed from it, unless that happened in the tick the index was written
+    data = stat_data(stat)
+    mtime = (data[2], data[3])
+    if force or not node.valid or node.stat != data or index.is_racy(mtime):
+        read_dir(index, ignore, node, path, prefix)
+        node.stat = data
+        cache.changed = True
+
+    files.extend(prefix + name for name in node.untracked)
+    for name, child in node.dirs.items():
+        scan_dir(repo, index, ignore, cache, child, prefix + name + "/", force, files)
+
+
+def read_dir(
+    index: GitIndex, ignore: GitIgnore, node: GitUntrackedDir, path: str, prefix: str
+) -> None:
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        entries = []
+
+    untracked: List[str] = []
+    dirs = {}
+    for entry in entries:
+        name = entry.name
+        if entry.is_dir(follow_symlinks=False):
+            # Nothing below an ignored directory can be untracked, so it is
+            # not descended into at all
+            if name != ".git" and not ignore.check_ignore(prefix + name, is_dir=True):
+                dirs[name] = node.dirs.get(name) or GitUntrackedDir(name)
+        elif index.find(prefix + name) is None and not ignore.check_ignore(
+            prefix + name
+        ):
+            untracked.append(name)
+
+    node.untracked = untracked
+    node.dirs = dirs
+    node.valid = True
+    node.check_only = False
@@ -62,6 +62,24 @@ git cat-file blob b17df541639ec7814a9ad274e177d9f8da1eb951 > ../file2
 cd ..
 cmp file1 file2
 
+step cat-file type and size
+cd left
+"$mgit" cat-file -t b17d > ../file1
+"$mgit" cat-file -s b17d >> ../file1
+cd ../right
+git cat-file -t b17d > ../file2
+git cat-file -s b17d >> ../file2
+cd ..
+cmp file1 file2
+
+step cat-file --batch
+cd left
+printf "b17d\nmissing\n" | "$mgit" cat-file --batch > ../file1
+cd ../right
+printf "b17d\nmissing\n" | git cat-file --batch > ../file2
+cd ..
+cmp file1 file2
+
 step "Create commit (git only, nothing is tested)" 
 cd left
 echo "Aleph" > hebraic-letter.txt
@@ -196,4 +214,87 @@ cd ..
 cmp file1 file2
 
 
+step "add symlink"
+cd left
+ln -s hebraic-letter.txt link
+"$mgit" add link
+git ls-files -s link > ../file1
+"$mgit" status | grep link >> ../file1
+cd ../right
+ln -s hebraic-letter.txt link
+git add link
+git ls-files -s link > ../file2
+# mgit lists the staged link, and nothing unstaged for it
+printf "\t\033[32madded:    link\033[0m\n" >> ../file2
+cd ..
+cmp file1 file2
+
+
+step "log -n, --since and paths"
+cd left
+"$mgit" log -n 1 | grep -o "commit [0-9a-f]\{40\}" > ../file1
+"$mgit" log --since "2009-12-31" | grep -o "commit [0-9a-f]\{40\}" >> ../file1
+"$mgit" log -- a | grep -o "commit [0-9a-f]\{40\}" >> ../file1
+git log -n 1 --format="commit %H" > ../file2
+git log --since "2009-12-31" --format="commit %H" >> ../file2
+git log --format="commit %H" -- a >> ../file2
+cd ..
+cmp file1 file2
+
+step "repack, then read from packs"
+cd left
+"$mgit" repack -a -d > /dev/null
+git verify-pack .git/objects/pack/pack-*.idx > /dev/null
+git fsck --no-dangling
+"$mgit" cat-file commit HEAD > ../file1
+"$mgit" ls-tree HEAD >> ../file1
+"$mgit" cat-file blob "$(git rev-parse HEAD:a/greek_letters)" >> ../file1
+cd ../right
+git cat-file commit HEAD > ../file2
+git ls-tree HEAD >> ../file2
+git cat-file blob "$(git rev-parse HEAD:a/greek_letters)" >> ../file2
+cd ..
+cmp file1 file2
+
+step "commit-graph and multi-pack-index"
+cd left
+"$mgit" commit-graph write --changed-paths > /dev/null
+git commit-graph verify
+"$mgit" commit-graph verify
+"$mgit" multi-pack-index write > /dev/null
+git multi-pack-index verify
+"$mgit" multi-pack-index verify
+"$mgit" log -- a | grep -o "commit [0-9a-f]\{40\}" > ../file1
+git log --format="commit %H" -- a > ../file2
+cd ..
+cmp file1 file2
+
+step gc
+cd left
+"$mgit" gc > /dev/null
+git verify-pack .git/objects/pack/pack-*.idx > /dev/null
+git fsck --no-dangling
+cd ..
+
+step "index v4 with untracked cache and cache tree"
+cd left
+git config index.version 4
+git config core.untrackedCache true
+git config user.name "mgit-tests.sh"
+git config user.email "mgit@example.com"
+echo "Beta" > a/greek_letters
+"$mgit" add a/greek_letters
+"$mgit" commit -m "Commit 3" > /dev/null
+"$mgit" status > /dev/null
+test "$(od -A n -t x1 -j 4 -N 4 .git/index)" = " 00 00 00 04"
+grep -aq TREE .git/index
+grep -aq UNTR .git/index
+git fsck --no-dangling
+test -z "$(git status --porcelain)"
+git write-tree > ../file1
+git rev-parse "HEAD^{tree}" > ../file2
+cd ..
+cmp file1 file2
+
+
 step "SUCCESS"
\ No newline at end of file